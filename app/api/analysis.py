@@ -0,0 +1,221 @@
+"""
+Shared analysis service for ToxidAPI.
+
+Owns the analyzer instance and the result cache, and runs analyzer calls in
+the threadpool so blocking upstream requests never stall the event loop. A
+global semaphore bounds the number of analyzer calls in flight across all
+requests; batch requests additionally bound their own fan-out.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import weakref
+from typing import Dict, Any, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.api.cache import ResultCache, CacheEntry
+from app.api.usage_events import track_cache
+from app.models.result_normalizer import normalize_result
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Concurrency settings
+ANALYZER_CONCURRENCY = int(os.getenv("ANALYZER_CONCURRENCY", "16"))  # analyzer calls in flight, all requests
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # analyzer calls in flight per batch request
+
+# Batch size caps per tier
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "10"))
+PRO_BATCH_MAX_SIZE = int(os.getenv("PRO_BATCH_MAX_SIZE", "500"))
+
+# Initialize the analyzer with API key from environment
+api_key = os.getenv("GEMINI_API_KEY")
+
+# Set up the analyzer - either real Gemini or a mock
+try:
+    if not api_key:
+        logger.warning("GEMINI_API_KEY environment variable is not set. Using mock analyzer.")
+        # Create a mock analyzer for demo purposes
+        class MockAnalyzer:
+            def __init__(self):
+                self.name = "mock-analyzer"
+                
+            def analyze(self, text):
+                """Simple mock analysis based on keywords"""
+                import random
+                
+                # Simple toxicity detection
+                toxicity_score = 0.0
+                toxic_words = ["hate", "idiot", "stupid", "kill", "die", "awful", "terrible"]
+                profanity = ["f***", "s***", "damn", "hell"]
+                
+                text_lower = text.lower()
+                for word in toxic_words:
+                    if word in text_lower:
+                        toxicity_score += 0.2
+                
+                for word in profanity:
+                    if word in text_lower:
+                        toxicity_score += 0.15
+                
+                # Cap at 1.0
+                toxicity_score = min(1.0, toxicity_score)
+                
+                # Simple sentiment analysis
+                sentiment_score = 0.0
+                positive_words = ["good", "great", "excellent", "happy", "love", "wonderful"]
+                negative_words = ["bad", "sad", "angry", "upset", "hate", "terrible"]
+                
+                for word in positive_words:
+                    if word in text_lower:
+                        sentiment_score += 0.2
+                
+                for word in negative_words:
+                    if word in text_lower:
+                        sentiment_score -= 0.2
+                
+                # Limit to -1.0 to 1.0 range
+                sentiment_score = max(-1.0, min(1.0, sentiment_score))
+                
+                # Generate mock result in the AnalysisResponse shape
+                is_toxic = toxicity_score > 0.5
+                return normalize_result({
+                    "toxicity": {
+                        "score": toxicity_score,
+                        "is_toxic": is_toxic,
+                        "detailed_scores": {
+                            "toxicity": toxicity_score,
+                            "severe_toxicity": random.uniform(0, toxicity_score),
+                            "obscene": min(1.0, toxicity_score * 1.2),
+                            "threat": random.uniform(0, toxicity_score),
+                            "insult": random.uniform(0, toxicity_score),
+                            "identity_hate": random.uniform(0, toxicity_score),
+                        }
+                    },
+                    "sentiment": {
+                        "score": sentiment_score,
+                        "label": "POSITIVE" if sentiment_score > 0.25 else ("NEGATIVE" if sentiment_score < -0.25 else "NEUTRAL"),
+                        "emotions": {}
+                    },
+                    "profanity": {
+                        "score": min(1.0, toxicity_score * 1.2),
+                        "is_profane": is_toxic,
+                        "severity": "HIGH" if toxicity_score > 0.7 else ("MEDIUM" if is_toxic else "NONE"),
+                        "categories": {}
+                    },
+                    "sensitivity": {
+                        "score": 0.0,
+                        "is_sensitive": False,
+                        "categories": {}
+                    },
+                    "readability": {},
+                    "flagged_words": {
+                        "count": int(toxicity_score * 10),
+                        "words": [],
+                        "categories": {},
+                        "severity_score": toxicity_score,
+                        "is_severe": is_toxic
+                    }
+                })
+        
+        analyzer = MockAnalyzer()
+    else:
+        # Use the real analyzer if API key is available
+        from app.models.gemini_analyzer import GeminiAnalyzer
+        analyzer = GeminiAnalyzer(api_key)
+except Exception as e:
+    logger.error(f"Error initializing analyzer: {str(e)}")
+    # Fallback to a simple mock analyzer if anything goes wrong
+    class SimpleAnalyzer:
+        def analyze(self, text):
+            return normalize_result({
+                "toxicity": {"score": 0.0, "is_toxic": False, "detailed_scores": {}},
+                "sentiment": {"score": 0.0, "label": "NEUTRAL"},
+                "profanity": {},
+                "sensitivity": {},
+                "readability": {},
+                "flagged_words": {"count": 0, "words": []}
+            })
+    analyzer = SimpleAnalyzer()
+
+# Simple in-memory cache for results, stored with their rendered JSON
+CACHE_MAX_SIZE = 100
+result_cache = ResultCache(CACHE_MAX_SIZE)
+
+# One global semaphore per event loop (tests and benchmarks run several loops)
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+def _analyzer_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(ANALYZER_CONCURRENCY)
+    return semaphore
+
+def batch_limit_for(tier: Optional[str]) -> int:
+    """Maximum batch size for a user tier."""
+    return PRO_BATCH_MAX_SIZE if tier == "pro" else BATCH_MAX_SIZE
+
+async def analyze_text(text: str) -> Tuple[CacheEntry, bool]:
+    """
+    Analyze text, serving from and populating the result cache.
+    
+    Args:
+        text: The text to analyze
+        
+    Returns:
+        Tuple of (cache entry, whether it was a cache hit)
+    """
+    entry = result_cache.get(text)
+    track_cache(entry is not None)
+    if entry is not None:
+        return entry, True
+    
+    async with _analyzer_semaphore():
+        analysis_result = await run_in_threadpool(analyzer.analyze, text)
+    return result_cache.put(text, analysis_result), False
+
+async def analyze_batch(texts: List[Any], concurrency: int = BATCH_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Analyze a batch of texts concurrently, preserving order.
+    
+    Identical texts are analyzed once. Each item reports its own status, so a
+    failing item does not fail the batch.
+    
+    Args:
+        texts: Items to analyze; non-string items are reported as invalid
+        concurrency: Maximum analyzer calls in flight for this batch
+        
+    Returns:
+        One dict per input item with ``status`` ("ok" or "error"), ``processing_time``
+        and either ``entry`` (CacheEntry) or ``error`` (dict with code and message)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def run(text: str) -> Dict[str, Any]:
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                entry, _ = await analyze_text(text)
+                return {"status": "ok", "entry": entry, "processing_time": time.perf_counter() - start_time}
+            except Exception as e:
+                logger.error(f"Error analyzing text in batch: {str(e)}")
+                return {
+                    "status": "error",
+                    "error": {"code": "ANALYSIS_FAILED", "message": str(e)},
+                    "processing_time": time.perf_counter() - start_time,
+                }
+    
+    # Dedupe identical texts within the batch
+    unique = list(dict.fromkeys(text for text in texts if isinstance(text, str)))
+    outcomes = dict(zip(unique, await asyncio.gather(*(run(text) for text in unique))))
+    
+    invalid = {
+        "status": "error",
+        "error": {"code": "INVALID_ITEM", "message": "Batch items must be strings"},
+        "processing_time": 0.0,
+    }
+    return [outcomes[text] if isinstance(text, str) else invalid for text in texts]
@@ -16,6 +16,8 @@ import logging
 from sqlalchemy import inspect
 
 from app.models.database import get_db, DBUser, DBAPIKey
+from app.api import last_used
+from app.api.rate_limiter import invalidate_api_key
 from app.models.user import UserCreate, UserLogin, UserResponse, APIKeyCreate, APIKeyResponse
 
 # Configure logging
@@ -271,6 +273,8 @@ def create_api_key(user_id: str, name: str = "Default", db: Session = Depends(ge
         db.add(db_api_key)
         db.commit()
         db.refresh(db_api_key)
+        # Drop any cached "unknown key" entry so the key works right away
+        invalidate_api_key(api_key)
         
         # Return API key data
         return APIKeyResponse(
@@ -326,6 +330,7 @@ def delete_api_key(key_id: str, user_id: str, db: Session = Depends(get_db)) ->
         # Delete API key
         db.delete(db_api_key)
         db.commit()
+        invalidate_api_key(db_api_key.key)
         return True
     except Exception as e:
         logger.error(f"Error in delete_api_key: {str(e)}")
@@ -353,9 +358,8 @@ def get_api_key(
         if not db_api_key:
             return None
         
-        # Update last used time
-        db_api_key.last_used = datetime.utcnow()
-        db.commit()
+        # Record the use; written to the database in the background
+        last_used.tracker.touch(db_api_key.id)
         
         return db_api_key
     except Exception as e:
@@ -0,0 +1,69 @@
+"""
+In-memory cache of analysis results.
+
+Entries keep the normalized result together with its JSON rendering, so a
+cache hit only appends the per-request ``processing_time`` to stored bytes
+instead of serializing the result again.
+"""
+
+from typing import Any, Dict, Optional
+
+from app.api.responses import render_json
+
+class CacheEntry:
+    """A cached analysis result and its pre-rendered JSON body."""
+    __slots__ = ("result", "body", "_prefix")
+
+    def __init__(self, result: Dict[str, Any], body: bytes):
+        self.result = result
+        # Rendered {**result, "text": ...} without processing_time
+        self.body = body
+        # Body with the closing brace replaced by the processing_time key
+        self._prefix = body[:-1] + b',"processing_time":'
+
+    def render(self, processing_time: float, extra: bytes = b"") -> bytes:
+        """
+        Render the response body with the given processing time.
+        
+        Args:
+            processing_time: Seconds spent serving this request
+            extra: Rendered members to append, e.g. b',"status":"ok"'
+        """
+        # repr() of a finite float is valid JSON
+        return self._prefix + repr(float(processing_time)).encode() + extra + b"}"
+
+class ResultCache:
+    """
+    Bounded text -> CacheEntry map; the oldest entry is evicted first.
+
+    Args:
+        max_size: Maximum number of cached texts
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: Dict[str, CacheEntry] = {}
+
+    def get(self, text: str) -> Optional[CacheEntry]:
+        return self._entries.get(text)
+
+    def put(self, text: str, analysis: Dict[str, Any]) -> CacheEntry:
+        """Cache a normalized analysis result for text and return its entry."""
+        result = {**analysis, "text": text}
+        entry = CacheEntry(result, render_json(result))
+        if text not in self._entries and len(self._entries) >= self.max_size:
+            # Remove oldest entry
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[text] = entry
+        return entry
+
+    def clear(self) -> int:
+        """Remove all entries and return how many there were."""
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def __contains__(self, text: str) -> bool:
+        return text in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
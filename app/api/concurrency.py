@@ -0,0 +1,198 @@
+"""
+Per-client concurrency limits for ToxidAPI.
+
+Rate limits bound how much a client asks for per window, not how much of it
+runs at once: a client within its hourly limit can still open hundreds of
+simultaneous analyses and hold most of the upstream concurrency. Each API
+key (or client IP without one) may therefore only have CONCURRENCY_LIMIT
+analysis requests in flight, PRO_CONCURRENCY_LIMIT for the pro tier. A
+request over the limit waits up to CONCURRENCY_QUEUE_TIMEOUT for a slot,
+then gets a 429 with Retry-After. Slots are taken before the rate limit
+is checked, so a request turned away here costs no rate-limit units.
+
+Slots are counted in Redis when it is available, so the limit holds across
+processes, and per process otherwise or while Redis is down. A slot in Redis
+is a lease that expires after CONCURRENCY_LEASE_TTL unless the request
+holding it renews it, so slots held by a crashed worker free themselves.
+The request handling itself is done by ConcurrencyLimitMiddleware in
+app.core.middleware.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+from app.core.metrics import CONCURRENCY_REJECTIONS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Concurrency settings
+CONCURRENCY_LIMIT = int(os.getenv("CONCURRENCY_LIMIT", "10"))  # in-flight requests per client
+PRO_CONCURRENCY_LIMIT = int(os.getenv("PRO_CONCURRENCY_LIMIT", "50"))
+CONCURRENCY_QUEUE_TIMEOUT = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT", "2"))  # max wait for a slot
+CONCURRENCY_LEASE_TTL = float(os.getenv("CONCURRENCY_LEASE_TTL", "30"))  # seconds a slot outlives its holder
+CONCURRENCY_RETRY_AFTER = int(os.getenv("CONCURRENCY_RETRY_AFTER", "1"))  # seconds, sent with 429s
+
+# Endpoints whose requests take a slot
+LIMITED_PATHS = ("/api/v2/analyze", "/api/v2/v2/analyze", "/api/v2/analyze/batch", "/api/v2/analyze/stream")
+
+# Interval for polling while waiting for a slot
+_POLL_INTERVAL = 0.05
+
+def limit_for_tier(tier: Optional[str]) -> int:
+    """Maximum in-flight requests for a user tier."""
+    return PRO_CONCURRENCY_LIMIT if tier == "pro" else CONCURRENCY_LIMIT
+
+class Lease:
+    """A slot held by one request; pass it back to the semaphore to release it."""
+    def __init__(self, key: str, backend: str):
+        self.key = key
+        self.id = uuid.uuid4().hex
+        self.backend = backend
+        self.renewal: Optional[asyncio.Task] = None
+
+class MemorySemaphores:
+    """In-process slot counts per client; a key is dropped when its last slot is released."""
+    def __init__(self):
+        self._counts: Dict[str, int] = {}
+
+    async def try_acquire(self, key: str, limit: int) -> Optional[Lease]:
+        """Take a slot if one is free; returns the lease, or None if the client is at its limit."""
+        count = self._counts.get(key, 0)
+        if count >= limit:
+            return None
+        self._counts[key] = count + 1
+        return Lease(key, "memory")
+
+    async def release(self, lease: Lease) -> None:
+        count = self._counts.get(lease.key, 0) - 1
+        if count > 0:
+            self._counts[lease.key] = count
+        else:
+            self._counts.pop(lease.key, None)
+
+    def in_flight(self, key: str) -> int:
+        return self._counts.get(key, 0)
+
+class RedisSemaphores:
+    """
+    Slots in Redis, shared by all processes.
+
+    Each client has a sorted set of lease IDs scored by expiry time; acquiring
+    drops expired leases and adds one if fewer than the limit remain, in one
+    Lua script. Holders renew their lease every third of CONCURRENCY_LEASE_TTL.
+    Takes a ``redis.asyncio`` client; while the supervisor reports Redis as
+    unavailable, slots are counted in-process instead.
+    """
+    acquire_script = """
+local limit, now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ttl)
+return 1
+"""
+    renew_script = """
+if not redis.call('ZSCORE', KEYS[1], ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[2]), ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+    def __init__(self, client, supervisor=None, lease_ttl: float = CONCURRENCY_LEASE_TTL):
+        from app.api.redis_supervisor import RedisSupervisor
+        self.client = client
+        self.supervisor = supervisor or RedisSupervisor(client)
+        self.lease_ttl = lease_ttl
+        self.fallback = MemorySemaphores()
+        self._acquire = client.register_script(self.acquire_script)
+        self._renew = client.register_script(self.renew_script)
+
+    def _ttl_ms(self) -> int:
+        return int(self.lease_ttl * 1000)
+
+    async def try_acquire(self, key: str, limit: int) -> Optional[Lease]:
+        """Take a slot if one is free; returns the lease, or None if the client is at its limit."""
+        if self.supervisor.available:
+            lease = Lease(key, "redis")
+            try:
+                acquired = await self._acquire(keys=[key], args=[limit, int(time.time() * 1000), self._ttl_ms(), lease.id])
+                self.supervisor.record_success()
+            except Exception as e:
+                self.supervisor.record_failure(e)
+                logger.error(f"Redis error acquiring concurrency slot: {str(e)}")
+            else:
+                if not acquired:
+                    return None
+                lease.renewal = asyncio.create_task(self._keep_renewed(lease))
+                return lease
+        else:
+            self.supervisor.fallback("concurrency")
+        return await self.fallback.try_acquire(key, limit)
+
+    async def _keep_renewed(self, lease: Lease) -> None:
+        # Extend the lease while the request runs; if renewing fails, the lease
+        # lapses and the slot frees itself, which errs on the side of admitting
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self._renew(keys=[lease.key], args=[int(time.time() * 1000), self._ttl_ms(), lease.id])
+                self.supervisor.record_success()
+            except Exception as e:
+                self.supervisor.record_failure(e)
+                logger.warning(f"Redis error renewing concurrency lease: {str(e)}")
+
+    async def release(self, lease: Lease) -> None:
+        if lease.backend == "memory":
+            await self.fallback.release(lease)
+            return
+        if lease.renewal is not None:
+            lease.renewal.cancel()
+        try:
+            await self.client.zrem(lease.key, lease.id)
+            self.supervisor.record_success()
+        except Exception as e:
+            # The lease expires on its own
+            self.supervisor.record_failure(e)
+            logger.error(f"Redis error releasing concurrency slot: {str(e)}")
+
+async def acquire(semaphores, key: str, limit: int, timeout: Optional[float] = None, tier: Optional[str] = None) -> Optional[Lease]:
+    """
+    Take a slot for key, waiting for one to free up.
+
+    Args:
+        semaphores: Slot store
+        key: Client key
+        limit: Maximum in-flight requests for the client
+        timeout: Seconds to wait (default: CONCURRENCY_QUEUE_TIMEOUT)
+        tier: Client tier, for the rejection metric
+
+    Returns:
+        The lease, or None if no slot became free in time
+    """
+    deadline = time.monotonic() + (CONCURRENCY_QUEUE_TIMEOUT if timeout is None else timeout)
+    while True:
+        lease = await semaphores.try_acquire(key, limit)
+        if lease is not None:
+            return lease
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            CONCURRENCY_REJECTIONS.labels(tier=tier or "free").inc()
+            return None
+        await asyncio.sleep(min(_POLL_INTERVAL, remaining))
+
+def create_semaphores():
+    """Use Redis when it is configured, with an in-process fallback during outages."""
+    from app.api.rate_limiter import redis_client, redis_supervisor
+    if redis_client is not None:
+        return RedisSemaphores(redis_client, redis_supervisor)
+    logger.info("Redis unavailable; concurrency limits are enforced per process")
+    return MemorySemaphores()
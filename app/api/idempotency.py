@@ -0,0 +1,225 @@
+"""
+Idempotency-Key support for ToxidAPI.
+
+Clients retrying a POST after a timeout send the same ``Idempotency-Key``
+header; the first response for a key is stored and replayed for retries
+within IDEMPOTENCY_TTL, without running the analysis or consuming rate-limit
+budget again. A retry that arrives while the original request is still in
+flight waits for its response. Keys are scoped to the caller (API key, or
+client IP without one) and to the endpoint, and a key reused with a
+different request body is rejected.
+
+Records live in Redis when it is available, so replays work across
+processes, and in a bounded in-process store otherwise or while Redis is
+down. The request handling itself is done by IdempotencyMiddleware in
+app.core.middleware.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Idempotency settings
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds a response is replayed for
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))  # max wait on an in-flight original
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "120"))  # in-flight marker lifetime, covers crashes
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))  # in-process store only
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", "67108864"))  # stored responses, in-process store only
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(os.getenv("IDEMPOTENCY_MAX_RESPONSE_BYTES", "1048576"))
+
+# Endpoints that honour the header
+IDEMPOTENT_PATHS = ("/api/v2/analyze", "/api/v2/analyze/batch")
+
+# Interval for polling Redis while another process handles the original
+_POLL_INTERVAL = 0.05
+
+class MemoryIdempotencyStore:
+    """
+    In-process idempotency records; the oldest key is evicted first.
+
+    The store holds at most max_keys records and max_bytes of stored response
+    headers and bodies, whichever limit is reached first.
+
+    Records are dicts with ``state`` ("in_flight" or "done"), ``fingerprint``
+    and ``owner``; done records also carry ``status``, ``headers`` and ``body``.
+    """
+    def __init__(self, max_keys: int = IDEMPOTENCY_MAX_KEYS, max_bytes: int = IDEMPOTENCY_MAX_BYTES):
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        # key -> (expires_at, record, size)
+        self._records: Dict[str, Any] = {}
+        self._bytes = 0
+        # key -> event set when an in-flight record is completed or released
+        self._events: Dict[str, asyncio.Event] = {}
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._pop(key)
+            return None
+        return entry[1]
+
+    def _pop(self, key: str) -> None:
+        entry = self._records.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _set(self, key: str, record: Dict[str, Any], ttl: int) -> None:
+        size = len(record.get("body", b"")) + sum(len(name) + len(value) for name, value in record.get("headers", ()))
+        self._pop(key)
+        # Remove oldest entries until the new one fits
+        while self._records and (len(self._records) >= self.max_keys or self._bytes + size > self.max_bytes):
+            self._pop(next(iter(self._records)))
+        self._records[key] = (time.time() + ttl, record, size)
+        self._bytes += size
+
+    async def begin(self, key: str, fingerprint: str, owner: str) -> Optional[Dict[str, Any]]:
+        """Claim key for a new request; returns None if claimed, else the existing record."""
+        existing = self._get(key)
+        if existing is not None:
+            return existing
+        self._set(key, {"state": "in_flight", "fingerprint": fingerprint, "owner": owner}, IDEMPOTENCY_LOCK_TTL)
+        self._events[key] = asyncio.Event()
+        return None
+
+    async def complete(self, key: str, owner: str, record: Dict[str, Any]) -> None:
+        """Store the response of the request that claimed key."""
+        current = self._get(key)
+        if current is not None and current["owner"] == owner:
+            self._set(key, record, IDEMPOTENCY_TTL)
+        self._notify(key)
+
+    async def release(self, key: str, owner: str) -> None:
+        """Give up a claim without storing a response, so a retry runs again."""
+        current = self._get(key)
+        if current is not None and current["owner"] == owner:
+            self._pop(key)
+        self._notify(key)
+
+    async def wait(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait until key is no longer in flight; returns the record, or None if released."""
+        event = self._events.get(key)
+        if event is not None:
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._get(key)
+
+    def _notify(self, key: str) -> None:
+        event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+class RedisIdempotencyStore:
+    """
+    Idempotency records in Redis, shared by all processes.
+
+    The in-flight marker is created with SET NX and expires after
+    IDEMPOTENCY_LOCK_TTL, so a crashed request does not block its key.
+    Takes a ``redis.asyncio`` client; while the supervisor reports Redis as
+    unavailable, records are kept in an in-process store instead.
+    """
+    def __init__(self, client, supervisor=None):
+        from app.api.redis_supervisor import RedisSupervisor
+        self.client = client
+        self.supervisor = supervisor or RedisSupervisor(client)
+        self.fallback = MemoryIdempotencyStore()
+
+    def _load(self, raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+        if raw is None:
+            return None
+        record = json.loads(raw)
+        if "body" in record:
+            record["body"] = base64.b64decode(record["body"])
+        return record
+
+    def _dump(self, record: Dict[str, Any]) -> str:
+        if "body" in record:
+            record = {**record, "body": base64.b64encode(record["body"]).decode("ascii")}
+        return json.dumps(record)
+
+    async def _call(self, operation: str, *args):
+        """Run operation on Redis, or on the in-process store while Redis is down."""
+        if self.supervisor.available:
+            try:
+                result = await getattr(self, f"_redis_{operation}")(*args)
+                self.supervisor.record_success()
+                return result
+            except Exception as e:
+                self.supervisor.record_failure(e)
+                logger.error(f"Redis error in idempotency {operation}: {str(e)}")
+        else:
+            self.supervisor.fallback("idempotency")
+        return await getattr(self.fallback, operation)(*args)
+
+    async def begin(self, key: str, fingerprint: str, owner: str) -> Optional[Dict[str, Any]]:
+        return await self._call("begin", key, fingerprint, owner)
+
+    async def complete(self, key: str, owner: str, record: Dict[str, Any]) -> None:
+        await self._call("complete", key, owner, record)
+
+    async def release(self, key: str, owner: str) -> None:
+        await self._call("release", key, owner)
+
+    async def wait(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        return await self._call("wait", key, timeout)
+
+    async def _redis_begin(self, key: str, fingerprint: str, owner: str) -> Optional[Dict[str, Any]]:
+        marker = self._dump({"state": "in_flight", "fingerprint": fingerprint, "owner": owner})
+        if await self.client.set(key, marker, nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+            return None
+        existing = self._load(await self.client.get(key))
+        if existing is None:
+            # Expired between SET and GET; try again
+            return await self._redis_begin(key, fingerprint, owner)
+        return existing
+
+    async def _replace_if_owner(self, key: str, owner: str, record: Optional[Dict[str, Any]]) -> None:
+        # Compare-and-set, so a request whose marker expired cannot clobber a newer claim
+        import redis
+        async with self.client.pipeline() as pipe:
+            try:
+                await pipe.watch(key)
+                current = self._load(await pipe.get(key))
+                if current is None or current.get("owner") != owner:
+                    return
+                pipe.multi()
+                if record is None:
+                    pipe.delete(key)
+                else:
+                    pipe.set(key, self._dump(record), ex=IDEMPOTENCY_TTL)
+                await pipe.execute()
+            except redis.WatchError:
+                pass
+
+    async def _redis_complete(self, key: str, owner: str, record: Dict[str, Any]) -> None:
+        await self._replace_if_owner(key, owner, record)
+
+    async def _redis_release(self, key: str, owner: str) -> None:
+        await self._replace_if_owner(key, owner, None)
+
+    async def _redis_wait(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            record = self._load(await self.client.get(key))
+            if record is None or record["state"] != "in_flight" or time.monotonic() >= deadline:
+                return record
+            await asyncio.sleep(_POLL_INTERVAL)
+
+def create_store():
+    """Use Redis when it is configured, with an in-process fallback during outages."""
+    from app.api.rate_limiter import redis_client, redis_supervisor
+    if redis_client is not None:
+        return RedisIdempotencyStore(redis_client, redis_supervisor)
+    logger.info("Redis unavailable; idempotency keys are stored in-process")
+    return MemoryIdempotencyStore()
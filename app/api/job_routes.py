@@ -0,0 +1,207 @@
+"""
+Job API routes for ToxidAPI.
+
+Submit large analysis batches as jobs, poll their progress and page through
+their results. Jobs are processed by the background workers in app.api.jobs.
+"""
+
+import json
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api import jobs, usage_events, webhooks
+from app.api.models import JobRequest, JobResponse
+from app.api.rate_limiter import validate_api_key, require_api_key, charge_request, texts_cost
+from app.api.responses import RenderedJSONResponse, render_json, render_array
+from app.core.middleware import ParsedBodyRoute
+from app.models.database import get_db, DBJob
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create router with versioning
+router = APIRouter(prefix="/api/v2/jobs", tags=["jobs"], route_class=ParsedBodyRoute)
+
+# Maximum results per page
+MAX_PAGE_SIZE = 1000
+
+def _submit(db: Session, request: Request, user_id: str, texts: list, webhook_url: Optional[str] = None) -> DBJob:
+    if not texts:
+        raise HTTPException(
+            status_code=400,
+            detail="A job must include at least one text"
+        )
+    max_items = jobs.job_limit_for(getattr(request.state, "tier", None))
+    if len(texts) > max_items:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Job size limit is {max_items} texts"
+        )
+    try:
+        webhook = webhooks.resolve_job_webhook(db, request.state.api_key_id, webhook_url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    usage_events.track_items(len(texts))
+    return jobs.create_job(db, user_id, texts, webhook=webhook)
+
+def _get_job_or_404(db: Session, job_id: str, user_id: str) -> DBJob:
+    job = jobs.get_job(db, job_id, user_id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "job_not_found",
+                "code": "JOB_NOT_FOUND",
+                "message": f"Job {job_id} not found."
+            }
+        )
+    return job
+
+def _parse_upload(filename: str, content: bytes) -> list:
+    """Parse an upload: JSON Lines (strings or {"text": ...}) or one text per line."""
+    try:
+        lines = content.decode("utf-8").splitlines()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload must be UTF-8 encoded")
+
+    if not (filename or "").endswith((".jsonl", ".ndjson")):
+        return [line for line in lines if line.strip()]
+
+    texts = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            value = json.loads(line)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Line {number} is not valid JSON")
+        if isinstance(value, dict):
+            value = value.get("text")
+        if not isinstance(value, str):
+            raise HTTPException(status_code=400, detail=f"Line {number} has no text")
+        texts.append(value)
+    return texts
+
+@router.post(
+    "",
+    response_model=JobResponse,
+    status_code=202,
+    summary="Submit an analysis job",
+    description="Queue a large list of texts for background analysis. Returns the job to poll."
+)
+def submit_job(
+    job_request: JobRequest,
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """
+    Submit texts for background analysis.
+
+    - **texts**: List of texts to analyze
+    - **webhook_url**: Optional URL to push results to, overriding the API key's webhook URL
+
+    Returns the queued job. Poll `/api/v2/jobs/{job_id}` for progress.
+    """
+    user_id = require_api_key(request, api_key)
+    webhook_url = str(job_request.webhook_url) if job_request.webhook_url else None
+    return _submit(db, request, user_id, job_request.texts, webhook_url)
+
+@router.post(
+    "/upload",
+    response_model=JobResponse,
+    status_code=202,
+    summary="Submit an analysis job from a file",
+    description="Queue texts from a file upload: JSON Lines (.jsonl/.ndjson) or plain text with one text per line."
+)
+async def upload_job(
+    request: Request,
+    file: UploadFile = File(...),
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """
+    Submit texts from an uploaded file for background analysis.
+
+    JSON Lines files may contain strings or objects with a "text" field.
+    Any other file is read as one text per non-empty line. Results are
+    pushed to the API key's webhook URL, if one is configured. The texts
+    are charged against the owner's quota once the file is parsed.
+    """
+    user_id = require_api_key(request, api_key)
+    texts = await run_in_threadpool(_parse_upload, file.filename, await file.read())
+    await charge_request(request, texts_cost(texts))
+    return await run_in_threadpool(_submit, db, request, user_id, texts)
+
+@router.get(
+    "/{job_id}",
+    response_model=JobResponse,
+    summary="Get job status",
+    description="Get the status and progress of a job."
+)
+def get_job_status(
+    job_id: str,
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """Get the status and progress of a job."""
+    user_id = require_api_key(request, api_key)
+    return _get_job_or_404(db, job_id, user_id)
+
+@router.post(
+    "/{job_id}/cancel",
+    response_model=JobResponse,
+    summary="Cancel a job",
+    description="Stop processing a queued or running job. Results analyzed so far are kept."
+)
+def cancel_job(
+    job_id: str,
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """Cancel a queued or running job."""
+    user_id = require_api_key(request, api_key)
+    return jobs.cancel_job(db, _get_job_or_404(db, job_id, user_id))
+
+@router.get(
+    "/{job_id}/results",
+    summary="Get job results",
+    description="Page through a job's results in submission order."
+)
+def get_job_results(
+    job_id: str,
+    request: Request,
+    after: int = Query(-1, description="Return items after this position (use next_after from the previous page)"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE, description="Maximum items to return"),
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """
+    Page through a job's results.
+
+    Each item has its `position` in the submission and a `status` of
+    pending, processing, done (with `result`) or failed (with `error`).
+    """
+    user_id = require_api_key(request, api_key)
+    job = _get_job_or_404(db, job_id, user_id)
+    items = jobs.get_job_items(db, job.id, after, limit)
+
+    # Stored results are already rendered JSON; splice them in as-is
+    rendered = [
+        jobs.render_item(item.position, item.status, item.processing_time, item.error, item.result)
+        for item in items
+    ]
+
+    next_after = items[-1].position if len(items) == limit else None
+    return RenderedJSONResponse(content=(
+        b'{"job_id":' + render_json(job.id)
+        + b',"status":' + render_json(job.status)
+        + b',"results":' + render_array(rendered)
+        + b',"next_after":' + render_json(next_after) + b"}"
+    ))
@@ -0,0 +1,326 @@
+"""
+Asynchronous analysis jobs for ToxidAPI.
+
+Large batches are persisted as a job row plus one row per text. Background
+workers claim chunks of pending items, run them through the shared analysis
+service (result cache, global analyzer semaphore) and store the rendered
+results. Claimed items carry a lease, so items left in flight by a crash or
+restart are picked up again once the lease expires; processing is therefore
+at-least-once, which is safe because analysis results are idempotent.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, insert, or_, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api import analysis, webhooks
+from app.api.models import JobResponse
+from app.api.responses import render_json
+from app.models.database import session_scope, DBJob, DBJobItem, DBJobWebhook, IS_SERVERLESS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Job settings
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "false" if IS_SERVERLESS else "true").lower() == "true"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))  # worker tasks per process
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "50"))  # items claimed per worker iteration
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "8"))  # analyzer calls in flight per worker
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))  # seconds between polls when idle
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))  # before in-flight items are reclaimed
+
+# Item caps per tier
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", "10000"))
+PRO_JOB_MAX_ITEMS = int(os.getenv("PRO_JOB_MAX_ITEMS", "500000"))
+
+# Rows per INSERT when storing a new job's items
+_INSERT_CHUNK = 1000
+
+# Job and item states
+ACTIVE_JOB_STATES = ("queued", "running")
+OPEN_ITEM_STATES = ("pending", "processing")
+
+# Serializes claims between the workers of this process
+_claim_lock = threading.Lock()
+
+# Running worker tasks
+_worker_tasks: List[asyncio.Task] = []
+
+def job_limit_for(tier: Optional[str]) -> int:
+    """Maximum texts per job for a user tier."""
+    return PRO_JOB_MAX_ITEMS if tier == "pro" else JOB_MAX_ITEMS
+
+def create_job(db: Session, user_id: str, texts: List[str], webhook: Optional[Tuple[str, str]] = None) -> DBJob:
+    """
+    Persist a new job and its items.
+
+    Args:
+        db: Database session
+        user_id: Owner of the job
+        texts: Texts to analyze, in result order
+        webhook: Optional (url, secret) to push results to
+
+    Returns:
+        The queued job
+    """
+    job = DBJob(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        status="queued",
+        total_items=len(texts),
+        processed_items=0,
+        failed_items=0,
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.flush()
+    if webhook:
+        db.add(DBJobWebhook(job_id=job.id, url=webhook[0], secret=webhook[1]))
+
+    # Bulk insert items; per-object ORM inserts are far too slow for large jobs
+    for start in range(0, len(texts), _INSERT_CHUNK):
+        db.execute(insert(DBJobItem), [
+            {"job_id": job.id, "position": start + offset, "text": text, "status": "pending"}
+            for offset, text in enumerate(texts[start:start + _INSERT_CHUNK])
+        ])
+
+    db.commit()
+    db.refresh(job)
+    logger.info(f"Created job {job.id} with {len(texts)} items")
+    return job
+
+def get_job(db: Session, job_id: str, user_id: str) -> Optional[DBJob]:
+    """Get a job owned by user_id."""
+    return db.query(DBJob).filter(DBJob.id == job_id, DBJob.user_id == user_id).first()
+
+def cancel_job(db: Session, job: DBJob) -> DBJob:
+    """Cancel an active job; items already analyzed keep their results."""
+    if job.status in ACTIVE_JOB_STATES:
+        job.status = "cancelled"
+        job.completed_at = datetime.utcnow()
+        webhooks.enqueue(db, job.id, "job.cancelled", [render_job(job)])
+        db.commit()
+        db.refresh(job)
+    return job
+
+def get_job_items(db: Session, job_id: str, after: int, limit: int) -> List[DBJobItem]:
+    """Get a page of items with position greater than after."""
+    return (
+        db.query(DBJobItem)
+        .filter(DBJobItem.job_id == job_id, DBJobItem.position > after)
+        .order_by(DBJobItem.position)
+        .limit(limit)
+        .all()
+    )
+
+def render_item(position: int, status: str, processing_time: Optional[float], error: Optional[str], result: Optional[str]) -> bytes:
+    """Render a job item; result is stored rendered JSON and is spliced in as-is."""
+    body = render_json({
+        "position": position,
+        "status": status,
+        "processing_time": processing_time,
+        "error": error,
+    })
+    if result is not None:
+        body = body[:-1] + b',"result":' + result.encode("utf-8") + b"}"
+    return body
+
+def render_job(job: DBJob) -> bytes:
+    """Render a job's status and progress."""
+    return render_json(JobResponse.model_validate(job).model_dump(mode="json"))
+
+def _claimable(expired: datetime):
+    # Pending items, or in-flight items whose lease has expired
+    return or_(
+        DBJobItem.status == "pending",
+        and_(DBJobItem.status == "processing", DBJobItem.claimed_at < expired),
+    )
+
+def _held_under(claimed_at: datetime):
+    # Items still in flight under the claim made at claimed_at
+    return and_(DBJobItem.status == "processing", DBJobItem.claimed_at == claimed_at)
+
+def claim_chunk(size: int = JOB_CHUNK_SIZE) -> Optional[Tuple[str, datetime, List[Tuple[int, int, str]]]]:
+    """
+    Claim up to size items from the oldest active job that has work left.
+
+    Returns:
+        Tuple of (job id, claim timestamp, [(item id, position, text), ...]) or
+        None when there is no work. Results are stored against the claim
+        timestamp, so a worker whose lease was taken over cannot overwrite them.
+    """
+    with _claim_lock, session_scope() as db:
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=JOB_LEASE_SECONDS)
+
+        # One query for the oldest job with a claimable item
+        has_work = (
+            db.query(DBJobItem.id)
+            .filter(DBJobItem.job_id == DBJob.id, _claimable(expired))
+            .exists()
+        )
+        job = (
+            db.query(DBJob)
+            .filter(DBJob.status.in_(ACTIVE_JOB_STATES), has_work)
+            .order_by(DBJob.created_at)
+            .first()
+        )
+        if job is None:
+            return None
+
+        ids = [
+            row.id for row in db.query(DBJobItem.id)
+            .filter(DBJobItem.job_id == job.id, _claimable(expired))
+            .order_by(DBJobItem.position)
+            .limit(size)
+        ]
+        db.execute(
+            update(DBJobItem)
+            .where(DBJobItem.id.in_(ids), _claimable(expired))
+            .values(status="processing", claimed_at=now)
+        )
+        if job.status == "queued":
+            job.status = "running"
+            job.started_at = now
+        db.commit()
+
+        items = (
+            db.query(DBJobItem.id, DBJobItem.position, DBJobItem.text)
+            .filter(DBJobItem.id.in_(ids), _held_under(now))
+            .order_by(DBJobItem.position)
+            .all()
+        )
+        if not items:
+            return None
+        return job.id, now, [(item.id, item.position, item.text) for item in items]
+
+def _complete_if_done(db: Session, job: DBJob) -> None:
+    open_items = (
+        db.query(func.count(DBJobItem.id))
+        .filter(DBJobItem.job_id == job.id, DBJobItem.status.in_(OPEN_ITEM_STATES))
+        .scalar()
+    )
+    if open_items == 0 and job.status in ACTIVE_JOB_STATES:
+        job.status = "completed"
+        job.completed_at = datetime.utcnow()
+        webhooks.enqueue(db, job.id, "job.completed", [render_job(job)])
+        logger.info(f"Job {job.id} completed")
+
+def store_results(job_id: str, claimed_at: datetime, items: List[Tuple[int, int, str]], outcomes: List[Dict[str, Any]]) -> None:
+    """
+    Store analysis outcomes for claimed items, update job progress and queue webhook events.
+
+    Only items still held under this claim are stored and counted; items
+    reclaimed by another worker after the lease expired are left to it.
+    Nothing is stored once the job has been cancelled.
+    """
+    with session_scope() as db:
+        job = db.query(DBJob).filter(DBJob.id == job_id).with_for_update().first()
+        if job is None or job.status not in ACTIVE_JOB_STATES:
+            return
+
+        owned = {
+            row.id for row in db.query(DBJobItem.id)
+            .filter(DBJobItem.id.in_([item_id for item_id, _, _ in items]), _held_under(claimed_at))
+            .with_for_update()
+        }
+
+        rows = []
+        events = []
+        failed = 0
+        for (item_id, position, _), outcome in zip(items, outcomes):
+            if item_id not in owned:
+                continue
+            if outcome["status"] == "ok":
+                row = {
+                    "id": item_id,
+                    "status": "done",
+                    "result": outcome["entry"].body.decode("utf-8"),
+                    "error": None,
+                    "processing_time": outcome["processing_time"],
+                }
+            else:
+                failed += 1
+                row = {
+                    "id": item_id,
+                    "status": "failed",
+                    "result": None,
+                    "error": outcome["error"]["message"],
+                    "processing_time": outcome["processing_time"],
+                }
+            rows.append(row)
+            events.append(render_item(position, row["status"], row["processing_time"], row["error"], row["result"]))
+
+        if rows:
+            # Bulk update by primary key, still guarded by the claim
+            db.execute(
+                update(DBJobItem)
+                .where(_held_under(claimed_at))
+                .execution_options(synchronize_session=None),
+                rows,
+            )
+            webhooks.enqueue(db, job_id, "job.result", events)
+            db.execute(
+                update(DBJob)
+                .where(DBJob.id == job_id)
+                .values(
+                    processed_items=DBJob.processed_items + len(rows),
+                    failed_items=DBJob.failed_items + failed,
+                )
+            )
+            db.refresh(job)
+        _complete_if_done(db, job)
+        db.commit()
+
+async def process_next_chunk(size: int = JOB_CHUNK_SIZE) -> int:
+    """
+    Claim, analyze and store one chunk of job items.
+
+    Returns:
+        Number of items processed (0 when there was no work)
+    """
+    claimed = await run_in_threadpool(claim_chunk, size)
+    if claimed is None:
+        return 0
+
+    job_id, claimed_at, items = claimed
+    outcomes = await analysis.analyze_batch([text for _, _, text in items], concurrency=JOB_CONCURRENCY)
+    await run_in_threadpool(store_results, job_id, claimed_at, items, outcomes)
+    return len(items)
+
+async def _worker_loop(worker_id: int) -> None:
+    logger.info(f"Job worker {worker_id} started")
+    while True:
+        try:
+            processed = await process_next_chunk()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} error: {str(e)}")
+            processed = 0
+
+        if not processed:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+def start_workers() -> None:
+    """Start the background job workers on the running event loop."""
+    if not JOBS_ENABLED:
+        logger.info("Job workers disabled (JOBS_ENABLED=false)")
+        return
+    for worker_id in range(JOB_WORKERS):
+        _worker_tasks.append(asyncio.create_task(_worker_loop(worker_id)))
+
+async def stop_workers() -> None:
+    """Cancel the background job workers; in-flight items are reclaimed later."""
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
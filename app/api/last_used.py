@@ -0,0 +1,96 @@
+"""
+Write-behind for API key last-used times.
+
+Authenticated requests only note when their key was used; the times are
+written with one bulk UPDATE every LAST_USED_FLUSH_INTERVAL seconds, so the
+request path does no write transaction. Each key has at most one pending
+time, the latest, however many requests it made in between. A stored
+last_used time can therefore trail the real one by up to the flush interval
+(plus the time a failed write takes to be retried), and by up to one
+interval more for a process that crashes before flushing.
+"""
+
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, or_, update
+from starlette.concurrency import run_in_threadpool
+
+from app.models.database import session_scope, DBAPIKey
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Longest a last_used time waits to be written, in seconds
+LAST_USED_FLUSH_INTERVAL = float(os.getenv("LAST_USED_FLUSH_INTERVAL", "5"))
+
+def write_last_used(times: Dict[str, datetime]) -> None:
+    """Set last_used for many keys in one executemany UPDATE; never moves a time backwards."""
+    table = DBAPIKey.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("key_id"))
+        .where(or_(table.c.last_used.is_(None), table.c.last_used < bindparam("used_at")))
+        .values(last_used=bindparam("used_at"))
+    )
+    with session_scope() as db:
+        db.connection().execute(statement, [{"key_id": key_id, "used_at": used_at} for key_id, used_at in times.items()])
+        db.commit()
+
+class LastUsedTracker:
+    """Latest use of each API key since the last flush."""
+    def __init__(self):
+        self._pending: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, key_id: str, used_at: Optional[datetime] = None) -> None:
+        """Note that a key was used (now, by default)."""
+        used_at = used_at or datetime.utcnow()
+        pending = self._pending.get(key_id)
+        if pending is None or used_at > pending:
+            self._pending[key_id] = used_at
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        """Write pending times; returns how many keys were updated."""
+        if not self._pending:
+            return 0
+        flushing, self._pending = self._pending, {}
+        try:
+            await run_in_threadpool(write_last_used, flushing)
+        except Exception as e:
+            logger.error(f"Error writing API key last-used times: {str(e)}")
+            # Retry with the next flush, unless the key was used again since
+            for key_id, used_at in flushing.items():
+                self.touch(key_id, used_at)
+            return 0
+        return len(flushing)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(LAST_USED_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Last-used flusher error: {str(e)}")
+
+    def start(self) -> None:
+        """Start flushing periodically on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write what is left."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+# Shared by every request in the process
+tracker = LastUsedTracker()
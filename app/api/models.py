@@ -1,5 +1,23 @@
-from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from pydantic import BaseModel, Field, AfterValidator, HttpUrl
+from typing import Annotated, List, Dict, Optional
+from datetime import date, datetime
+
+def _clamp(low: float, high: float):
+    """Build a validator that clamps a number into [low, high]."""
+    def clamp(value):
+        # Comparisons instead of min()/max(); this runs for every score field
+        if value < low:
+            return low
+        if value > high:
+            return high
+        return value
+    return AfterValidator(clamp)
+
+# Score types; out-of-range model output is clamped rather than rejected
+UnitScore = Annotated[float, _clamp(0.0, 1.0)]
+SignedScore = Annotated[float, _clamp(-1.0, 1.0)]
+GradeLevel = Annotated[int, _clamp(1, 12)]
+Count = Annotated[int, _clamp(0, float("inf"))]
 
 # Request Models
 class TextRequest(BaseModel):
@@ -7,44 +25,44 @@ class TextRequest(BaseModel):
 
 # Response Models
 class DetailedToxicityScores(BaseModel):
-    toxicity: float = Field(0.0, description="General toxicity score")
-    severe_toxicity: float = Field(0.0, description="Severe toxicity score")
-    obscene: float = Field(0.0, description="Obscenity score")
-    threat: float = Field(0.0, description="Threatening content score")
-    insult: float = Field(0.0, description="Insulting content score")
-    identity_hate: float = Field(0.0, description="Identity-based hate score")
+    toxicity: UnitScore = Field(0.0, description="General toxicity score")
+    severe_toxicity: UnitScore = Field(0.0, description="Severe toxicity score")
+    obscene: UnitScore = Field(0.0, description="Obscenity score")
+    threat: UnitScore = Field(0.0, description="Threatening content score")
+    insult: UnitScore = Field(0.0, description="Insulting content score")
+    identity_hate: UnitScore = Field(0.0, description="Identity-based hate score")
 
 class ToxicityResponse(BaseModel):
-    score: float = Field(..., description="Overall toxicity score (0-1)")
-    is_toxic: bool = Field(..., description="Whether the content is considered toxic")
+    score: UnitScore = Field(0.0, description="Overall toxicity score (0-1)")
+    is_toxic: bool = Field(False, description="Whether the content is considered toxic")
     detailed_scores: DetailedToxicityScores = Field(
         default_factory=DetailedToxicityScores,
         description="Detailed scores for different toxicity categories"
     )
 
 class EmotionScores(BaseModel):
-    joy: float = Field(0.0, description="Joy emotion score")
-    sadness: float = Field(0.0, description="Sadness emotion score")
-    anger: float = Field(0.0, description="Anger emotion score")
-    fear: float = Field(0.0, description="Fear emotion score")
-    surprise: float = Field(0.0, description="Surprise emotion score")
+    joy: UnitScore = Field(0.0, description="Joy emotion score")
+    sadness: UnitScore = Field(0.0, description="Sadness emotion score")
+    anger: UnitScore = Field(0.0, description="Anger emotion score")
+    fear: UnitScore = Field(0.0, description="Fear emotion score")
+    surprise: UnitScore = Field(0.0, description="Surprise emotion score")
 
 class SentimentResponse(BaseModel):
-    score: float = Field(..., description="Sentiment score (-1 to 1, negative to positive)")
-    label: str = Field(..., description="Sentiment label (POSITIVE, NEGATIVE, NEUTRAL)")
+    score: SignedScore = Field(0.0, description="Sentiment score (-1 to 1, negative to positive)")
+    label: str = Field("NEUTRAL", description="Sentiment label (POSITIVE, NEGATIVE, NEUTRAL)")
     emotions: EmotionScores = Field(
         default_factory=EmotionScores,
         description="Detailed emotion scores"
     )
 
 class ProfanityCategories(BaseModel):
-    mild_profanity: float = Field(0.0, description="Mild profanity score")
-    strong_profanity: float = Field(0.0, description="Strong profanity score")
-    sexual_references: float = Field(0.0, description="Sexual references score")
-    slurs: float = Field(0.0, description="Slurs score")
+    mild_profanity: UnitScore = Field(0.0, description="Mild profanity score")
+    strong_profanity: UnitScore = Field(0.0, description="Strong profanity score")
+    sexual_references: UnitScore = Field(0.0, description="Sexual references score")
+    slurs: UnitScore = Field(0.0, description="Slurs score")
 
 class ProfanityResponse(BaseModel):
-    score: float = Field(0.0, description="Overall profanity score (0-1)")
+    score: UnitScore = Field(0.0, description="Overall profanity score (0-1)")
     is_profane: bool = Field(False, description="Whether the content contains profanity")
     severity: str = Field("NONE", description="Profanity severity (NONE, LOW, MEDIUM, HIGH)")
     categories: ProfanityCategories = Field(
@@ -53,15 +71,15 @@ class ProfanityResponse(BaseModel):
     )
 
 class SensitivityCategories(BaseModel):
-    political: float = Field(0.0, description="Political sensitivity score")
-    religious: float = Field(0.0, description="Religious sensitivity score")
-    racial: float = Field(0.0, description="Racial sensitivity score")
-    gender: float = Field(0.0, description="Gender sensitivity score")
-    violence: float = Field(0.0, description="Violence sensitivity score")
-    self_harm: float = Field(0.0, description="Self-harm sensitivity score")
+    political: UnitScore = Field(0.0, description="Political sensitivity score")
+    religious: UnitScore = Field(0.0, description="Religious sensitivity score")
+    racial: UnitScore = Field(0.0, description="Racial sensitivity score")
+    gender: UnitScore = Field(0.0, description="Gender sensitivity score")
+    violence: UnitScore = Field(0.0, description="Violence sensitivity score")
+    self_harm: UnitScore = Field(0.0, description="Self-harm sensitivity score")
 
 class SensitivityResponse(BaseModel):
-    score: float = Field(0.0, description="Overall sensitivity score (0-1)")
+    score: UnitScore = Field(0.0, description="Overall sensitivity score (0-1)")
     is_sensitive: bool = Field(False, description="Whether the content contains sensitive material")
     categories: SensitivityCategories = Field(
         default_factory=SensitivityCategories,
@@ -71,11 +89,11 @@ class SensitivityResponse(BaseModel):
 class ReadabilityMetrics(BaseModel):
     avg_word_length: float = Field(5.0, description="Average word length")
     avg_sentence_length: float = Field(15.0, description="Average sentence length")
-    complex_word_percentage: float = Field(0.3, description="Percentage of complex words")
+    complex_word_percentage: UnitScore = Field(0.3, description="Percentage of complex words")
 
 class ReadabilityResponse(BaseModel):
-    score: float = Field(0.5, description="Readability score (0-1, harder to easier)")
-    grade_level: int = Field(8, description="Approximate grade level (1-12)")
+    score: UnitScore = Field(0.5, description="Readability score (0-1, harder to easier)")
+    grade_level: GradeLevel = Field(8, description="Approximate grade level (1-12)")
     difficulty: str = Field("MEDIUM", description="Readability difficulty (EASY, MEDIUM, DIFFICULT)")
     metrics: ReadabilityMetrics = Field(
         default_factory=ReadabilityMetrics,
@@ -83,22 +101,30 @@ class ReadabilityResponse(BaseModel):
     )
 
 class FlaggedWordsResponse(BaseModel):
-    count: int = Field(..., description="Number of flagged words found")
+    count: Count = Field(0, description="Number of flagged words found")
     words: List[str] = Field(default_factory=list, description="List of flagged words")
     categories: Dict[str, List[str]] = Field(
         default_factory=dict, 
         description="Categorization of flagged words"
     )
-    severity_score: float = Field(0.0, description="Severity score for flagged content (0-1)")
+    severity_score: UnitScore = Field(0.0, description="Severity score for flagged content (0-1)")
     is_severe: bool = Field(False, description="Whether the flagged content is considered severe")
 
-class AnalysisResponse(BaseModel):
-    toxicity: ToxicityResponse = Field(..., description="Toxicity analysis results")
-    sentiment: SentimentResponse = Field(..., description="Sentiment analysis results")
-    profanity: ProfanityResponse = Field(..., description="Profanity analysis results")
-    sensitivity: SensitivityResponse = Field(..., description="Sensitivity analysis results")
-    readability: ReadabilityResponse = Field(..., description="Readability analysis results")
-    flagged_words: FlaggedWordsResponse = Field(..., description="Flagged words analysis")
+class AnalysisResult(BaseModel):
+    """
+    Analysis sections produced by the analyzer.
+    
+    Every field has a default and scores are clamped to their documented
+    ranges, so partial or out-of-range model output validates cleanly.
+    """
+    toxicity: ToxicityResponse = Field(default_factory=ToxicityResponse, description="Toxicity analysis results")
+    sentiment: SentimentResponse = Field(default_factory=SentimentResponse, description="Sentiment analysis results")
+    profanity: ProfanityResponse = Field(default_factory=ProfanityResponse, description="Profanity analysis results")
+    sensitivity: SensitivityResponse = Field(default_factory=SensitivityResponse, description="Sensitivity analysis results")
+    readability: ReadabilityResponse = Field(default_factory=ReadabilityResponse, description="Readability analysis results")
+    flagged_words: FlaggedWordsResponse = Field(default_factory=FlaggedWordsResponse, description="Flagged words analysis")
+
+class AnalysisResponse(AnalysisResult):
     processing_time: float = Field(..., description="Processing time in seconds")
     text: str = Field(..., description="Original text that was analyzed")
     
@@ -173,4 +199,71 @@ class AnalysisResponse(BaseModel):
                 "processing_time": 0.437,
                 "text": "This is f*cking sh*t!"
             }
-        } 
\ No newline at end of file
+        }
+
+
+# Job Models
+class JobRequest(BaseModel):
+    texts: List[str] = Field(..., description="Texts to analyze, in result order")
+    webhook_url: Optional[HttpUrl] = Field(
+        None,
+        description="URL to push results to; defaults to the API key's webhook URL"
+    )
+
+class JobResponse(BaseModel):
+    id: str = Field(..., description="Job ID")
+    status: str = Field(..., description="Job status (queued, running, completed, cancelled)")
+    total_items: int = Field(..., description="Number of texts in the job")
+    processed_items: int = Field(..., description="Number of texts analyzed so far, including failures")
+    failed_items: int = Field(..., description="Number of texts that could not be analyzed")
+    created_at: datetime = Field(..., description="When the job was submitted")
+    started_at: Optional[datetime] = Field(None, description="When processing started")
+    completed_at: Optional[datetime] = Field(None, description="When the job completed or was cancelled")
+    
+    class Config:
+        from_attributes = True
+
+
+# Webhook Models
+class WebhookRequest(BaseModel):
+    url: Optional[HttpUrl] = Field(
+        None,
+        description="Callback URL for jobs submitted with this API key; omit to only use per-job URLs"
+    )
+
+class WebhookResponse(BaseModel):
+    url: Optional[str] = Field(None, description="Callback URL for jobs submitted with this API key")
+    secret: str = Field(..., description="Secret for verifying the X-Toxid-Signature header")
+    created_at: datetime = Field(..., description="When the webhook was configured")
+    updated_at: datetime = Field(..., description="When the webhook was last changed")
+    
+    class Config:
+        from_attributes = True
+
+class DeadLetterResponse(BaseModel):
+    id: int = Field(..., description="Dead letter ID")
+    job_id: str = Field(..., description="Job the event belongs to")
+    event: str = Field(..., description="Event type (job.result, job.completed, job.cancelled)")
+    attempts: int = Field(..., description="Delivery attempts made")
+    last_error: Optional[str] = Field(None, description="Error of the last attempt")
+    created_at: datetime = Field(..., description="When the event was queued")
+    failed_at: datetime = Field(..., description="When delivery was given up")
+    
+    class Config:
+        from_attributes = True
+
+
+# Usage Models
+class UsagePeriodResponse(BaseModel):
+    period_start: date = Field(..., description="First day of the period (UTC)")
+    units: int = Field(..., description="Rate-limit units used")
+    requests: int = Field(..., description="Successful requests made")
+    
+    class Config:
+        from_attributes = True
+
+class UsageResponse(BaseModel):
+    tier: str = Field(..., description="Tier of the API key's owner")
+    quotas: Dict[str, int] = Field(..., description="Units allowed per day and per month; 0 means no quota")
+    days: List[UsagePeriodResponse] = Field(..., description="Daily usage, most recent first")
+    months: List[UsagePeriodResponse] = Field(..., description="Monthly usage, most recent first")
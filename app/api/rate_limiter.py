@@ -3,29 +3,44 @@ Rate limiting module for ToxidAPI.
 Implements rate limiting using Redis for persistent storage.
 """
 
+import math
 import time
-from typing import Dict, Tuple, Optional
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Tuple, Optional
 from fastapi import Request, HTTPException, Depends
 import os
-import json
 import logging
-from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import update
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.types import Scope
 
 # Import database models
-from app.models.database import get_db, DBAPIKey
+from app.models.database import session_scope, DBAPIKey, DBUser
+from app.api import last_used
+from app.api.usage import quota_error
+from app.api.redis_supervisor import RedisSupervisor
+from app.core.local_store import ExpiringStore
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# In-memory store for fallback when Redis is unavailable
-in_memory_store = {}
+# In-memory store for fallback when Redis is unavailable, bounded so that
+# scans from many clients cannot grow it without limit
+RATE_LIMIT_MEMORY_MAX_KEYS = int(os.getenv("RATE_LIMIT_MEMORY_MAX_KEYS", "100000"))
+in_memory_store = ExpiringStore(RATE_LIMIT_MEMORY_MAX_KEYS, resolution=1000, name="rate_limit")
 
 # Default settings
-DEFAULT_RATE_LIMIT = int(os.getenv("RATE_LIMIT", "100"))  # requests per time window
+DEFAULT_RATE_LIMIT = int(os.getenv("RATE_LIMIT", "100"))  # units (short texts analyzed) per time window
 DEFAULT_RATE_WINDOW = int(os.getenv("RATE_WINDOW", "3600"))  # seconds (1 hour)
-PRO_RATE_LIMIT = int(os.getenv("PRO_RATE_LIMIT", "1000"))  # requests per time window for pro users
+PRO_RATE_LIMIT = int(os.getenv("PRO_RATE_LIMIT", "1000"))  # units per time window for pro users
+
+# Redis connection pool settings
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))  # per process
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "1.0"))  # max wait for a free connection
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "1.0"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))  # seconds idle before a PING
 
 # Redis client will be initialized later if Redis is available
 redis_client = None
@@ -33,20 +48,51 @@ redis_client = None
 # Try to import Redis and connect safely, but don't crash if it's not available
 try:
     import redis
-    # Redis configuration
+    import redis.asyncio
+    # Redis configuration; set REDIS_URL empty to run without Redis
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
-    try:
-        redis_client = redis.from_url(REDIS_URL)
-        # Test connection
-        redis_client.ping()
-        logger.info("Successfully connected to Redis")
-    except Exception as e:
-        logger.warning(f"Failed to connect to Redis: {str(e)}. Using in-memory fallback.")
-        redis_client = None
+    if REDIS_URL:
+        # Requests use the async pool, so a slow Redis only stalls the request
+        # waiting on it, not the event loop
+        redis_client = redis.asyncio.Redis(connection_pool=redis.asyncio.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        ))
+    else:
+        logger.info("REDIS_URL is empty. Using in-memory rate limiting.")
 except ImportError:
     logger.warning("Redis package not installed. Using in-memory fallback for rate limiting.")
     redis_client = None
 
+def _probe_redis() -> bool:
+    """Test the connection once at import, to start in the right mode."""
+    try:
+        with redis.from_url(REDIS_URL, socket_connect_timeout=REDIS_CONNECT_TIMEOUT, socket_timeout=REDIS_SOCKET_TIMEOUT) as probe:
+            probe.ping()
+        logger.info("Successfully connected to Redis")
+        return True
+    except Exception as e:
+        # The supervisor keeps trying in the background once the app starts
+        logger.warning(f"Failed to connect to Redis: {str(e)}. Using in-memory fallback until it is reachable.")
+        return False
+
+# Decides between Redis and the in-memory fallback, and reconnects after outages
+redis_supervisor = RedisSupervisor(redis_client, up=redis_client is not None and _probe_redis())
+
+async def close_redis() -> None:
+    """Stop reconnecting and close the pooled Redis connections (called on shutdown)."""
+    await redis_supervisor.stop()
+    if redis_client is not None:
+        await redis_client.aclose()
+
+def _redis_available() -> bool:
+    return redis_client is not None and redis_supervisor.available
+
 def get_client_identifier(request: Request, api_key: Optional[str] = None) -> str:
     """
     Get a unique identifier for the client, preferring API key if available.
@@ -70,188 +116,548 @@ def get_client_identifier(request: Request, api_key: Optional[str] = None) -> st
         # Fallback if client info can't be accessed
         return "ip:unknown"
 
-def get_rate_limit(api_key: Optional[str] = None, db: Session = None) -> Tuple[int, int]:
+# Rate limit algorithms. Each has a Lua script for Redis, run atomically in
+# one round-trip, and the same logic in Python for the in-memory fallback.
+# Both take the current time from the caller and work in milliseconds.
+# Limits are in units, and each request costs one or more of them.
+# Scripts get KEYS[1] = state key, ARGV = {limit, window ms, now ms, cost}
+# and return {allowed, remaining units, ms until reset}: for allowed requests,
+# the time until the full limit is available again; for rejected ones, the
+# time until a request of that cost would be admitted. The Python check() takes the stored
+# state (None for a new client) and returns that triple with the new state
+# and the time it expires at, as ExpiringStore.update expects.
+
+class FixedWindow:
+    """
+    Count units in a window that starts with the first request.
+
+    Cheapest, but a client can send up to twice the limit across a window
+    boundary. Rejected requests are not counted.
+    """
+    name = "fixed_window"
+    script = """
+local limit, window, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'count', 'reset_at')
+local count, reset_at = tonumber(state[1]), tonumber(state[2])
+if not reset_at or now >= reset_at then
+    count, reset_at = 0, now + window
+end
+if count + cost > limit then
+    return {0, limit - count, reset_at - now}
+end
+count = count + cost
+redis.call('HSET', KEYS[1], 'count', count, 'reset_at', reset_at)
+redis.call('PEXPIRE', KEYS[1], reset_at - now)
+return {1, limit - count, reset_at - now}
+"""
+
+    def check(self, state: Optional[Tuple[int, int]], limit: int, window: int, now: int, cost: int = 1):
+        # State: (count, reset_at)
+        count, reset_at = state if state is not None and now < state[1] else (0, now + window)
+        if count + cost > limit:
+            return (False, limit - count, reset_at - now), state, reset_at
+        return (True, limit - count - cost, reset_at - now), (count + cost, reset_at), reset_at
+
+class SlidingWindow:
+    """
+    Sliding window counter over clock-aligned windows.
+
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window, which smooths out boundary bursts with two counters
+    per client instead of a log of timestamps.
+    """
+    name = "sliding_window"
+    script = """
+local limit, window, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local start = now - now % window
+local state = redis.call('HMGET', KEYS[1], 'start', 'curr', 'prev')
+local last, curr, prev = tonumber(state[1]), tonumber(state[2]) or 0, tonumber(state[3]) or 0
+if last ~= start then
+    if last == start - window then prev = curr else prev = 0 end
+    curr = 0
+end
+local elapsed = now - start
+local estimate = prev * (window - elapsed) / window + curr
+if estimate + cost > limit then
+    local wait
+    if curr + cost > limit then
+        -- Only possible in the next window, once this window's count has decayed enough
+        wait = window - elapsed + math.ceil(window * (1 - (limit - cost) / curr))
+    else
+        wait = math.ceil(window * (1 - (limit - cost - curr) / prev)) - elapsed
+    end
+    return {0, math.max(math.floor(limit - estimate + 1e-9), 0), math.max(wait, 1)}
+end
+curr = curr + cost
+redis.call('HSET', KEYS[1], 'start', start, 'curr', curr, 'prev', prev)
+redis.call('PEXPIRE', KEYS[1], 2 * window - elapsed)
+return {1, math.floor(limit - estimate - cost + 1e-9), 2 * window - elapsed}
+"""
+
+    def check(self, state: Optional[Tuple[int, int, int]], limit: int, window: int, now: int, cost: int = 1):
+        # State: (window start, current count, previous count)
+        start = now - now % window
+        last, curr, prev = state if state is not None else (None, 0, 0)
+        if last != start:
+            prev = curr if last == start - window else 0
+            curr = 0
+        elapsed = now - start
+        estimate = prev * (window - elapsed) / window + curr
+        if estimate + cost > limit:
+            if curr + cost > limit:
+                # Only possible in the next window, once this window's count has decayed enough
+                wait = window - elapsed + math.ceil(window * (1 - (limit - cost) / curr))
+            else:
+                wait = math.ceil(window * (1 - (limit - cost - curr) / prev)) - elapsed
+            remaining = max(math.floor(limit - estimate + 1e-9), 0)
+            return (False, remaining, max(wait, 1)), state, last + 2 * window
+        remaining = math.floor(limit - estimate - cost + 1e-9)
+        return (True, remaining, 2 * window - elapsed), (start, curr + cost, prev), start + 2 * window
+
+class GCRA:
+    """
+    Generic cell rate algorithm, a token bucket stored as one timestamp.
+
+    Units are admitted at an even rate of limit per window, with bursts of
+    up to limit units when the client has been idle.
+    """
+    name = "gcra"
+    script = """
+local limit, window, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local interval = window / limit
+local tat = redis.call('GET', KEYS[1])
+tat = tat and tonumber(tat) or now
+if tat < now then tat = now end
+local new_tat = tat + interval * cost
+local allow_at = new_tat - window
+if now < allow_at then
+    return {0, math.max(math.floor((window - (tat - now)) / interval + 1e-9), 0), math.ceil(allow_at - now)}
+end
+redis.call('SET', KEYS[1], string.format('%.17g', new_tat), 'PX', math.ceil(new_tat - now))
+return {1, math.floor((window - (new_tat - now)) / interval + 1e-9), math.ceil(new_tat - now)}
+"""
+
+    def check(self, state: Optional[float], limit: int, window: int, now: int, cost: int = 1):
+        # State: theoretical arrival time of the next request
+        interval = window / limit
+        tat = max(state if state is not None else now, now)
+        new_tat = tat + interval * cost
+        allow_at = new_tat - window
+        if now < allow_at:
+            remaining = max(math.floor((window - (tat - now)) / interval + 1e-9), 0)
+            return (False, remaining, math.ceil(allow_at - now)), state, state
+        remaining = math.floor((window - (new_tat - now)) / interval + 1e-9)
+        return (True, remaining, math.ceil(new_tat - now)), new_tat, new_tat
+
+ALGORITHMS = {algorithm.name: algorithm for algorithm in (FixedWindow(), SlidingWindow(), GCRA())}
+
+def _algorithm_setting(variable: str, default: str) -> str:
+    name = os.getenv(variable, default)
+    if name not in ALGORITHMS:
+        logger.warning(f"Unknown {variable} '{name}'; using {default}. Choose from: {', '.join(ALGORITHMS)}")
+        return default
+    return name
+
+# Algorithm per tier
+RATE_LIMIT_ALGORITHM = _algorithm_setting("RATE_LIMIT_ALGORITHM", "fixed_window")
+PRO_RATE_LIMIT_ALGORITHM = _algorithm_setting("PRO_RATE_LIMIT_ALGORITHM", RATE_LIMIT_ALGORITHM)
+
+def limits_for_tier(tier: Optional[str]) -> Tuple[int, int, str]:
+    """Rate limit, window and algorithm for a user tier."""
+    if tier == "pro":
+        return PRO_RATE_LIMIT, DEFAULT_RATE_WINDOW, PRO_RATE_LIMIT_ALGORITHM
+    return DEFAULT_RATE_LIMIT, DEFAULT_RATE_WINDOW, RATE_LIMIT_ALGORITHM
+
+# Resolved API keys, cached briefly so authenticated requests don't query the
+# database every time. Creating or deleting a key invalidates its entry in
+# this process; other processes, and tier changes (which are made in the
+# database, not through the API), take effect within API_KEY_CACHE_TTL.
+# Unknown keys are cached too, for a shorter time, so that requests with a
+# bogus key don't query the database every time either.
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "30"))  # seconds
+API_KEY_NEGATIVE_CACHE_TTL = float(os.getenv("API_KEY_NEGATIVE_CACHE_TTL", "5"))  # seconds
+API_KEY_CACHE_MAX_KEYS = int(os.getenv("API_KEY_CACHE_MAX_KEYS", "10000"))
+api_key_cache = ExpiringStore(API_KEY_CACHE_MAX_KEYS, resolution=1, name="api_keys")
+
+# Cached in place of an APIKeyInfo for keys that do not exist
+_UNKNOWN_KEY = object()
+
+class APIKeyInfo(NamedTuple):
+    """An API key resolved to its owner, tier and rate limits."""
+    id: str
+    key: str
+    user_id: str
+    tier: Optional[str]
+    is_active: bool
+
+    @property
+    def limits(self) -> Tuple[int, int, str]:
+        return limits_for_tier(self.tier)
+
+def resolve_api_key(db: Session, api_key: str) -> Optional[APIKeyInfo]:
     """
-    Get rate limit and window for the client.
+    Look up an API key and its owner's tier, using the cache when possible.
     
     Args:
-        api_key: Optional API key
         db: Database session
+        api_key: The API key string
         
     Returns:
-        Tuple of (rate_limit, window_seconds)
+        APIKeyInfo, or None if the key does not exist
     """
-    # Check if this is an API key with a tier from the database
-    if api_key and db:
-        try:
-            db_api_key = db.query(DBAPIKey).filter(DBAPIKey.key == api_key).first()
-            if db_api_key:
-                # Get the tier from the user
-                user = db_api_key.user
-                if user.tier == "pro":
-                    return PRO_RATE_LIMIT, DEFAULT_RATE_WINDOW
-        except Exception as e:
-            logger.error(f"Error getting rate limit from database: {str(e)}")
+    now = time.monotonic()
+    key_info = api_key_cache.get(api_key, now)
+    if key_info is not None:
+        return None if key_info is _UNKNOWN_KEY else key_info
     
-    # Fallback to Redis for legacy API keys
-    if api_key and redis_client:
-        try:
-            # Check if this is a pro API key
-            key_data = redis_client.get(f"api_key:{api_key}")
-            if key_data:
-                key_info = json.loads(key_data)
-                if key_info.get("tier") == "pro":
-                    return PRO_RATE_LIMIT, DEFAULT_RATE_WINDOW
-        except Exception as e:
-            logger.error(f"Error getting rate limit from Redis: {str(e)}")
+    row = db.query(DBAPIKey.id, DBAPIKey.user_id, DBAPIKey.is_active, DBUser.tier).outerjoin(
+        DBUser, DBUser.id == DBAPIKey.user_id
+    ).filter(DBAPIKey.key == api_key).first()
+    if row is None:
+        api_key_cache.update(api_key, lambda _: (_UNKNOWN_KEY, _UNKNOWN_KEY, now + API_KEY_NEGATIVE_CACHE_TTL), now)
+        return None
     
-    return DEFAULT_RATE_LIMIT, DEFAULT_RATE_WINDOW
+    key_info = APIKeyInfo(row.id, api_key, row.user_id, row.tier, bool(row.is_active))
+    api_key_cache.update(api_key, lambda _: (key_info, key_info, now + API_KEY_CACHE_TTL), now)
+    return key_info
+
+def invalidate_api_key(api_key: str) -> None:
+    """Drop a cached key, e.g. after it was created or deleted."""
+    api_key_cache.delete(api_key)
+
+# Registered scripts; redis-py sends EVALSHA and loads the script on first use
+_scripts = {}
+
+async def _run_script(source: str, keys: list, args: list):
+    """Run a Lua script on the current Redis client."""
+    script = _scripts.get(source)
+    if script is None or script.registered_client is not redis_client:
+        script = _scripts[source] = redis_client.register_script(source)
+    return await script(keys=keys, args=args)
 
-def check_rate_limit(identifier: str, limit: int, window: int) -> Tuple[bool, int, int, int]:
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+async def check_rate_limit(identifier: str, limit: int, window: int, algorithm: Optional[str] = None,
+                           cost: int = 1) -> Tuple[bool, int, int, int]:
     """
     Check if the client has exceeded their rate limit.
     
     Args:
         identifier: Client identifier
-        limit: Rate limit
+        limit: Rate limit in units
         window: Time window in seconds
+        algorithm: Name of the algorithm in ALGORITHMS (default: RATE_LIMIT_ALGORITHM)
+        cost: Units the request uses; a request costing more than the limit
+            never fits and is rejected without charging the client's budget
         
     Returns:
-        Tuple of (is_allowed, remaining_requests, limit, reset_time)
+        Tuple of (is_allowed, remaining_units, limit, reset_time)
     """
+    algorithm = ALGORITHMS[algorithm or RATE_LIMIT_ALGORITHM]
+    oversized = cost > limit
+    # An oversized request only reads the budget, so its response still reports it
+    cost = 0 if oversized else max(cost, 1)
+    now = _now_ms()
+    
     # Use Redis if available
-    if redis_client:
+    if _redis_available():
         try:
-            now = datetime.utcnow()
-            key = f"rate_limit:{identifier}"
-            
-            # Get current usage
-            usage_data = redis_client.get(key)
-            if not usage_data:
-                # Initialize usage data
-                usage_data = {
-                    "count": 1,
-                    "reset_time": (now + timedelta(seconds=window)).timestamp()
-                }
-                redis_client.setex(key, window, json.dumps(usage_data))
-                return True, limit - 1, limit, window
-            
-            usage = json.loads(usage_data)
-            
-            # Check if window has expired
-            if now.timestamp() > usage["reset_time"]:
-                # Reset usage
-                usage = {
-                    "count": 1,
-                    "reset_time": (now + timedelta(seconds=window)).timestamp()
-                }
-                redis_client.setex(key, window, json.dumps(usage))
-                return True, limit - 1, limit, window
-            
-            # Check if limit exceeded
-            if usage["count"] >= limit:
-                reset_time = int(usage["reset_time"] - now.timestamp())
-                return False, 0, limit, reset_time
-            
-            # Increment usage
-            usage["count"] += 1
-            redis_client.setex(key, window, json.dumps(usage))
-            return True, limit - usage["count"], limit, int(usage["reset_time"] - now.timestamp())
+            # One atomic round-trip: concurrent requests cannot overshoot the limit
+            allowed, remaining, reset_ms = await _run_script(
+                algorithm.script,
+                keys=[f"rate_limit:{algorithm.name}:{identifier}"],
+                args=[limit, window * 1000, now, cost],
+            )
+            redis_supervisor.record_success()
+            return bool(allowed) and not oversized, remaining, limit, max(1, math.ceil(reset_ms / 1000))
         except Exception as e:
+            redis_supervisor.record_failure(e)
             logger.error(f"Redis error in check_rate_limit: {str(e)}")
             # Fall back to in-memory rate limiting
+    elif redis_client is not None:
+        redis_supervisor.fallback("rate_limit")
     
     # In-memory fallback
-    current_time = int(time.time())
-    
-    # Initialize if not exists
-    if identifier not in in_memory_store:
-        in_memory_store[identifier] = {
-            "count": 1,
-            "reset_time": current_time + window
-        }
-        return True, limit - 1, limit, window
-    
-    # Check if window has expired
-    if current_time > in_memory_store[identifier]["reset_time"]:
-        # Reset usage
-        in_memory_store[identifier] = {
-            "count": 1,
-            "reset_time": current_time + window
-        }
-        return True, limit - 1, limit, window
-    
-    # Check if limit exceeded
-    if in_memory_store[identifier]["count"] >= limit:
-        reset_time = in_memory_store[identifier]["reset_time"] - current_time
-        return False, 0, limit, reset_time
+    allowed, remaining, reset_ms = in_memory_store.update(
+        f"{algorithm.name}:{identifier}",
+        lambda state: algorithm.check(state, limit, window * 1000, now, cost),
+        now,
+    )
+    return allowed and not oversized, remaining, limit, max(1, math.ceil(reset_ms / 1000))
+
+# Request cost in rate-limit units. Each analyzed text costs
+# RATE_LIMIT_COST_PER_ITEM, plus RATE_LIMIT_COST_PER_KB for every full KB of
+# it (about 250 tokens), so a short text costs one unit and large batches or
+# documents use up the limit in proportion to the work they cause.
+RATE_LIMIT_COST_PER_ITEM = int(os.getenv("RATE_LIMIT_COST_PER_ITEM", "1"))
+RATE_LIMIT_COST_PER_KB = int(os.getenv("RATE_LIMIT_COST_PER_KB", "1"))
+
+def texts_cost(texts: list) -> int:
+    """Units charged for analyzing texts; at least 1."""
+    cost = 0
+    for text in texts:
+        cost += RATE_LIMIT_COST_PER_ITEM
+        if isinstance(text, str):
+            cost += len(text.encode("utf-8")) // 1024 * RATE_LIMIT_COST_PER_KB
+    return max(cost, 1)
+
+# Job submissions are analyzed by the background workers at their own pace,
+# so their texts count against the quotas only; the rate limit charges each
+# submission 1 unit
+QUOTA_ONLY_PATHS = ("/api/v2/jobs", "/api/v2/jobs/upload")
+
+# Batches are capped in size per tier (see app.api.analysis.batch_limit_for).
+# One within its cap is charged at most the whole limit, so the largest ones
+# are admitted once the budget is full rather than rejected as too large.
+CAPPED_COST_PATHS = ("/api/v2/analyze/batch",)
+
+def rate_limit_cost(path: str, cost: int, key_info: Optional["APIKeyInfo"]) -> int:
+    """Units of a request's cost that are charged against the rate limit."""
+    if path in QUOTA_ONLY_PATHS:
+        return 1
+    if path in CAPPED_COST_PATHS:
+        limit = key_info.limits[0] if key_info is not None else limits_for_tier(None)[0]
+        if cost > limit:
+            return limit
+    return cost
+
+def is_json(content_type: Optional[str]) -> bool:
+    """Whether a Content-Type header denotes a JSON body."""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type == "application/json" or media_type.endswith("+json")
+
+def json_cost(payload: Any) -> int:
+    """
+    Units charged for a request with a parsed JSON body.
     
-    # Increment usage
-    in_memory_store[identifier]["count"] += 1
-    return True, limit - in_memory_store[identifier]["count"], limit, in_memory_store[identifier]["reset_time"] - current_time
+    Bodies with a ``text`` (single analysis) or ``texts`` list (batches, jobs)
+    are charged with texts_cost; anything else costs 1.
+    """
+    if isinstance(payload, dict):
+        if isinstance(payload.get("texts"), list):
+            return texts_cost(payload["texts"])
+        if isinstance(payload.get("text"), str):
+            return texts_cost([payload["text"]])
+    return 1
+
+def _lookup_api_key(api_key: str) -> Optional[APIKeyInfo]:
+    with session_scope() as db:
+        return resolve_api_key(db, api_key)
 
-async def rate_limit_middleware(request: Request, api_key: Optional[str] = None, db: Session = None):
+async def request_api_key(scope: Scope, api_key: Optional[str] = None) -> Optional[APIKeyInfo]:
     """
-    FastAPI dependency for rate limiting.
+    Resolve a request's API key once and share it through scope["state"].
+    
+    The outermost middleware resolves the key; inner middleware and
+    validate_api_key reuse the result. Cache misses query the database in
+    a threadpool, off the event loop.
     
     Args:
-        request: The FastAPI request object
-        api_key: Optional API key from authentication
-        db: Database session
+        scope: The request's ASGI scope
+        api_key: The key to resolve; defaults to the X-API-Key header
         
     Returns:
-        None if allowed, raises HTTPException if rate limited
+        APIKeyInfo, or None without a key or if the key does not exist
         
     Raises:
-        HTTPException: When the client exceeds rate limits
+        SQLAlchemyError: When the database is unavailable; nothing is stored then
     """
+    if not api_key:
+        api_key = Headers(scope=scope).get("x-api-key")
+    if not api_key:
+        return None
+    state = scope.setdefault("state", {})
+    resolved = state.get("resolved_api_key")
+    if resolved is not None and resolved[0] == api_key:
+        return resolved[1]
+    
+    key_info = api_key_cache.get(api_key, time.monotonic())
+    if key_info is _UNKNOWN_KEY:
+        key_info = None
+    elif key_info is None:
+        key_info = await run_in_threadpool(_lookup_api_key, api_key)
+    state["resolved_api_key"] = (api_key, key_info)
+    return key_info
+
+async def lookup_api_key(scope: Scope) -> Optional[APIKeyInfo]:
+    """request_api_key for middleware: database errors are logged and treated as no key."""
     try:
-        # Skip rate limiting for certain paths
-        if request.url.path in ["/health", "/docs", "/redoc", "/openapi.json", "/"]:
-            return
-        
-        # Get the client identifier
-        identifier = get_client_identifier(request, api_key)
-        
-        # Get rate limit settings
-        limit, window = get_rate_limit(api_key, db)
-        
-        # Check rate limit
-        is_allowed, remaining, limit, reset = check_rate_limit(identifier, limit, window)
-        
-        # Add rate limit headers
-        request.state.rate_limit_headers = {
-            "X-Rate-Limit-Limit": str(limit),
-            "X-Rate-Limit-Remaining": str(remaining),
-            "X-Rate-Limit-Reset": str(reset)
+        return await request_api_key(scope)
+    except Exception as e:
+        logger.error(f"Error resolving API key: {str(e)}")
+        return None
+
+class RateLimitResult(NamedTuple):
+    """Outcome of a rate limit check, in units."""
+    allowed: bool
+    remaining: int
+    limit: int
+    reset: int
+    cost: int
+
+    @property
+    def oversized(self) -> bool:
+        """Whether the request costs more than the whole limit, so retrying cannot help."""
+        return self.cost > self.limit
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Response headers; rejections that may succeed later also say when to retry."""
+        headers = {
+            "X-Rate-Limit-Limit": str(self.limit),
+            "X-Rate-Limit-Remaining": str(self.remaining),
+            "X-Rate-Limit-Reset": str(self.reset),
+            "X-Rate-Limit-Cost": str(self.cost),
         }
-        
-        # Raise exception if rate limited
-        if not is_allowed:
-            raise HTTPException(
-                status_code=429,
-                detail={
-                    "error": "too_many_requests",
-                    "code": "RATE_LIMIT_EXCEEDED",
-                    "message": f"Rate limit exceeded. Try again in {reset} seconds.",
-                    "details": {
-                        "limit": limit,
-                        "remaining": 0,
-                        "reset": reset
-                    }
+        if not self.allowed and not self.oversized:
+            headers["Retry-After"] = str(self.reset)
+        return headers
+
+def rate_limit_error(result: RateLimitResult) -> HTTPException:
+    """The error for a rejected request: 413 if it costs more than the whole limit, else 429."""
+    if result.oversized:
+        return HTTPException(
+            status_code=413,
+            detail={
+                "error": "request_too_large",
+                "code": "REQUEST_TOO_LARGE",
+                "message": f"This request costs {result.cost} units, more than the rate limit of {result.limit} units. "
+                           f"Split it into smaller requests.",
+                "details": {
+                    "limit": result.limit,
+                    "cost": result.cost
                 }
-            )
-    except Exception as e:
-        # Log but don't crash the application
-        logger.error(f"Error in rate limiting middleware: {str(e)}")
-        # Still allow the request to continue
-        return
+            },
+            headers=result.headers
+        )
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "too_many_requests",
+            "code": "RATE_LIMIT_EXCEEDED",
+            "message": f"Rate limit exceeded. Try again in {result.reset} seconds.",
+            "details": {
+                "limit": result.limit,
+                "remaining": result.remaining,
+                "cost": result.cost,
+                "reset": result.reset
+            }
+        },
+        headers=result.headers
+    )
+
+async def rate_limit_request(request: Request, key_info: Optional[APIKeyInfo], cost: int = 1) -> RateLimitResult:
+    """
+    Charge a request against its client's rate limit.
+    
+    Requests with a valid API key are limited per key at the key's tier;
+    anything else, including unknown or inactive keys, per client IP at the
+    default tier. Called by RateLimitMiddleware in app.core.middleware.
+    
+    Args:
+        request: The request; only its client is used
+        key_info: The request's API key, from request_api_key
+        cost: Units the request uses
+        
+    Returns:
+        RateLimitResult
+    """
+    if key_info is not None and key_info.is_active:
+        identifier = get_client_identifier(request, key_info.key)
+        limit, window, algorithm = key_info.limits
+    else:
+        identifier = get_client_identifier(request)
+        limit, window, algorithm = limits_for_tier(None)
+    
+    allowed, remaining, limit, reset = await check_rate_limit(identifier, limit, window, algorithm, cost)
+    return RateLimitResult(allowed, remaining, limit, reset, cost)
+
+class RequestCharge:
+    """
+    Units charged for one request, for endpoints that only learn its size while handling it.
+    
+    RateLimitMiddleware charges what it can price from the body up front
+    and leaves this in ``request.state.charge``. The stream endpoint then
+    charges the items read so far, and the upload endpoint the parsed file,
+    through charge_request; only units beyond those already paid are charged,
+    against the rate limit (unless the request is quota-only, see
+    QUOTA_ONLY_PATHS) and, for metered requests, the owner's quotas.
+    
+    Args:
+        request: The request
+        key_info: Its API key, or None
+        charged: Units already charged
+        meter: UsageMeter the charged units were reserved in, or None if the request is not metered
+        now: Time the units were reserved at
+        rate_limited: Whether further units are charged against the rate limit
+    """
+    def __init__(self, request: Request, key_info: Optional[APIKeyInfo], charged: int = 0, meter=None,
+                 now: Optional[datetime] = None, rate_limited: bool = True):
+        self.request = request
+        self.key_info = key_info
+        self.charged = charged
+        self.meter = meter
+        self.now = now
+        self.rate_limited = rate_limited
+        # Quota units to give back if the request fails
+        self.reserved = charged if meter is not None else 0
+    
+    async def charge(self, cost: int) -> None:
+        """
+        Raise the request's total charge to cost units.
+        
+        Raises:
+            HTTPException: 413 or 429 when the units do not fit
+        """
+        if cost <= self.charged:
+            return
+        extra = cost - self.charged
+        reserved = 0
+        if self.meter is not None:
+            try:
+                quota = await self.meter.reserve(self.key_info.user_id, self.key_info.tier, extra, self.now, requests=0)
+            except Exception as e:
+                # Don't fail requests because the meter broke
+                logger.error(f"Error reserving usage: {str(e)}")
+                quota = None
+            else:
+                if quota is not None and not quota.allowed:
+                    raise quota_error(quota)
+                reserved = extra
+        result = None
+        if self.rate_limited:
+            try:
+                result = await rate_limit_request(self.request, self.key_info, extra)
+            except Exception as e:
+                logger.error(f"Error checking rate limit: {str(e)}")
+        if result is not None and not result.allowed:
+            if reserved:
+                await self.meter.refund(self.key_info.user_id, reserved, self.now, requests=0)
+            # Report the whole request, so one that can never fit gets a 413
+            raise rate_limit_error(result._replace(cost=cost))
+        self.charged = cost
+        self.reserved += reserved
+
+async def charge_request(request: Request, cost: int) -> None:
+    """
+    Charge a request for cost units in total, crediting what it already paid.
+    
+    A no-op for requests that did not pass through RateLimitMiddleware.
+    
+    Raises:
+        HTTPException: 413 or 429 when the units do not fit
+    """
+    charge = getattr(request.state, "charge", None)
+    if charge is not None:
+        await charge.charge(cost)
 
 # API key validator dependency
 async def validate_api_key(request: Request, api_key: str = None):
     """
-    Dependency for validating API keys and applying rate limiting.
-    To be used with the API route dependencies.
+    Dependency for validating API keys.
+    To be used with the API route dependencies; rate limits are applied
+    before the request gets here, by RateLimitMiddleware.
     
     Args:
         request: The FastAPI request object
@@ -261,29 +667,21 @@ async def validate_api_key(request: Request, api_key: str = None):
         The API key string if valid
         
     Raises:
-        HTTPException: When the API key is invalid or rate limited
+        HTTPException: When the API key is invalid
     """
     # Get API key from header if not provided
     if not api_key:
         api_key = request.headers.get("X-API-Key")
     
-    # Check if API key is required for this endpoint
+    # Demo access without a key (rate limited per IP)
     if not api_key:
-        # For demo endpoints, use IP-based rate limiting
-        await rate_limit_middleware(request)
         return None
     
-    # Get database session
-    db = next(get_db())
-    
-    # Validate API key in database
-    db_api_key = db.query(DBAPIKey).filter(
-        DBAPIKey.key == api_key,
-        DBAPIKey.is_active == True
-    ).first()
+    # Validate API key; usually already resolved by the middleware
+    key_info = await request_api_key(request.scope, api_key)
     
     # Check if API key is valid
-    if not db_api_key:
+    if not key_info or not key_info.is_active:
         raise HTTPException(
             status_code=401,
             detail={
@@ -293,11 +691,41 @@ async def validate_api_key(request: Request, api_key: str = None):
             }
         )
     
-    # Update last used time
-    db_api_key.last_used = datetime.utcnow()
-    db.commit()
+    # Expose the key's owner and tier to route handlers (e.g. for batch size caps)
+    request.state.api_key_info = key_info
+    request.state.user_id = key_info.user_id
+    request.state.tier = key_info.tier
+    request.state.api_key_id = key_info.id
     
-    # Apply rate limiting
-    await rate_limit_middleware(request, api_key, db)
+    # Record the use; written to the database in the background
+    last_used.tracker.touch(key_info.id)
     
-    return api_key 
\ No newline at end of file
+    return api_key
+
+def require_api_key(request: Request, api_key: Optional[str]) -> str:
+    """
+    Require that the request was made with an API key.
+    
+    For endpoints that act on a user's own resources, where the anonymous
+    demo access allowed by validate_api_key does not apply.
+    
+    Args:
+        request: The FastAPI request object, after validate_api_key ran
+        api_key: The value returned by validate_api_key
+        
+    Returns:
+        The ID of the key's owner
+        
+    Raises:
+        HTTPException: When no API key was provided
+    """
+    if not api_key:
+        raise HTTPException(
+            status_code=401,
+            detail={
+                "error": "missing_api_key",
+                "code": "API_KEY_REQUIRED",
+                "message": "This endpoint requires an API key in the X-API-Key header."
+            }
+        )
+    return request.state.user_id
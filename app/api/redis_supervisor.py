@@ -0,0 +1,139 @@
+"""
+Redis connection supervision for ToxidAPI.
+
+Shared state (rate limits, idempotency records, the legacy API-key cache)
+lives in Redis, with in-process fallbacks. RedisSupervisor decides which one
+is used: after REDIS_FAILURE_THRESHOLD consecutive connection errors it opens
+the circuit, so requests go straight to the fallback instead of each waiting
+on a dead server, and a background task pings Redis with exponential backoff
+until it answers again. Mode changes are logged once and exported as metrics.
+"""
+
+import asyncio
+import logging
+import os
+import random
+from typing import Optional
+
+from app.core.metrics import REDIS_FALLBACKS, REDIS_MODE_CHANGES, REDIS_RECONNECT_ATTEMPTS, REDIS_UP
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Supervision settings
+REDIS_FAILURE_THRESHOLD = int(os.getenv("REDIS_FAILURE_THRESHOLD", "3"))  # consecutive errors before falling back
+REDIS_RECONNECT_MIN_DELAY = float(os.getenv("REDIS_RECONNECT_MIN_DELAY", "0.5"))  # seconds
+REDIS_RECONNECT_MAX_DELAY = float(os.getenv("REDIS_RECONNECT_MAX_DELAY", "30"))
+REDIS_PING_TIMEOUT = float(os.getenv("REDIS_PING_TIMEOUT", "1.0"))
+
+def is_connection_error(error: Exception) -> bool:
+    """Whether error means Redis is unreachable, as opposed to e.g. a bad command."""
+    try:
+        import redis
+        if isinstance(error, (redis.ConnectionError, redis.TimeoutError)):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+class RedisSupervisor:
+    """
+    Circuit breaker and reconnect loop for one Redis client.
+
+    Callers check ``available`` before using the client and report the
+    outcome with ``record_success`` / ``record_failure``.
+    """
+    def __init__(self, client, up: bool = True, failure_threshold: int = REDIS_FAILURE_THRESHOLD,
+                 min_delay: float = REDIS_RECONNECT_MIN_DELAY, max_delay: float = REDIS_RECONNECT_MAX_DELAY):
+        self.client = client
+        self.up = up
+        self.failure_threshold = max(1, failure_threshold)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self._task: Optional[asyncio.Task] = None
+        self._task_loop: Optional[asyncio.AbstractEventLoop] = None
+        REDIS_UP.set(1 if up else 0)
+
+    @property
+    def mode(self) -> str:
+        return "redis" if self.up else "memory"
+
+    @property
+    def available(self) -> bool:
+        """Whether to use Redis now; while it is down, makes sure a reconnect is under way."""
+        if not self.up:
+            self._ensure_reconnecting()
+        return self.up
+
+    def fallback(self, operation: str) -> None:
+        """Count an operation served in-process because Redis is unavailable."""
+        REDIS_FALLBACKS.labels(operation=operation).inc()
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+    def record_failure(self, error: Exception) -> None:
+        """Count a failed call; connection errors eventually open the circuit."""
+        if not self.up or not is_connection_error(error):
+            return
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.mark_down(error)
+
+    def mark_down(self, error: Exception) -> None:
+        """Switch to the in-process fallback and start reconnecting."""
+        if self.up:
+            self.up = False
+            logger.warning(f"Redis unavailable ({error}); using in-process fallback until it reconnects")
+            REDIS_UP.set(0)
+            REDIS_MODE_CHANGES.labels(mode="memory").inc()
+        self._ensure_reconnecting()
+
+    def _mark_up(self) -> None:
+        self.up = True
+        self.failures = 0
+        logger.info("Reconnected to Redis")
+        REDIS_UP.set(1)
+        REDIS_MODE_CHANGES.labels(mode="redis").inc()
+
+    def _ensure_reconnecting(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop yet (e.g. at import); start() picks this up on startup
+            return
+        if self._task is not None and not self._task.done() and self._task_loop is loop:
+            return
+        self._task = loop.create_task(self._reconnect())
+        self._task_loop = loop
+
+    async def _reconnect(self) -> None:
+        delay = self.min_delay
+        while not self.up:
+            # Full jitter, so workers don't all reconnect at once
+            await asyncio.sleep(random.uniform(0, delay))
+            try:
+                await asyncio.wait_for(self.client.ping(), REDIS_PING_TIMEOUT)
+            except Exception as e:
+                REDIS_RECONNECT_ATTEMPTS.labels(outcome="failed").inc()
+                logger.debug(f"Redis reconnect failed: {str(e)}")
+                delay = min(delay * 2, self.max_delay)
+                continue
+            REDIS_RECONNECT_ATTEMPTS.labels(outcome="succeeded").inc()
+            self._mark_up()
+
+    def start(self) -> None:
+        """Begin reconnecting if Redis was down before the event loop started."""
+        if not self.up:
+            self._ensure_reconnecting()
+
+    async def stop(self) -> None:
+        """Cancel the reconnect loop."""
+        task, self._task = self._task, None
+        if task is not None and not task.done() and self._task_loop is asyncio.get_running_loop():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,59 @@
+"""
+JSON rendering for the analyze routes.
+
+Uses orjson when it is installed and falls back to the standard library
+encoder otherwise. Routes build their bodies from already-normalized dicts,
+so no response-model validation happens on the way out.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Any, Iterable
+
+from fastapi.responses import Response, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+
+    def render_json(content: Any) -> bytes:
+        """Serialize content to compact JSON bytes."""
+        return orjson.dumps(content)
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    logger.warning("orjson not installed. Falling back to the standard JSON encoder.")
+    ORJSON_AVAILABLE = False
+
+    def render_json(content: Any) -> bytes:
+        """Serialize content to compact JSON bytes."""
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+def render_array(items: Iterable[bytes]) -> bytes:
+    """Join rendered JSON values into a JSON array."""
+    return b"[" + b",".join(items) + b"]"
+
+class RenderedJSONResponse(Response):
+    """Response whose body is already-rendered JSON bytes."""
+    media_type = "application/json"
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming NDJSON response for endpoints that also stream the request body.
+
+    StreamingResponse listens for client disconnects by reading from the
+    ASGI receive channel, which would steal request body chunks from the
+    endpoint. This response only starts listening once body_consumed is set;
+    until then a disconnect surfaces to the body reader as ClientDisconnect.
+    """
+    media_type = "application/x-ndjson"
+
+    def __init__(self, content, body_consumed: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_consumed = body_consumed
+
+    async def listen_for_disconnect(self, receive) -> None:
+        await self.body_consumed.wait()
+        await super().listen_for_disconnect(receive)
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
+import asyncio
 import logging
 import time
 from typing import Dict, Any, Optional
@@ -6,105 +7,17 @@ import os
 from pydantic import BaseModel
 
 from app.api.models import TextRequest, AnalysisResponse
-from app.api.rate_limiter import validate_api_key
+from app.api.rate_limiter import validate_api_key, charge_request
+from app.api import analysis, streaming, usage_events
+from app.api.analysis import result_cache, CACHE_MAX_SIZE
+from app.api.responses import RenderedJSONResponse, NDJSONStreamingResponse, render_json, render_array
+from app.core.middleware import ParsedBodyRoute
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Create router with versioning
-router = APIRouter(prefix="/api/v2", tags=["api-v2"])
-
-# Initialize the analyzer with API key from environment
-api_key = os.getenv("GEMINI_API_KEY")
-
-# Set up the analyzer - either real Gemini or a mock
-try:
-    if not api_key:
-        logger.warning("GEMINI_API_KEY environment variable is not set. Using mock analyzer.")
-        # Create a mock analyzer for demo purposes
-        class MockAnalyzer:
-            def __init__(self):
-                self.name = "mock-analyzer"
-                
-            def analyze(self, text):
-                """Simple mock analysis based on keywords"""
-                import random
-                
-                # Simple toxicity detection
-                toxicity_score = 0.0
-                toxic_words = ["hate", "idiot", "stupid", "kill", "die", "awful", "terrible"]
-                profanity = ["f***", "s***", "damn", "hell"]
-                
-                text_lower = text.lower()
-                for word in toxic_words:
-                    if word in text_lower:
-                        toxicity_score += 0.2
-                
-                for word in profanity:
-                    if word in text_lower:
-                        toxicity_score += 0.15
-                
-                # Cap at 1.0
-                toxicity_score = min(1.0, toxicity_score)
-                
-                # Simple sentiment analysis
-                sentiment_score = 0.0
-                positive_words = ["good", "great", "excellent", "happy", "love", "wonderful"]
-                negative_words = ["bad", "sad", "angry", "upset", "hate", "terrible"]
-                
-                for word in positive_words:
-                    if word in text_lower:
-                        sentiment_score += 0.2
-                
-                for word in negative_words:
-                    if word in text_lower:
-                        sentiment_score -= 0.2
-                
-                # Limit to -1.0 to 1.0 range
-                sentiment_score = max(-1.0, min(1.0, sentiment_score))
-                
-                # Generate mock result
-                return {
-                    "toxicity": {
-                        "score": toxicity_score,
-                        "label": "toxic" if toxicity_score > 0.5 else "clean",
-                        "detailed_scores": {
-                            "profanity": min(1.0, toxicity_score * 1.2),
-                            "threat": random.uniform(0, toxicity_score),
-                            "insult": random.uniform(0, toxicity_score),
-                            "identity_attack": random.uniform(0, toxicity_score),
-                        }
-                    },
-                    "sentiment": {
-                        "score": sentiment_score,
-                        "label": "positive" if sentiment_score > 0.25 else ("negative" if sentiment_score < -0.25 else "neutral")
-                    },
-                    "flagged_words": {
-                        "count": int(toxicity_score * 10),
-                        "words": []
-                    }
-                }
-        
-        analyzer = MockAnalyzer()
-    else:
-        # Use the real analyzer if API key is available
-        from app.models.gemini_analyzer import GeminiAnalyzer
-        analyzer = GeminiAnalyzer(api_key)
-except Exception as e:
-    logger.error(f"Error initializing analyzer: {str(e)}")
-    # Fallback to a simple mock analyzer if anything goes wrong
-    class SimpleAnalyzer:
-        def analyze(self, text):
-            return {
-                "toxicity": {"score": 0.0, "label": "clean", "detailed_scores": {}},
-                "sentiment": {"score": 0.0, "label": "neutral"},
-                "flagged_words": {"count": 0, "words": []}
-            }
-    analyzer = SimpleAnalyzer()
-
-# Simple in-memory cache for results
-result_cache = {}
-CACHE_MAX_SIZE = 100
+router = APIRouter(prefix="/api/v2", tags=["api-v2"], route_class=ParsedBodyRoute)
 
 # Custom error responses
 class APIError(BaseModel):
@@ -153,20 +66,11 @@ async def analyze_endpoint(
         
         text = request.text
         start_time = time.time()
+        usage_events.track_items(1)
         
-        # Check cache first
-        if text in result_cache:
-            logger.info(f"Cache hit for text: {text[:20]}...")
-            cached_result = result_cache[text]
-            # Update processing time
-            cached_result["processing_time"] = time.time() - start_time
-            return cached_result
-        
-        # Analyze text using Gemini
+        # Analyze text using Gemini; cache hits reuse the pre-rendered body
         try:
-            logger.info("Calling Gemini analyzer...")
-            analysis_result = analyzer.analyze(text)
-            logger.info("Analysis completed successfully")
+            entry, cache_hit = await analysis.analyze_text(text)
         except Exception as e:
             logger.error(f"Error during Gemini analysis: {str(e)}")
             raise HTTPException(
@@ -177,25 +81,18 @@ async def analyze_endpoint(
         # Calculate processing time
         processing_time = time.time() - start_time
         
-        # Combine results
-        result = {
-            **analysis_result,
-            "processing_time": processing_time,
-            "text": text
-        }
-        
-        # Update cache
-        if len(result_cache) >= CACHE_MAX_SIZE:
-            # Remove oldest entry
-            result_cache.pop(next(iter(result_cache)))
-        result_cache[text] = result
+        if cache_hit:
+            logger.info(f"Cache hit for text: {text[:20]}...")
+            return RenderedJSONResponse(content=entry.render(processing_time))
         
         logger.info(f"Analysis completed in {processing_time:.2f}s")
         
-        # Set cache control headers
-        response.headers["Cache-Control"] = "public, max-age=86400"  # Cache for 24 hours
-        
-        return result
+        # Analyzer output is already normalized against AnalysisResult, so return
+        # it directly instead of having FastAPI validate it against response_model
+        return RenderedJSONResponse(
+            content=entry.render(processing_time),
+            headers={"Cache-Control": "public, max-age=86400"}  # Cache for 24 hours
+        )
         
     except HTTPException:
         # Re-raise HTTP exceptions so they keep their status codes
@@ -272,9 +169,7 @@ async def flush_cache(
                 detail="Admin API key required for this operation"
             )
     
-    global result_cache
-    cache_size = len(result_cache)
-    result_cache = {}
+    cache_size = result_cache.clear()
     
     return {
         "status": "success",
@@ -286,7 +181,7 @@ async def flush_cache(
     "/analyze/batch",
     status_code=200,
     summary="Analyze multiple texts in batch",
-    description="Analyze multiple text items at once. Returns analysis results for each text."
+    description="Analyze multiple text items at once. Returns analysis results or an error for each text, in order."
 )
 async def batch_analyze_endpoint(
     request: Dict[str, list],
@@ -297,65 +192,103 @@ async def batch_analyze_endpoint(
     """
     Analyze multiple texts in batch mode.
     
-    - **texts**: List of texts to analyze
+    - **texts**: List of texts to analyze (cap depends on the API key's tier)
     
-    Returns a list of analysis results.
+    Items are analyzed concurrently and returned in request order, each with a
+    ``status`` of "ok" or "error" and its own measured processing time. A failed
+    item does not fail the batch.
     """
     if "texts" not in request or not isinstance(request["texts"], list):
         raise HTTPException(
             status_code=400,
             detail="Request must include a 'texts' field with a list of strings"
         )
-        
+    
+    # Batch size cap depends on the caller's tier
     batch_size = len(request["texts"])
-    if batch_size > 10:
+    max_batch_size = analysis.batch_limit_for(getattr(request_obj.state, "tier", None))
+    if batch_size > max_batch_size:
         raise HTTPException(
             status_code=400,
-            detail="Batch size limit is 10 texts"
+            detail=f"Batch size limit is {max_batch_size} texts"
         )
         
     logger.info(f"Batch analysis request with {batch_size} texts")
+    usage_events.track_items(batch_size)
     start_time = time.time()
     
-    results = []
-    for text in request["texts"]:
-        if not isinstance(text, str):
-            continue
-            
-        try:
-            # Check cache first
-            if text in result_cache:
-                results.append(result_cache[text])
-                continue
-                
-            # Analyze text
-            analysis_result = analyzer.analyze(text)
-            
-            # Combine results
-            result = {
-                **analysis_result,
-                "processing_time": 0.0,  # Will be updated later
-                "text": text
-            }
-            
-            # Add to cache
-            if len(result_cache) >= CACHE_MAX_SIZE:
-                result_cache.pop(next(iter(result_cache)))
-            result_cache[text] = result
-            
-            results.append(result)
-        except Exception as e:
-            logger.error(f"Error analyzing text in batch: {str(e)}")
-            results.append({
-                "error": str(e),
-                "text": text
-            })
+    # Analyze concurrently; identical texts are analyzed once
+    items = await analysis.analyze_batch(request["texts"])
     
-    # Update processing time
-    processing_time = time.time() - start_time
-    for result in results:
-        if "processing_time" in result:
-            result["processing_time"] = processing_time / batch_size
+    # Render each item with its measured processing time and status
+    rendered = []
+    succeeded = 0
+    for text, item in zip(request["texts"], items):
+        if item["status"] == "ok":
+            succeeded += 1
+            rendered.append(item["entry"].render(item["processing_time"], extra=b',"status":"ok"'))
+        else:
+            rendered.append(render_json({
+                "status": "error",
+                "error": item["error"],
+                "text": text if isinstance(text, str) else None,
+                "processing_time": item["processing_time"]
+            }))
     
+    summary = render_json({
+        "total": batch_size,
+        "succeeded": succeeded,
+        "failed": batch_size - succeeded,
+        "unique": len(set(text for text in request["texts"] if isinstance(text, str)))
+    })
+    
+    processing_time = time.time() - start_time
     logger.info(f"Batch analysis completed in {processing_time:.2f}s")
-    return {"results": results} 
\ No newline at end of file
+    return RenderedJSONResponse(content=b'{"results":' + render_array(rendered) + b',"summary":' + summary + b"}")
+
+# Streaming batch analysis endpoint
+@router.post(
+    "/analyze/stream",
+    status_code=200,
+    summary="Analyze a stream of texts (NDJSON)",
+    description="Stream newline-delimited JSON texts in the request body and receive NDJSON results as they complete.",
+    response_class=NDJSONStreamingResponse,
+    responses={
+        200: {
+            "description": "One JSON object per line, in completion order",
+            "content": {"application/x-ndjson": {}}
+        }
+    }
+)
+async def stream_analyze_endpoint(
+    request_obj: Request,
+    api_key: str = Depends(validate_api_key)
+):
+    """
+    Analyze newline-delimited JSON texts as they arrive.
+    
+    Each request line is a JSON string or an object with a "text" field.
+    Each response line is an analysis result with the input line's ``index``
+    and a ``status`` of "ok", or an object with ``index``, ``status`` "error"
+    and ``error``. Results are sent in completion order, not input order.
+    Each item is charged against the rate limit as it is read; the stream
+    stops with an error line once an item no longer fits.
+    """
+    max_items = streaming.stream_limit_for(getattr(request_obj.state, "tier", None))
+    body_consumed = asyncio.Event()
+    
+    async def body():
+        try:
+            async for chunk in request_obj.stream():
+                yield chunk
+        finally:
+            body_consumed.set()
+    
+    async def charge(cost: int) -> None:
+        await charge_request(request_obj, cost)
+    
+    logger.info("Streaming analysis request started")
+    return NDJSONStreamingResponse(
+        streaming.stream_analysis(body(), max_items=max_items, charge=charge),
+        body_consumed=body_consumed
+    )
@@ -0,0 +1,170 @@
+"""
+NDJSON streaming analysis for ToxidAPI.
+
+Request lines are parsed as they arrive and analyzed with bounded
+concurrency; results are written back as NDJSON lines in completion order,
+each tagged with the index of its input line. The number of items in flight
+and the number of rendered results waiting to be sent are both bounded, so
+server memory stays constant however many lines a client sends.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+
+from app.api import analysis, usage_events
+from app.api.rate_limiter import texts_cost
+from app.api.responses import render_json
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Streaming settings
+STREAM_CONCURRENCY = int(os.getenv("STREAM_CONCURRENCY", "8"))  # analyzer calls in flight per stream
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", "1000000"))
+
+# Item caps per tier (0 means unlimited)
+STREAM_MAX_ITEMS = int(os.getenv("STREAM_MAX_ITEMS", "100"))
+PRO_STREAM_MAX_ITEMS = int(os.getenv("PRO_STREAM_MAX_ITEMS", "0"))
+
+def stream_limit_for(tier: Optional[str]) -> int:
+    """Maximum items per stream for a user tier (0 means unlimited)."""
+    return PRO_STREAM_MAX_ITEMS if tier == "pro" else STREAM_MAX_ITEMS
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = STREAM_MAX_LINE_BYTES) -> AsyncIterator[Optional[bytes]]:
+    """
+    Split a byte stream into lines, skipping blank ones.
+
+    Lines longer than max_line_bytes are discarded as they arrive and
+    reported as None, so one oversized line cannot grow the buffer.
+    """
+    buffer = b""
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            newline = buffer.find(b"\n")
+            if newline == -1:
+                break
+            line, buffer = buffer[:newline], buffer[newline + 1:]
+            if oversized or len(line) > max_line_bytes:
+                oversized = False
+                yield None
+            elif line.strip():
+                yield line
+        if len(buffer) > max_line_bytes:
+            buffer = b""
+            oversized = True
+    if oversized:
+        yield None
+    elif buffer.strip():
+        yield buffer
+
+def _parse_line(line: Optional[bytes]) -> str:
+    """Extract the text from an NDJSON line: a JSON string or {"text": ...}."""
+    if line is None:
+        raise ValueError(f"Line exceeds {STREAM_MAX_LINE_BYTES} bytes")
+    value = json.loads(line)
+    if isinstance(value, dict):
+        value = value.get("text")
+    if not isinstance(value, str):
+        raise ValueError('Line must be a JSON string or an object with a "text" string')
+    return value
+
+def _render_error(index: int, code: str, message: str) -> bytes:
+    return render_json({
+        "index": index,
+        "status": "error",
+        "error": {"code": code, "message": message},
+    }) + b"\n"
+
+async def stream_analysis(
+    chunks: AsyncIterator[bytes],
+    concurrency: int = STREAM_CONCURRENCY,
+    max_items: int = 0,
+    charge: Optional[Callable[[int], Awaitable[None]]] = None
+) -> AsyncIterator[bytes]:
+    """
+    Analyze NDJSON input as it arrives and yield NDJSON results.
+
+    Args:
+        chunks: Request body chunks
+        concurrency: Maximum analyzer calls in flight
+        max_items: Stop after this many items (0 means unlimited)
+        charge: Called with the units used so far before each item is
+            analyzed; raising HTTPException stops the stream with its code
+
+    Yields:
+        One rendered result line per input line, in completion order
+    """
+    # A slot is held from parsing until the item's result is queued, and the
+    # queue itself is bounded, so a slow reader stops the producer
+    slots = asyncio.Semaphore(concurrency)
+    results: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    tasks = set()
+    done = object()
+
+    async def analyze(index: int, text: str) -> None:
+        try:
+            start_time = time.perf_counter()
+            entry, _ = await analysis.analyze_text(text)
+            extra = b',"index":' + str(index).encode() + b',"status":"ok"'
+            await results.put(entry.render(time.perf_counter() - start_time, extra=extra) + b"\n")
+        except Exception as e:
+            logger.error(f"Error analyzing text in stream: {str(e)}")
+            await results.put(_render_error(index, "ANALYSIS_FAILED", str(e)))
+        finally:
+            slots.release()
+
+    async def produce() -> None:
+        index = -1
+        cost = 0
+        try:
+            async for line in iter_lines(chunks):
+                index += 1
+                if max_items and index >= max_items:
+                    await results.put(_render_error(index, "LIMIT_EXCEEDED", f"Stream item limit is {max_items}"))
+                    break
+                await slots.acquire()
+                try:
+                    text = _parse_line(line)
+                except ValueError as e:
+                    slots.release()
+                    await results.put(_render_error(index, "INVALID_ITEM", str(e)))
+                    continue
+                if charge is not None:
+                    cost += texts_cost([text])
+                    try:
+                        await charge(cost)
+                    except HTTPException as e:
+                        slots.release()
+                        await results.put(_render_error(index, e.detail["code"], e.detail["message"]))
+                        break
+                usage_events.track_items(1)
+                task = asyncio.create_task(analyze(index, text))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except Exception as e:
+            logger.error(f"Error reading stream: {str(e)}")
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await results.put(_render_error(index + 1, "INVALID_STREAM", str(e)))
+        await results.put(done)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            line = await results.get()
+            if line is done:
+                break
+            yield line
+    finally:
+        # Client went away or the stream finished; stop outstanding work
+        producer.cancel()
+        for task in list(tasks):
+            task.cancel()
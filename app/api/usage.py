@@ -0,0 +1,400 @@
+"""
+Daily and monthly usage quotas for ToxidAPI.
+
+Every successful analysis request (METERED_PATHS) made with an API key adds
+its rate-limit units (see app.api.rate_limiter.json_cost) to its owner's
+usage for the current UTC day and month; streams and uploads add theirs per
+text as it is read or parsed (see app.api.rate_limiter.RequestCharge).
+Counting stays off the database: counters live in Redis when it is
+available, and each process also keeps what it counted in memory and
+writes it to the usage table in one bulk upsert every USAGE_FLUSH_INTERVAL
+seconds. Quota checks read the counters; the usage endpoint reads the table.
+
+A request's units are reserved when its quota is checked, so concurrent
+requests cannot overshoot a quota between the check and the count, and
+given back if the request then fails. Without Redis, or while it is down, a
+process sees the table totals (reread at most every USAGE_TOTALS_TTL
+seconds) plus what it counted itself, so quotas can be overshot by what
+other processes counted in the meantime.
+"""
+
+import asyncio
+import calendar
+import logging
+import math
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.local_store import ExpiringStore
+from app.models.database import session_scope, DBUsage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Usage settings
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))  # seconds between bulk writes
+USAGE_TOTALS_TTL = float(os.getenv("USAGE_TOTALS_TTL", "60"))  # seconds table totals are reused without Redis
+USAGE_MAX_USERS = int(os.getenv("USAGE_MAX_USERS", "100000"))  # users whose table totals are kept in-process
+
+# Quotas in units per UTC day and month; 0 means no quota
+QUOTA_DAILY = int(os.getenv("QUOTA_DAILY", "0"))
+QUOTA_MONTHLY = int(os.getenv("QUOTA_MONTHLY", "10000"))
+PRO_QUOTA_DAILY = int(os.getenv("PRO_QUOTA_DAILY", "0"))
+PRO_QUOTA_MONTHLY = int(os.getenv("PRO_QUOTA_MONTHLY", "500000"))
+
+PERIODS = ("day", "month")
+
+# POST endpoints that count towards usage; reading results or usage does not
+METERED_PATHS = (
+    "/api/v2/analyze", "/api/v2/v2/analyze", "/api/v2/analyze/batch", "/api/v2/analyze/stream",
+    "/api/v2/jobs", "/api/v2/jobs/upload",
+)
+
+# (user ID, period, first day of the period)
+CounterKey = Tuple[str, str, date]
+
+def quotas_for_tier(tier: Optional[str]) -> Dict[str, int]:
+    """Daily and monthly quota for a user tier; 0 means no quota."""
+    if tier == "pro":
+        return {"day": PRO_QUOTA_DAILY, "month": PRO_QUOTA_MONTHLY}
+    return {"day": QUOTA_DAILY, "month": QUOTA_MONTHLY}
+
+def period_start(period: str, day: date) -> date:
+    return day if period == "day" else day.replace(day=1)
+
+def period_end(period: str, start: date) -> datetime:
+    """When a period that began on start ends (UTC)."""
+    if period == "day":
+        end = start + timedelta(days=1)
+    else:
+        end = (start + timedelta(days=32)).replace(day=1)
+    return datetime.combine(end, datetime.min.time())
+
+def _utcnow() -> datetime:
+    return datetime.utcnow()
+
+class QuotaResult(NamedTuple):
+    """Outcome of a quota check for the period closest to its quota."""
+    allowed: bool
+    period: str
+    limit: int
+    remaining: int
+    reset: int
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Response headers; rejections also say when to retry."""
+        headers = {
+            "X-Quota-Period": self.period,
+            "X-Quota-Limit": str(self.limit),
+            "X-Quota-Remaining": str(self.remaining),
+            "X-Quota-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.reset)
+        return headers
+
+def quota_error(result: QuotaResult) -> HTTPException:
+    """The 429 for a request that does not fit in its quota."""
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "quota_exceeded",
+            "code": "QUOTA_EXCEEDED",
+            "message": f"{'Daily' if result.period == 'day' else 'Monthly'} quota of {result.limit} units used up. "
+                       f"Try again in {result.reset} seconds.",
+            "details": {
+                "period": result.period,
+                "limit": result.limit,
+                "remaining": result.remaining,
+                "reset": result.reset
+            }
+        },
+        headers=result.headers
+    )
+
+def load_totals(user_id: str, keys: List[CounterKey]) -> Dict[CounterKey, int]:
+    """Units stored in the usage table for keys, all of one user."""
+    with session_scope() as db:
+        rows = db.query(DBUsage.period, DBUsage.period_start, DBUsage.units).filter(
+            DBUsage.user_id == user_id,
+            DBUsage.period_start >= min(key[2] for key in keys),
+        ).all()
+    stored = {(user_id, row.period, row.period_start): row.units for row in rows}
+    return {key: stored.get(key, 0) for key in keys}
+
+def write_usage(deltas: Dict[CounterKey, List[int]]) -> None:
+    """Add [units, requests] deltas to the usage table in one transaction."""
+    now = datetime.utcnow()
+    rows = [
+        {"user_id": user_id, "period": period, "period_start": start,
+         "units": units, "requests": requests, "updated_at": now}
+        for (user_id, period, start), (units, requests) in deltas.items()
+    ]
+    with session_scope() as db:
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            if dialect == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(DBUsage)
+            statement = statement.on_conflict_do_update(
+                index_elements=["user_id", "period", "period_start"],
+                set_={
+                    "units": DBUsage.units + statement.excluded.units,
+                    "requests": DBUsage.requests + statement.excluded.requests,
+                    "updated_at": statement.excluded.updated_at,
+                },
+            )
+            db.execute(statement, rows)
+        else:
+            # No portable upsert; update, then insert the rows that did not exist yet
+            for row in rows:
+                result = db.execute(
+                    update(DBUsage)
+                    .where(
+                        DBUsage.user_id == row["user_id"],
+                        DBUsage.period == row["period"],
+                        DBUsage.period_start == row["period_start"],
+                    )
+                    .values(
+                        units=DBUsage.units + row["units"],
+                        requests=DBUsage.requests + row["requests"],
+                        updated_at=now,
+                    )
+                )
+                if result.rowcount == 0:
+                    db.add(DBUsage(**row))
+        db.commit()
+
+def list_usage(db: Session, user_id: str, period: str, limit: int) -> List[DBUsage]:
+    """A user's most recent usage rows for period ("day" or "month")."""
+    return db.query(DBUsage).filter(
+        DBUsage.user_id == user_id,
+        DBUsage.period == period,
+    ).order_by(DBUsage.period_start.desc()).limit(limit).all()
+
+class UsageMeter:
+    """
+    Usage counters per user, with a background task flushing them to the table.
+
+    Takes a ``redis.asyncio`` client and its supervisor, or None to count
+    in-process only.
+    """
+    def __init__(self, client=None, supervisor=None):
+        self.client = client
+        self.supervisor = supervisor
+        # [units, requests] counted by this process and not yet in the table;
+        # _flushing holds a batch while it is being written
+        self._pending: Dict[CounterKey, List[int]] = {}
+        self._flushing: Dict[CounterKey, List[int]] = {}
+        # Table totals, for counting without Redis
+        self._totals = ExpiringStore(USAGE_MAX_USERS * len(PERIODS), resolution=1, name="usage")
+        self._task: Optional[asyncio.Task] = None
+
+    def _keys(self, user_id: str, now: datetime) -> List[CounterKey]:
+        return [(user_id, period, period_start(period, now.date())) for period in PERIODS]
+
+    def _redis_key(self, key: CounterKey) -> str:
+        user_id, period, start = key
+        return f"usage:{user_id}:{period}:{start.isoformat()}"
+
+    def _expire_at(self, key: CounterKey) -> int:
+        # Keep counters a day past their period, for requests straddling the boundary
+        return calendar.timegm((period_end(key[1], key[2]) + timedelta(days=1)).timetuple())
+
+    def _unflushed(self, key: CounterKey) -> int:
+        return self._pending.get(key, (0, 0))[0] + self._flushing.get(key, (0, 0))[0]
+
+    def _use_redis(self) -> bool:
+        if self.client is None:
+            return False
+        if self.supervisor.available:
+            return True
+        self.supervisor.fallback("usage")
+        return False
+
+    async def usage(self, user_id: str, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Units user_id has used in the current day and month."""
+        keys = self._keys(user_id, now or _utcnow())
+        if self._use_redis():
+            try:
+                values = await self.client.mget([self._redis_key(key) for key in keys])
+                if any(value is None for value in values):
+                    # New period, or Redis lost its data; start from the table
+                    stored = await run_in_threadpool(load_totals, user_id, keys)
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for key in keys:
+                            pipe.set(self._redis_key(key), stored[key] + self._unflushed(key), nx=True, exat=self._expire_at(key))
+                        pipe.mget([self._redis_key(key) for key in keys])
+                        values = (await pipe.execute())[-1]
+                self.supervisor.record_success()
+                return {key[1]: int(value or 0) for key, value in zip(keys, values)}
+            except Exception as e:
+                self.supervisor.record_failure(e)
+                logger.error(f"Redis error reading usage: {str(e)}")
+
+        now_monotonic = time.monotonic()
+        stored = {key: self._totals.get(key, now_monotonic) for key in keys}
+        if any(value is None for value in stored.values()):
+            loaded = await run_in_threadpool(load_totals, user_id, keys)
+            for key, units in loaded.items():
+                self._totals.update(key, lambda _, units=units: (None, units, now_monotonic + USAGE_TOTALS_TTL), now_monotonic)
+            stored = loaded
+        return {key[1]: stored[key] + self._unflushed(key) for key in keys}
+
+    def _quota(self, quotas: Dict[str, int], used: Dict[str, int], cost: int, now: datetime) -> QuotaResult:
+        """The quota result for a request of cost units, given the units used before it."""
+        results = []
+        for period in PERIODS:
+            limit = quotas[period]
+            if not limit:
+                continue
+            allowed = used[period] + cost <= limit
+            remaining = max(limit - used[period] - (cost if allowed else 0), 0)
+            reset = max(1, math.ceil((period_end(period, period_start(period, now.date())) - now).total_seconds()))
+            results.append(QuotaResult(allowed, period, limit, remaining, reset))
+        rejected = [result for result in results if not result.allowed]
+        if rejected:
+            # Retrying is pointless until every exhausted quota has reset
+            return max(rejected, key=lambda result: result.reset)
+        return min(results, key=lambda result: result.remaining)
+
+    def _count(self, keys: List[CounterKey], units: int, requests: int) -> None:
+        for key in keys:
+            counts = self._pending.setdefault(key, [0, 0])
+            counts[0] += units
+            counts[1] += requests
+
+    async def reserve(self, user_id: str, tier: Optional[str], cost: int, now: Optional[datetime] = None,
+                      requests: int = 1) -> Optional[QuotaResult]:
+        """
+        Count a request of cost units against user_id's usage if it fits in the quotas.
+
+        Checking and counting are one step. With Redis the counters are
+        incremented, and decremented again if that took one past its quota;
+        in-process nothing else runs between reading and counting. Give the
+        units back with refund if the request then fails.
+
+        Args:
+            user_id: The user making the request
+            tier: The user's tier
+            cost: Units the request uses
+            now: Time of the request
+            requests: Requests to count with the units; 0 for more units of one already counted
+
+        Returns:
+            QuotaResult for the period closest to (or over) its quota, or None
+            if the tier has no quotas. Rejected requests are not counted.
+        """
+        now = now or _utcnow()
+        quotas = quotas_for_tier(tier)
+        if not any(quotas.values()):
+            await self.record(user_id, cost, now, requests)
+            return None
+        keys = self._keys(user_id, now)
+        if self._use_redis():
+            # Starts counters of a new period from the table
+            await self.usage(user_id, now)
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.incrby(self._redis_key(key), cost)
+                        pipe.expireat(self._redis_key(key), self._expire_at(key))
+                    counted = (await pipe.execute())[::2]
+                result = self._quota(quotas, {key[1]: int(value) - cost for key, value in zip(keys, counted)}, cost, now)
+                if result.allowed:
+                    self._count(keys, cost, requests)
+                else:
+                    async with self.client.pipeline(transaction=False) as pipe:
+                        for key in keys:
+                            pipe.decrby(self._redis_key(key), cost)
+                        await pipe.execute()
+                self.supervisor.record_success()
+                return result
+            except Exception as e:
+                self.supervisor.record_failure(e)
+                logger.error(f"Redis error reserving usage: {str(e)}")
+
+        used = await self.usage(user_id, now)
+        # No await from here on: the check and the count are atomic within this process
+        result = self._quota(quotas, used, cost, now)
+        if result.allowed:
+            self._count(keys, cost, requests)
+        return result
+
+    async def refund(self, user_id: str, units: int, now: Optional[datetime] = None, requests: int = 1) -> None:
+        """Give back units (and requests) reserved for a request that failed; now is the time it was reserved at."""
+        await self.record(user_id, -units, now, -requests)
+
+    async def record(self, user_id: str, units: int, now: Optional[datetime] = None, requests: int = 1) -> None:
+        """Count a successful request of units against user_id's usage, without checking quotas."""
+        keys = self._keys(user_id, now or _utcnow())
+        self._count(keys, units, requests)
+        if self._use_redis():
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for key in keys:
+                        pipe.incrby(self._redis_key(key), units)
+                        pipe.expireat(self._redis_key(key), self._expire_at(key))
+                    await pipe.execute()
+                self.supervisor.record_success()
+            except Exception as e:
+                self.supervisor.record_failure(e)
+                logger.error(f"Redis error recording usage: {str(e)}")
+
+    async def flush(self) -> int:
+        """Write counted usage to the table; returns how many rows were updated."""
+        if not self._pending or self._flushing:
+            return 0
+        self._flushing, self._pending = self._pending, {}
+        try:
+            await run_in_threadpool(write_usage, self._flushing)
+        except Exception as e:
+            logger.error(f"Error flushing usage: {str(e)}")
+            # Keep the counts for the next flush
+            for key, (units, requests) in self._flushing.items():
+                counts = self._pending.setdefault(key, [0, 0])
+                counts[0] += units
+                counts[1] += requests
+            self._flushing = {}
+            return 0
+        flushed, self._flushing = self._flushing, {}
+        # Cached table totals no longer include everything counted; reread them
+        for key in flushed:
+            self._totals.delete(key)
+        return len(flushed)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Usage flusher error: {str(e)}")
+
+    def start(self) -> None:
+        """Start flushing periodically on the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Stop the periodic flush and write what is left."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+def create_meter() -> UsageMeter:
+    """Count in Redis when it is configured, with in-process counting during outages."""
+    from app.api.rate_limiter import redis_client, redis_supervisor
+    return UsageMeter(redis_client, redis_supervisor)
@@ -0,0 +1,201 @@
+"""
+Per-request usage event log for ToxidAPI.
+
+Each API request leaves one record in the usage_events table: the API key,
+endpoint, status, how many texts it carried, whether results came from the
+cache (or were an idempotent replay), latency, and the tokens the upstream model reported. Requests never
+write it themselves: UsageEventMiddleware (app.core.middleware) puts the
+record on a bounded in-memory queue, and a background writer inserts queued
+records in bulk every USAGE_EVENT_BATCH_SIZE records or USAGE_EVENT_FLUSH_MS
+milliseconds, whichever comes first. When the queue is full, because the
+database is slow or down, new records are dropped and counted in the
+toxidapi_usage_events_dropped_total metric instead of slowing requests down.
+
+While a request runs, the analysis code adds to its record through
+track_items, track_cache and track_tokens; outside of a request these do
+nothing.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import insert
+from starlette.concurrency import run_in_threadpool
+
+from app.core.metrics import USAGE_EVENTS_DROPPED, USAGE_EVENTS_WRITTEN
+from app.models.database import session_scope, DBUsageEvent
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Event log settings
+USAGE_EVENT_QUEUE_SIZE = int(os.getenv("USAGE_EVENT_QUEUE_SIZE", "10000"))  # records held before dropping
+USAGE_EVENT_BATCH_SIZE = int(os.getenv("USAGE_EVENT_BATCH_SIZE", "500"))  # records per insert
+USAGE_EVENT_FLUSH_MS = int(os.getenv("USAGE_EVENT_FLUSH_MS", "1000"))  # max delay before queued records are written
+
+class RequestUsage:
+    """What one request used; filled in while it runs."""
+    __slots__ = ("items", "cache_hits", "cache_misses", "prompt_tokens", "output_tokens")
+
+    def __init__(self):
+        self.items = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+    @property
+    def cache(self) -> Optional[str]:
+        """"hit" or "miss" if every analysis was one, "mixed" otherwise, None without analyses."""
+        if self.cache_hits and self.cache_misses:
+            return "mixed"
+        if self.cache_hits:
+            return "hit"
+        if self.cache_misses:
+            return "miss"
+        return None
+
+# Usage of the request being handled; copied into tasks and threadpool calls
+_current: contextvars.ContextVar[Optional[RequestUsage]] = contextvars.ContextVar("request_usage", default=None)
+
+def begin_request() -> contextvars.Token:
+    """Start tracking usage for the current request; pass the token to end_request."""
+    return _current.set(RequestUsage())
+
+def end_request(token: contextvars.Token) -> RequestUsage:
+    """Stop tracking and return what the request used."""
+    usage = _current.get()
+    _current.reset(token)
+    return usage
+
+def track_items(count: int) -> None:
+    """Count texts submitted with the current request."""
+    usage = _current.get()
+    if usage is not None:
+        usage.items += count
+
+def track_cache(hit: bool) -> None:
+    """Count an analysis served from (or added to) the result cache."""
+    usage = _current.get()
+    if usage is not None:
+        if hit:
+            usage.cache_hits += 1
+        else:
+            usage.cache_misses += 1
+
+def track_tokens(prompt_tokens: int, output_tokens: int) -> None:
+    """Count upstream tokens spent on the current request."""
+    usage = _current.get()
+    if usage is not None:
+        usage.prompt_tokens += prompt_tokens
+        usage.output_tokens += output_tokens
+
+def write_events(events: List[Dict[str, Any]]) -> None:
+    """Insert event records in one statement."""
+    with session_scope() as db:
+        db.execute(insert(DBUsageEvent), events)
+        db.commit()
+
+class UsageEventLog:
+    """
+    Bounded queue of event records with a background bulk writer.
+
+    Records are only added from the event loop, so the queue needs no lock.
+
+    Args:
+        max_size: Records held before new ones are dropped
+        batch_size: Records written per insert; a full batch is written right away
+        flush_ms: Longest a record waits before it is written
+    """
+    def __init__(self, max_size: int = USAGE_EVENT_QUEUE_SIZE, batch_size: int = USAGE_EVENT_BATCH_SIZE,
+                 flush_ms: int = USAGE_EVENT_FLUSH_MS):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_ms = flush_ms
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, event: Dict[str, Any]) -> bool:
+        """Queue a record for writing; returns False if it was dropped because the queue is full."""
+        if len(self._queue) >= self.max_size:
+            USAGE_EVENTS_DROPPED.labels(reason="queue_full").inc()
+            return False
+        self._queue.append(event)
+        if len(self._queue) >= self.batch_size and self._batch_ready is not None:
+            self._batch_ready.set()
+        return True
+
+    def record(self, api_key_id: Optional[str], endpoint: str, method: str, status: int,
+               usage: RequestUsage, latency: float, replayed: bool = False) -> bool:
+        """Queue the record of a finished request; latency is in seconds."""
+        return self.enqueue({
+            "created_at": datetime.utcnow(),
+            "api_key_id": api_key_id,
+            "endpoint": endpoint,
+            "method": method,
+            "status": status,
+            "items": usage.items,
+            "cache": "replay" if replayed else usage.cache,
+            "latency_ms": round(latency * 1000, 3),
+            "prompt_tokens": usage.prompt_tokens,
+            "output_tokens": usage.output_tokens,
+        })
+
+    async def flush(self) -> int:
+        """Write every queued record, a batch at a time; returns how many were written."""
+        written = 0
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await run_in_threadpool(write_events, batch)
+            except Exception as e:
+                # Records are only kept in the queue, so a failed batch is lost
+                logger.error(f"Error writing {len(batch)} usage events: {str(e)}")
+                USAGE_EVENTS_DROPPED.labels(reason="write_failed").inc(len(batch))
+                break
+            USAGE_EVENTS_WRITTEN.inc(len(batch))
+            written += len(batch)
+        return written
+
+    async def _writer_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), self.flush_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Usage event writer error: {str(e)}")
+
+    def start(self) -> None:
+        """Start the writer on the running event loop."""
+        if self._task is None or self._task.done():
+            self._batch_ready = asyncio.Event()
+            self._task = asyncio.create_task(self._writer_loop())
+
+    async def stop(self) -> None:
+        """Stop the writer and write what is left."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._batch_ready = None
+        await self.flush()
+
+def endpoint_for(scope: Dict[str, Any]) -> str:
+    """The request path with path parameters put back as placeholders, e.g. /api/v2/jobs/{job_id}."""
+    path = scope["path"]
+    for name, value in (scope.get("path_params") or {}).items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
@@ -0,0 +1,46 @@
+"""
+Usage API routes for ToxidAPI.
+
+Lets key owners see how much of their daily and monthly quotas they have
+used. Figures come from the usage table, which the usage counters in
+app.api.usage are flushed to every few seconds.
+"""
+
+import logging
+
+from fastapi import APIRouter, Depends, Query, Request
+from sqlalchemy.orm import Session
+
+from app.api import usage
+from app.api.models import UsageResponse
+from app.api.rate_limiter import validate_api_key, require_api_key
+from app.models.database import get_db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create router with versioning
+router = APIRouter(prefix="/api/v2/usage", tags=["usage"])
+
+@router.get(
+    "",
+    response_model=UsageResponse,
+    summary="Get usage",
+    description="Get your daily and monthly usage in rate-limit units, and your quotas. Figures lag by up to USAGE_FLUSH_INTERVAL seconds."
+)
+def get_usage(
+    request: Request,
+    days: int = Query(31, ge=1, le=366, description="Number of most recent days to return"),
+    months: int = Query(12, ge=1, le=120, description="Number of most recent months to return"),
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """Get the daily and monthly usage of the calling API key's owner."""
+    user_id = require_api_key(request, api_key)
+    tier = request.state.tier or "free"
+    return {
+        "tier": tier,
+        "quotas": usage.quotas_for_tier(tier),
+        "days": usage.list_usage(db, user_id, "day", days),
+        "months": usage.list_usage(db, user_id, "month", months),
+    }
@@ -0,0 +1,122 @@
+"""
+Webhook API routes for ToxidAPI.
+
+Configure the callback URL and signing secret of an API key, and inspect or
+redeliver events that could not be delivered. Delivery itself is handled by
+the background dispatchers in app.api.webhooks.
+"""
+
+import logging
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.orm import Session
+
+from app.api import webhooks
+from app.api.models import WebhookRequest, WebhookResponse, DeadLetterResponse
+from app.api.rate_limiter import validate_api_key, require_api_key
+from app.core.middleware import ParsedBodyRoute
+from app.models.database import get_db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Create router with versioning
+router = APIRouter(prefix="/api/v2/webhooks", tags=["webhooks"], route_class=ParsedBodyRoute)
+
+@router.get(
+    "",
+    response_model=WebhookResponse,
+    summary="Get webhook settings",
+    description="Get the webhook URL and signing secret of the calling API key."
+)
+def get_webhook(
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """Get the webhook settings of the calling API key."""
+    require_api_key(request, api_key)
+    webhook = webhooks.get_key_webhook(db, request.state.api_key_id)
+    if not webhook:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "error": "webhook_not_found",
+                "code": "WEBHOOK_NOT_FOUND",
+                "message": "No webhook is configured for this API key."
+            }
+        )
+    return webhook
+
+@router.put(
+    "",
+    response_model=WebhookResponse,
+    summary="Configure webhook",
+    description="Set the callback URL for jobs submitted with the calling API key. A signing secret is created the first time."
+)
+def put_webhook(
+    webhook_request: WebhookRequest,
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """
+    Configure the webhook of the calling API key.
+
+    - **url**: Callback URL for jobs; omit to only get a signing secret for per-job URLs
+
+    Jobs submitted afterwards POST their results to the URL, signed with the
+    returned secret. Jobs already submitted keep their settings.
+    """
+    user_id = require_api_key(request, api_key)
+    url = str(webhook_request.url) if webhook_request.url else None
+    try:
+        return webhooks.configure_key_webhook(db, request.state.api_key_id, user_id, url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete(
+    "",
+    response_model=bool,
+    summary="Remove webhook",
+    description="Remove the webhook settings of the calling API key."
+)
+def delete_webhook(
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """Remove the webhook settings of the calling API key."""
+    require_api_key(request, api_key)
+    return webhooks.delete_key_webhook(db, request.state.api_key_id)
+
+@router.get(
+    "/dead-letters",
+    response_model=List[DeadLetterResponse],
+    summary="List undeliverable events",
+    description="List webhook events of your jobs that exhausted their delivery attempts, newest first."
+)
+def get_dead_letters(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000, description="Maximum events to return"),
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """List webhook events that could not be delivered."""
+    user_id = require_api_key(request, api_key)
+    return webhooks.list_dead_letters(db, user_id, limit)
+
+@router.post(
+    "/dead-letters/redeliver",
+    summary="Redeliver undeliverable events",
+    description="Queue all undeliverable events of your jobs for delivery again."
+)
+def redeliver_dead_letters(
+    request: Request,
+    api_key: str = Depends(validate_api_key),
+    db: Session = Depends(get_db)
+):
+    """Queue dead-lettered webhook events for delivery again."""
+    user_id = require_api_key(request, api_key)
+    return {"redelivered": webhooks.redeliver_dead_letters(db, user_id)}
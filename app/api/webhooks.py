@@ -0,0 +1,434 @@
+"""
+Webhook delivery of job results for ToxidAPI.
+
+Jobs with a callback URL get their results pushed instead of polled. Job
+processing only inserts delivery rows in the transaction that stores the
+results; a background dispatcher batches due deliveries per job into one
+signed POST, retries failures with exponential backoff and moves deliveries
+that exhaust their attempts to a dead-letter table. Delivery is
+at-least-once, so every POST carries a delivery ID receivers can use to
+drop duplicates.
+
+Requests are signed like this::
+
+    X-Toxid-Signature: t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<body>">
+
+using the secret of the API key's webhook settings.
+
+Callback URLs must be https and their host must resolve to public addresses
+only, so the server can't be pointed at itself, the cloud metadata service
+or the private network. URLs are checked when they are configured and again,
+with a fresh lookup, before every delivery. WEBHOOK_ALLOW_HTTP and
+WEBHOOK_ALLOW_PRIVATE_HOSTS lift these checks for local development.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import logging
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.api.responses import render_json, render_array
+from app.models.database import (
+    session_scope, DBJob, DBJobWebhook, DBWebhook, DBWebhookDeadLetter, DBWebhookDelivery, IS_SERVERLESS
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Webhook settings
+WEBHOOKS_ENABLED = os.getenv("WEBHOOKS_ENABLED", "false" if IS_SERVERLESS else "true").lower() == "true"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))  # dispatcher tasks per process
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))  # events per POST
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))  # seconds per POST
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))  # before dead-lettering
+WEBHOOK_RETRY_BASE = float(os.getenv("WEBHOOK_RETRY_BASE", "2"))  # seconds before the first retry
+WEBHOOK_RETRY_MAX = float(os.getenv("WEBHOOK_RETRY_MAX", "3600"))  # cap on the retry delay
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "1"))  # seconds between polls when idle
+
+# Development only: allow plain http callbacks, and callbacks to loopback or private hosts
+WEBHOOK_ALLOW_HTTP = os.getenv("WEBHOOK_ALLOW_HTTP", "false").lower() == "true"
+WEBHOOK_ALLOW_PRIVATE_HOSTS = os.getenv("WEBHOOK_ALLOW_PRIVATE_HOSTS", "false").lower() == "true"
+
+# A claimed batch is held for this long, so a crashed dispatcher's batch is retried
+_LEASE_SECONDS = WEBHOOK_TIMEOUT + 30
+
+# Signature header and tolerated clock skew for verification
+SIGNATURE_HEADER = "X-Toxid-Signature"
+SIGNATURE_TOLERANCE = 300
+
+# Serializes claims between the dispatchers of this process
+_claim_lock = threading.Lock()
+
+# Running dispatcher tasks
+_dispatcher_tasks: List[asyncio.Task] = []
+
+def sign(secret: str, body: bytes, timestamp: Optional[int] = None) -> str:
+    """Compute the signature header value for a request body."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), str(timestamp).encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def verify_signature(secret: str, header: str, body: bytes, tolerance: int = SIGNATURE_TOLERANCE) -> bool:
+    """
+    Verify a signature header, as a receiver would.
+
+    Args:
+        secret: The webhook secret
+        header: Value of the X-Toxid-Signature header
+        body: Raw request body
+        tolerance: Maximum age of the signature in seconds
+
+    Returns:
+        True if the signature matches and is recent enough
+    """
+    try:
+        parts = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(parts["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, body, timestamp), f"t={timestamp},v1={parts.get('v1', '')}")
+
+def resolve_host(host: str) -> List[str]:
+    """All addresses a host name resolves to."""
+    return list({info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)})
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def check_webhook_url(url: str) -> str:
+    """
+    Check that a callback URL is safe for the server to POST to.
+
+    Blocking: resolves the host name.
+
+    Args:
+        url: The callback URL
+
+    Returns:
+        The URL
+
+    Raises:
+        ValueError: If the scheme is not https (or http, when allowed), or
+            the host does not resolve or resolves to a non-public address
+    """
+    parts = urlsplit(url)
+    schemes = ("https", "http") if WEBHOOK_ALLOW_HTTP else ("https",)
+    if parts.scheme not in schemes:
+        raise ValueError(f"Webhook URLs must use {' or '.join(schemes)}")
+    if not parts.hostname:
+        raise ValueError("Webhook URL has no host")
+    if parts.username or parts.password:
+        raise ValueError("Webhook URLs must not contain credentials")
+    if WEBHOOK_ALLOW_PRIVATE_HOSTS:
+        return url
+    try:
+        addresses = resolve_host(parts.hostname)
+    except (OSError, UnicodeError):
+        raise ValueError(f"Webhook host {parts.hostname} could not be resolved")
+    if not addresses or not all(_is_public(address) for address in addresses):
+        raise ValueError(f"Webhook host {parts.hostname} is not a public address")
+    return url
+
+def get_key_webhook(db: Session, api_key_id: str) -> Optional[DBWebhook]:
+    """Get the webhook settings of an API key."""
+    return db.query(DBWebhook).filter(DBWebhook.api_key_id == api_key_id).first()
+
+def configure_key_webhook(db: Session, api_key_id: str, user_id: str, url: Optional[str]) -> DBWebhook:
+    """
+    Create or update the webhook settings of an API key; a new secret is generated on creation.
+
+    Raises:
+        ValueError: If the URL is not allowed (see check_webhook_url)
+    """
+    if url is not None:
+        check_webhook_url(url)
+    webhook = get_key_webhook(db, api_key_id)
+    if webhook is None:
+        webhook = DBWebhook(
+            id=str(uuid.uuid4()),
+            api_key_id=api_key_id,
+            user_id=user_id,
+            secret=f"whsec_{secrets.token_hex(24)}",
+            created_at=datetime.utcnow(),
+        )
+        db.add(webhook)
+    webhook.url = url
+    webhook.updated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(webhook)
+    return webhook
+
+def delete_key_webhook(db: Session, api_key_id: str) -> bool:
+    """Remove the webhook settings of an API key; jobs already submitted keep theirs."""
+    deleted = db.query(DBWebhook).filter(DBWebhook.api_key_id == api_key_id).delete()
+    db.commit()
+    return deleted > 0
+
+def resolve_job_webhook(db: Session, api_key_id: str, url: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Determine the callback for a new job.
+
+    Args:
+        db: Database session
+        api_key_id: The submitting API key
+        url: Callback URL given with the job, overriding the key's default
+
+    Returns:
+        Tuple of (url, secret), or None when the job has no callback
+
+    Raises:
+        ValueError: If a URL is given but the key has no webhook secret, or the URL is not allowed
+    """
+    webhook = get_key_webhook(db, api_key_id)
+    if url is None:
+        return (webhook.url, webhook.secret) if webhook and webhook.url else None
+    if webhook is None:
+        raise ValueError("Configure a webhook for this API key first (PUT /api/v2/webhooks) to get a signing secret")
+    return check_webhook_url(url), webhook.secret
+
+def enqueue(db: Session, job_id: str, event: str, payloads: List[bytes]) -> None:
+    """
+    Queue events for delivery if the job has a callback.
+
+    Runs inside the caller's transaction and never touches the network.
+    """
+    if not payloads or db.get(DBJobWebhook, job_id) is None:
+        return
+    now = datetime.utcnow()
+    db.execute(insert(DBWebhookDelivery), [
+        {"job_id": job_id, "event": event, "payload": payload.decode("utf-8"),
+         "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for payload in payloads
+    ])
+
+def claim_batch(size: int = WEBHOOK_BATCH_SIZE) -> Optional[Tuple[DBJobWebhook, List[DBWebhookDelivery]]]:
+    """
+    Claim up to size due deliveries of one job.
+
+    Returns:
+        Tuple of (job webhook, deliveries in queue order) or None when nothing is due
+    """
+    with _claim_lock, session_scope() as db:
+        now = datetime.utcnow()
+        due = (
+            db.query(DBWebhookDelivery.job_id)
+            .filter(DBWebhookDelivery.next_attempt_at <= now)
+            .order_by(DBWebhookDelivery.next_attempt_at)
+            .first()
+        )
+        if due is None:
+            return None
+
+        ids = [
+            row.id for row in db.query(DBWebhookDelivery.id)
+            .filter(DBWebhookDelivery.job_id == due.job_id, DBWebhookDelivery.next_attempt_at <= now)
+            .order_by(DBWebhookDelivery.id)
+            .limit(size)
+        ]
+        # Push the due time past the lease; rows claimed by another dispatcher are skipped
+        lease = now + timedelta(seconds=_LEASE_SECONDS)
+        db.execute(
+            update(DBWebhookDelivery)
+            .where(DBWebhookDelivery.id.in_(ids), DBWebhookDelivery.next_attempt_at <= now)
+            .values(next_attempt_at=lease)
+        )
+        db.commit()
+
+        deliveries = (
+            db.query(DBWebhookDelivery)
+            .filter(DBWebhookDelivery.id.in_(ids), DBWebhookDelivery.next_attempt_at == lease)
+            .order_by(DBWebhookDelivery.id)
+            .all()
+        )
+        target = db.get(DBJobWebhook, due.job_id)
+        db.expunge_all()
+        if target is None:
+            # The callback was removed along with the job
+            _finish(deliveries)
+            return None
+        return (target, deliveries) if deliveries else None
+
+def render_body(delivery_id: str, job_id: str, deliveries: List[DBWebhookDelivery]) -> bytes:
+    """
+    Render the POST body for a batch of deliveries.
+
+    Results are listed in ``results``; a completion or cancellation event
+    in the batch is reported as ``job``.
+    """
+    results = [d.payload.encode("utf-8") for d in deliveries if d.event == "job.result"]
+    states = [d.payload.encode("utf-8") for d in deliveries if d.event != "job.result"]
+    return (
+        b'{"delivery_id":' + render_json(delivery_id)
+        + b',"job_id":' + render_json(job_id)
+        + b',"results":' + render_array(results)
+        + b',"job":' + (states[-1] if states else b"null") + b"}"
+    )
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the given number of failed attempts."""
+    delay = min(WEBHOOK_RETRY_MAX, WEBHOOK_RETRY_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def _finish(deliveries: List[DBWebhookDelivery]) -> None:
+    with session_scope() as db:
+        db.query(DBWebhookDelivery).filter(
+            DBWebhookDelivery.id.in_([d.id for d in deliveries])
+        ).delete(synchronize_session=False)
+        db.commit()
+
+def _fail(deliveries: List[DBWebhookDelivery], error: str) -> None:
+    """Schedule a retry, or dead-letter deliveries that are out of attempts."""
+    now = datetime.utcnow()
+    # Events that joined the batch later have fewer attempts behind them
+    by_attempts = {}
+    for delivery in deliveries:
+        by_attempts.setdefault(delivery.attempts + 1, []).append(delivery)
+
+    with session_scope() as db:
+        for attempts, group in by_attempts.items():
+            ids = [d.id for d in group]
+            if attempts >= WEBHOOK_MAX_ATTEMPTS:
+                db.execute(insert(DBWebhookDeadLetter), [
+                    {"job_id": d.job_id, "event": d.event, "payload": d.payload, "attempts": attempts,
+                     "last_error": error, "created_at": d.created_at, "failed_at": now}
+                    for d in group
+                ])
+                db.query(DBWebhookDelivery).filter(DBWebhookDelivery.id.in_(ids)).delete(synchronize_session=False)
+                logger.warning(f"Dead-lettered {len(ids)} webhook events of job {group[0].job_id}: {error}")
+            else:
+                db.execute(
+                    update(DBWebhookDelivery)
+                    .where(DBWebhookDelivery.id.in_(ids))
+                    .values(
+                        attempts=attempts,
+                        last_error=error,
+                        next_attempt_at=now + timedelta(seconds=retry_delay(attempts)),
+                    )
+                )
+        db.commit()
+
+async def deliver_next_batch(client: httpx.AsyncClient, size: int = WEBHOOK_BATCH_SIZE) -> int:
+    """
+    Claim and POST one batch of due deliveries.
+
+    Args:
+        client: HTTP client to deliver with
+        size: Maximum events per POST
+
+    Returns:
+        Number of events in the batch (0 when nothing was due)
+    """
+    claimed = await run_in_threadpool(claim_batch, size)
+    if claimed is None:
+        return 0
+
+    target, deliveries = claimed
+    body = render_body(str(uuid.uuid4()), target.job_id, deliveries)
+    try:
+        # The host may resolve elsewhere than when the URL was accepted
+        await run_in_threadpool(check_webhook_url, target.url)
+    except ValueError as e:
+        error = f"Blocked: {str(e)}"
+        logger.warning(f"Webhook delivery for job {target.job_id} blocked: {str(e)}")
+        await run_in_threadpool(_fail, deliveries, error)
+        return len(deliveries)
+    try:
+        response = await client.post(
+            target.url,
+            content=body,
+            headers={"Content-Type": "application/json", SIGNATURE_HEADER: sign(target.secret, body)},
+            timeout=WEBHOOK_TIMEOUT,
+        )
+        error = None if response.is_success else f"HTTP {response.status_code}"
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {str(e)}"
+
+    if error is None:
+        await run_in_threadpool(_finish, deliveries)
+    else:
+        logger.info(f"Webhook delivery for job {target.job_id} failed: {error}")
+        await run_in_threadpool(_fail, deliveries, error)
+    return len(deliveries)
+
+def list_dead_letters(db: Session, user_id: str, limit: int = 100) -> List[DBWebhookDeadLetter]:
+    """Get the most recent dead-lettered events of a user's jobs."""
+    return (
+        db.query(DBWebhookDeadLetter)
+        .join(DBJob, DBJob.id == DBWebhookDeadLetter.job_id)
+        .filter(DBJob.user_id == user_id)
+        .order_by(DBWebhookDeadLetter.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+def redeliver_dead_letters(db: Session, user_id: str) -> int:
+    """Move a user's dead-lettered events back to the delivery queue; returns how many."""
+    letters = (
+        db.query(DBWebhookDeadLetter)
+        .join(DBJob, DBJob.id == DBWebhookDeadLetter.job_id)
+        .filter(DBJob.user_id == user_id)
+        .all()
+    )
+    if not letters:
+        return 0
+    now = datetime.utcnow()
+    db.execute(insert(DBWebhookDelivery), [
+        {"job_id": letter.job_id, "event": letter.event, "payload": letter.payload,
+         "attempts": 0, "next_attempt_at": now, "created_at": letter.created_at}
+        for letter in letters
+    ])
+    for letter in letters:
+        db.delete(letter)
+    db.commit()
+    return len(letters)
+
+async def _dispatcher_loop(worker_id: int) -> None:
+    logger.info(f"Webhook dispatcher {worker_id} started")
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                delivered = await deliver_next_batch(client)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook dispatcher {worker_id} error: {str(e)}")
+                delivered = 0
+
+            if not delivered:
+                await asyncio.sleep(WEBHOOK_POLL_INTERVAL)
+
+def start_dispatchers() -> None:
+    """Start the webhook dispatchers on the running event loop."""
+    if not WEBHOOKS_ENABLED:
+        logger.info("Webhook dispatchers disabled (WEBHOOKS_ENABLED=false)")
+        return
+    for worker_id in range(WEBHOOK_WORKERS):
+        _dispatcher_tasks.append(asyncio.create_task(_dispatcher_loop(worker_id)))
+
+async def stop_dispatchers() -> None:
+    """Cancel the webhook dispatchers; claimed batches are retried after their lease."""
+    for task in _dispatcher_tasks:
+        task.cancel()
+    await asyncio.gather(*_dispatcher_tasks, return_exceptions=True)
+    _dispatcher_tasks.clear()
@@ -0,0 +1,403 @@
+"""
+Command-line tools for ToxidAPI.
+
+Usage:
+    python -m app.cli analyze comments.csv --output results.jsonl
+    python -m app.cli analyze export.jsonl --output results --output-format parquet
+    python -m app.cli migrate [--check]
+
+``analyze`` runs the configured analyzer backend over a CSV or JSON Lines file
+without going through HTTP. Input is streamed, texts are analyzed across a
+thread or process pool through the shared result cache, and results are
+written incrementally in input order. A checkpoint file records how far the
+output is complete, so an interrupted run picks up where it stopped when the
+same command is run again.
+
+``migrate`` brings the database schema (DATABASE_URL) up to date; run it once
+per deploy when the app is started with DB_AUTO_MIGRATE=false. With
+``--check`` it only reports whether migrations are pending, exiting with 1
+if they are.
+"""
+
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.core import config  # noqa: F401  (loads .env before the analyzer reads its settings)
+from app.api import analysis
+from app.api.cache import CacheEntry
+from app.api.responses import render_json
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Optional Parquet support
+try:
+    import pyarrow
+    import pyarrow.parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+# Defaults
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CHECKPOINT_EVERY = 1000  # records per checkpoint (and per Parquet part file)
+
+def read_texts(path: str, input_format: str, text_column: str = "text") -> Iterator[Optional[str]]:
+    """
+    Stream texts from a CSV or JSON Lines file.
+
+    JSON Lines records may be strings or objects with a text field. Records
+    without a usable text are yielded as None so that record indices stay
+    aligned with the input.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if input_format == "csv":
+            reader = csv.DictReader(f)
+            if text_column not in (reader.fieldnames or []):
+                raise ValueError(f"CSV file has no '{text_column}' column")
+            for row in reader:
+                yield row[text_column]
+            return
+
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            if isinstance(value, dict):
+                value = value.get(text_column)
+            yield value if isinstance(value, str) else None
+
+def _analyze(text: str) -> Tuple[Optional[Dict[str, Any]], Optional[str], float]:
+    """Run the analyzer in a pool worker; returns (result, error, seconds)."""
+    start_time = time.perf_counter()
+    try:
+        return analysis.analyzer.analyze(text), None, time.perf_counter() - start_time
+    except Exception as e:
+        # Return the message; arbitrary exceptions may not pickle across processes
+        return None, str(e), time.perf_counter() - start_time
+
+def analyze_records(
+    texts: Iterator[Optional[str]],
+    executor: Executor,
+    start_index: int = 0,
+    window: int = 64
+) -> Iterator[Tuple[int, Optional[str], Dict[str, Any]]]:
+    """
+    Analyze texts on executor, yielding outcomes in input order.
+
+    Up to window records are in flight at once. Texts already in the result
+    cache, or already in flight, are not submitted again.
+
+    Yields:
+        Tuples of (index, text, outcome), where outcome has the same shape as
+        the items returned by analysis.analyze_batch
+    """
+    pending = deque()
+    in_flight: Dict[str, Future] = {}
+
+    def resolve(text: Optional[str], source: Any) -> Dict[str, Any]:
+        if source is None:
+            return {
+                "status": "error",
+                "error": {"code": "INVALID_ITEM", "message": "Record has no text"},
+                "processing_time": 0.0,
+            }
+        if isinstance(source, CacheEntry):
+            return {"status": "ok", "entry": source, "processing_time": 0.0}
+
+        result, error, processing_time = source.result()
+        if in_flight.get(text) is source:
+            del in_flight[text]
+        if error is not None:
+            return {
+                "status": "error",
+                "error": {"code": "ANALYSIS_FAILED", "message": error},
+                "processing_time": processing_time,
+            }
+        entry = analysis.result_cache.get(text) or analysis.result_cache.put(text, result)
+        return {"status": "ok", "entry": entry, "processing_time": processing_time}
+
+    for index, text in enumerate(texts, start_index):
+        if text is None:
+            source = None
+        else:
+            source = analysis.result_cache.get(text) or in_flight.get(text)
+            if source is None:
+                source = in_flight[text] = executor.submit(_analyze, text)
+        pending.append((index, text, source))
+
+        if len(pending) >= window:
+            index, text, source = pending.popleft()
+            yield index, text, resolve(text, source)
+
+    while pending:
+        index, text, source = pending.popleft()
+        yield index, text, resolve(text, source)
+
+def _render_outcome(index: int, text: Optional[str], outcome: Dict[str, Any]) -> bytes:
+    if outcome["status"] == "ok":
+        extra = b',"index":' + str(index).encode() + b',"status":"ok"'
+        return outcome["entry"].render(outcome["processing_time"], extra=extra)
+    return render_json({
+        "index": index,
+        "status": "error",
+        "error": outcome["error"],
+        "text": text,
+        "processing_time": outcome["processing_time"],
+    })
+
+class JSONLWriter:
+    """
+    Append rendered results to a JSON Lines file.
+
+    Args:
+        path: Output file
+        state: Checkpoint state from a previous run, or None to start over
+    """
+    def __init__(self, path: str, state: Optional[Dict[str, Any]] = None):
+        self.path = path
+        if state and not os.path.exists(path):
+            raise ValueError(f"Output {path} is missing; use --restart to start over")
+        self._file = open(path, "r+b" if state else "wb")
+        # Drop anything written after the last checkpoint
+        self._file.truncate(state["output_bytes"] if state else 0)
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, index: int, text: Optional[str], outcome: Dict[str, Any]) -> None:
+        self._file.write(_render_outcome(index, text, outcome) + b"\n")
+
+    def flush(self) -> Dict[str, Any]:
+        """Make written results durable and return the writer's checkpoint state."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"output_bytes": self._file.tell()}
+
+    def close(self) -> None:
+        self._file.close()
+
+class ParquetWriter:
+    """
+    Write results as a directory of Parquet part files, one per checkpoint.
+
+    Columns hold the headline scores; the full analysis is kept as JSON in
+    the ``result`` column.
+
+    Args:
+        path: Output directory
+        state: Checkpoint state from a previous run, or None to start over
+    """
+    COLUMNS = (
+        "index", "status", "text", "processing_time", "error",
+        "toxicity_score", "is_toxic", "sentiment_score", "sentiment_label",
+        "profanity_score", "is_profane", "sensitivity_score", "is_sensitive",
+        "flagged_words_count", "result",
+    )
+
+    def __init__(self, path: str, state: Optional[Dict[str, Any]] = None):
+        if not PYARROW_AVAILABLE:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.part = state["parts"] if state else 0
+        # Remove parts beyond the checkpoint, or all parts when starting over
+        for name in glob.glob(os.path.join(path, "part-*.parquet")):
+            if int(os.path.basename(name)[5:-8]) >= self.part:
+                os.remove(name)
+        self._columns = {name: [] for name in self.COLUMNS}
+
+    def write(self, index: int, text: Optional[str], outcome: Dict[str, Any]) -> None:
+        result = outcome["entry"].result if outcome["status"] == "ok" else None
+        row = {
+            "index": index,
+            "status": outcome["status"],
+            "text": text,
+            "processing_time": outcome["processing_time"],
+            "error": outcome["error"]["message"] if result is None else None,
+            "result": outcome["entry"].body.decode("utf-8") if result is not None else None,
+        }
+        if result is not None:
+            row.update({
+                "toxicity_score": result["toxicity"]["score"],
+                "is_toxic": result["toxicity"]["is_toxic"],
+                "sentiment_score": result["sentiment"]["score"],
+                "sentiment_label": result["sentiment"]["label"],
+                "profanity_score": result["profanity"]["score"],
+                "is_profane": result["profanity"]["is_profane"],
+                "sensitivity_score": result["sensitivity"]["score"],
+                "is_sensitive": result["sensitivity"]["is_sensitive"],
+                "flagged_words_count": result["flagged_words"]["count"],
+            })
+        for name, values in self._columns.items():
+            values.append(row.get(name))
+
+    def flush(self) -> Dict[str, Any]:
+        """Write buffered rows as the next part file and return the checkpoint state."""
+        if self._columns["index"]:
+            name = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+            pyarrow.parquet.write_table(pyarrow.table(self._columns), name + ".tmp")
+            os.replace(name + ".tmp", name)
+            self.part += 1
+            self._columns = {name: [] for name in self.COLUMNS}
+        return {"parts": self.part}
+
+    def close(self) -> None:
+        pass
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def save_checkpoint(path: str, state: Dict[str, Any]) -> None:
+    # Write then rename, so a crash never leaves a torn checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def run_analyze(args: argparse.Namespace) -> int:
+    """Run the analyze command; returns the number of failed records."""
+    input_format = args.input_format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    analysis.result_cache.max_size = args.cache_size
+
+    state = None if args.restart else load_checkpoint(checkpoint_path)
+    if state is not None:
+        if state["input"] != os.path.abspath(args.input) or state["output_format"] != args.output_format:
+            raise ValueError(f"Checkpoint {checkpoint_path} belongs to a different run; use --restart")
+        logger.info(f"Resuming after {state['records']} records")
+
+    writer_class = ParquetWriter if args.output_format == "parquet" else JSONLWriter
+    writer = writer_class(args.output, state)
+
+    texts = read_texts(args.input, input_format, args.text_column)
+    start_index = state["records"] if state else 0
+    for _ in range(start_index):
+        next(texts, None)
+
+    executor_class = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+    workers = args.workers or (
+        (os.cpu_count() or 1) if args.executor == "process" else analysis.ANALYZER_CONCURRENCY
+    )
+
+    failed = state.get("failed", 0) if state else 0
+    records = start_index
+    start_time = time.time()
+
+    def checkpoint() -> None:
+        save_checkpoint(checkpoint_path, {
+            "input": os.path.abspath(args.input),
+            "output_format": args.output_format,
+            "records": records,
+            "failed": failed,
+            **writer.flush(),
+        })
+
+    try:
+        with executor_class(max_workers=workers) as executor:
+            for index, text, outcome in analyze_records(texts, executor, start_index, window=workers * 4):
+                writer.write(index, text, outcome)
+                records = index + 1
+                if outcome["status"] != "ok":
+                    failed += 1
+                if records % args.checkpoint_every == 0:
+                    checkpoint()
+                    logger.info(f"Processed {records} records ({failed} failed)")
+        checkpoint()
+    finally:
+        writer.close()
+
+    # The run is complete; a rerun should start over
+    os.remove(checkpoint_path)
+    logger.info(
+        f"Analyzed {records - start_index} records in {time.time() - start_time:.1f}s "
+        f"({records} total, {failed} failed), results in {args.output}"
+    )
+    return failed
+
+def run_migrate(args: argparse.Namespace) -> int:
+    """Apply pending schema migrations, or with --check only report them; returns the exit status."""
+    from app.models import database, migrations
+
+    engine = database.create_db_engine(fallback=False)
+    try:
+        with engine.connect() as conn:
+            version = migrations.current_version(conn)
+        if args.check:
+            pending = version < migrations.SCHEMA_VERSION
+            logger.info(
+                f"Database schema is at version {version}, current is {migrations.SCHEMA_VERSION}"
+                + ("; migrations are pending" if pending else "")
+            )
+            return 1 if pending else 0
+        applied = migrations.migrate(engine)
+        if applied:
+            logger.info(f"Applied migrations {', '.join(map(str, applied))}; schema is at version {migrations.SCHEMA_VERSION}")
+        else:
+            logger.info(f"Database schema is up to date (version {version})")
+        return 0
+    finally:
+        engine.dispose()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="ToxidAPI command-line tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    analyze = commands.add_parser("analyze", help="Analyze a CSV or JSON Lines file offline")
+    analyze.add_argument("input", help="Input file (.csv, or JSON Lines of strings or objects)")
+    analyze.add_argument("-o", "--output", required=True, help="Output file (jsonl) or directory (parquet)")
+    analyze.add_argument("--input-format", choices=["csv", "jsonl"], help="Input format (default: from the file extension)")
+    analyze.add_argument("--output-format", choices=["jsonl", "parquet"], default="jsonl", help="Output format (default: jsonl)")
+    analyze.add_argument("--text-column", default="text", help="CSV column or JSON field holding the text (default: text)")
+    analyze.add_argument(
+        "--executor", choices=["thread", "process"], default="thread",
+        help="Pool type: threads suit remote backends such as Gemini, processes suit CPU-bound local backends"
+    )
+    analyze.add_argument("--workers", type=int, help="Pool size (default: ANALYZER_CONCURRENCY threads or one process per CPU)")
+    analyze.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="Result cache entries (default: %(default)s)")
+    analyze.add_argument("--checkpoint", help="Checkpoint file (default: OUTPUT.checkpoint)")
+    analyze.add_argument(
+        "--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+        help="Records between checkpoints (default: %(default)s)"
+    )
+    analyze.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+
+    migrate = commands.add_parser("migrate", help="Apply pending database schema migrations")
+    migrate.add_argument("--check", action="store_true", help="Only report whether migrations are pending (exit status 1 if so)")
+    return parser
+
+def main(argv: Optional[list] = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    try:
+        if args.command == "migrate":
+            return run_migrate(args)
+        failed = run_analyze(args)
+    except (OSError, RuntimeError, ValueError, SQLAlchemyError) as e:
+        logger.error(str(e))
+        return 2
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,8 @@ import logging
 import json
 from pathlib import Path
 
+from app.core.local_store import ExpiringStore
+
 logger = logging.getLogger(__name__)
 
 # API key header
@@ -16,6 +18,9 @@ API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
 # Path to the API keys file
 API_KEYS_FILE = Path("api_keys.json")
 
+# Keys with hourly request counts kept in memory
+API_KEY_COUNTS_MAX_KEYS = int(os.getenv("API_KEY_COUNTS_MAX_KEYS", "100000"))
+
 class ApiKey(BaseModel):
     key: str
     user_id: str
@@ -28,7 +33,8 @@ class ApiKey(BaseModel):
 class ApiKeyManager:
     def __init__(self):
         self.api_keys: Dict[str, ApiKey] = {}
-        self.request_counts: Dict[str, Dict[str, int]] = {}  # key -> {hour -> count}
+        # key -> (hour, count), expiring at the end of the hour
+        self.request_counts = ExpiringStore(API_KEY_COUNTS_MAX_KEYS, resolution=60, name="api_key_counts")
         self.load_api_keys()
     
     def load_api_keys(self):
@@ -89,20 +95,16 @@ class ApiKeyManager:
             return False
         
         key_data = self.api_keys[api_key]
-        current_hour = int(time.time() / 3600)
-        
-        if api_key not in self.request_counts:
-            self.request_counts[api_key] = {}
-        
-        if current_hour not in self.request_counts[api_key]:
-            # Clean up old hours
-            self.request_counts[api_key] = {current_hour: 0}
+        now = time.time()
+        current_hour = int(now / 3600)
         
-        # Increment request count
-        self.request_counts[api_key][current_hour] += 1
+        def increment(value):
+            # Start a new count when the hour changes
+            count = value[1] + 1 if value is not None and value[0] == current_hour else 1
+            return count, (current_hour, count), (current_hour + 1) * 3600
         
         # Check if rate limit exceeded
-        return self.request_counts[api_key][current_hour] <= key_data.rate_limit
+        return self.request_counts.update(api_key, increment, now) <= key_data.rate_limit
     
     def create_api_key(self, user_id: str, name: str, rate_limit: int = 100, permissions: List[str] = ["analyze"]) -> ApiKey:
         """Create a new API key"""
@@ -0,0 +1,154 @@
+"""
+Bounded, expiring in-process store for local counters.
+
+Used for state that lives in Redis when it is available but has to be kept
+per process otherwise, such as rate-limit counters. Entries expire, and the
+store never holds more than ``max_size`` keys, however many distinct clients
+it sees.
+"""
+
+import heapq
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.metrics import LOCAL_STORE_EVICTIONS
+
+# Expired keys removed per operation, so one call never pays for a large backlog
+SWEEP_BATCH = 256
+
+class ExpiringStore:
+    """
+    Thread-safe key -> value map with per-entry expiry and a size bound.
+
+    Expiry is tracked with a timing wheel of ``resolution``-wide slots that is
+    swept a little on every write; when the store is full, the least recently
+    written key is evicted. Times are in whatever unit the caller uses for
+    ``now`` and ``expires_at`` (e.g. milliseconds), as long as it is the same
+    throughout.
+
+    Args:
+        max_size: Maximum number of keys
+        resolution: Width of a wheel slot; entries are removed at most this long after expiring
+        name: Label for the eviction metric
+    """
+    def __init__(self, max_size: int, resolution: float = 1000, name: str = "local"):
+        self.max_size = max_size
+        self.resolution = resolution
+        self.name = name
+        self._evictions = LOCAL_STORE_EVICTIONS.labels(store=name)
+        # key -> (expires_at, value, wheel slot the key is filed under)
+        self._entries: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        # slot -> keys filed under it, and a heap of the slots in use
+        self._wheel: Dict[int, List[str]] = {}
+        self._slots: List[int] = []
+        # References held by the wheel, including stale ones for evicted or refiled keys
+        self._filed = 0
+        self._lock = threading.Lock()
+
+    def _slot(self, expires_at: float) -> int:
+        return int(expires_at // self.resolution)
+
+    def _file(self, key: str, expires_at: float) -> int:
+        slot = self._slot(expires_at)
+        keys = self._wheel.get(slot)
+        if keys is None:
+            keys = self._wheel[slot] = []
+            heapq.heappush(self._slots, slot)
+        keys.append(key)
+        self._filed += 1
+        return slot
+
+    def _compact(self) -> None:
+        # Rebuild the wheel from live entries, so stale references (and the
+        # evicted keys they keep alive) can't outgrow the store itself
+        self._wheel = {}
+        for key, (_, _, slot) in self._entries.items():
+            self._wheel.setdefault(slot, []).append(key)
+        self._slots = list(self._wheel)
+        heapq.heapify(self._slots)
+        self._filed = len(self._entries)
+
+    def _sweep(self, now: float, budget: int) -> None:
+        current = self._slot(now)
+        while self._slots and self._slots[0] < current and budget > 0:
+            slot = self._slots[0]
+            keys = self._wheel[slot]
+            while keys and budget > 0:
+                budget -= 1
+                self._filed -= 1
+                key = keys.pop()
+                entry = self._entries.get(key)
+                if entry is None or entry[2] != slot:
+                    # Removed, or filed under another slot since
+                    continue
+                if entry[0] <= now:
+                    del self._entries[key]
+                else:
+                    # Expiry was extended after filing; move it along lazily
+                    self._entries[key] = (entry[0], entry[1], self._file(key, entry[0]))
+            if not keys:
+                heapq.heappop(self._slots)
+                del self._wheel[slot]
+
+    def get(self, key: str, now: float) -> Optional[Any]:
+        """Return the value for key, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry[1]
+
+    def update(self, key: str, func: Callable[[Optional[Any]], Tuple[Any, Any, float]], now: float) -> Any:
+        """
+        Atomically read, modify and write the value for key.
+
+        Args:
+            key: Key to update
+            func: Called with the current value (None if missing or expired);
+                returns ``(result, new_value, expires_at)``
+            now: Current time
+
+        Returns:
+            The result returned by func
+        """
+        with self._lock:
+            self._sweep(now, SWEEP_BATCH)
+            entry = self._entries.get(key)
+            current = entry[1] if entry is not None and entry[0] > now else None
+            result, value, expires_at = func(current)
+            if entry is not None and entry[0] > now and self._slot(expires_at) >= entry[2]:
+                slot = entry[2]
+            else:
+                slot = self._file(key, expires_at)
+            if entry is not None:
+                # Keep iteration order least recently written first
+                self._entries.move_to_end(key)
+            elif len(self._entries) >= self.max_size:
+                # Remove least recently written entry
+                self._entries.popitem(last=False)
+                self._evictions.inc()
+            self._entries[key] = (expires_at, value, slot)
+            if self._filed > 2 * len(self._entries) + SWEEP_BATCH:
+                self._compact()
+            return result
+
+    def delete(self, key: str) -> bool:
+        """Remove key; returns whether it was present."""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def sweep(self, now: float) -> int:
+        """Remove every expired entry and return how many keys remain."""
+        with self._lock:
+            self._sweep(now, len(self._entries) + sum(len(keys) for keys in self._wheel.values()))
+            return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._wheel.clear()
+            self._slots.clear()
+            self._filed = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,112 @@
+"""
+Prometheus metrics for ToxidAPI.
+
+Metrics are defined here so every module shares one registry. When
+prometheus-client is not installed the metrics become no-ops and the
+/metrics endpoint reports that metrics are unavailable.
+"""
+
+import logging
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    logger.warning("prometheus-client not installed. Metrics are disabled.")
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; charset=utf-8"
+
+    class _NoopMetric:
+        """Stand-in that accepts the prometheus-client metric API and does nothing."""
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def labels(self, *args, **kwargs):
+            return self
+
+        def inc(self, amount=1):
+            pass
+
+        def dec(self, amount=1):
+            pass
+
+        def set(self, value):
+            pass
+
+        def observe(self, value):
+            pass
+
+    Counter = Gauge = Histogram = _NoopMetric
+
+    def generate_latest():
+        return b""
+
+# Analyzer
+ANALYZER_RESPONSES = Counter(
+    "toxidapi_analyzer_responses_total",
+    "Model responses by output mode and parse outcome (parsed, failed, upstream_error)",
+    ["mode", "outcome"],
+)
+ANALYZER_PROMPT_TOKENS = Counter(
+    "toxidapi_analyzer_prompt_tokens_total",
+    "Prompt tokens sent to the model, as reported by the upstream",
+    ["mode"],
+)
+ANALYZER_OUTPUT_TOKENS = Counter(
+    "toxidapi_analyzer_output_tokens_total",
+    "Output tokens generated by the model, as reported by the upstream",
+    ["mode"],
+)
+
+# Redis
+REDIS_UP = Gauge(
+    "toxidapi_redis_up",
+    "1 while shared state is kept in Redis, 0 while using the in-process fallback",
+)
+REDIS_MODE_CHANGES = Counter(
+    "toxidapi_redis_mode_changes_total",
+    "Switches between Redis and the in-process fallback, by the mode switched to",
+    ["mode"],
+)
+REDIS_RECONNECT_ATTEMPTS = Counter(
+    "toxidapi_redis_reconnect_attempts_total",
+    "Background reconnect attempts while Redis is down, by outcome",
+    ["outcome"],
+)
+REDIS_FALLBACKS = Counter(
+    "toxidapi_redis_fallbacks_total",
+    "Operations served in-process because Redis was unavailable",
+    ["operation"],
+)
+
+# In-process stores
+LOCAL_STORE_EVICTIONS = Counter(
+    "toxidapi_local_store_evictions_total",
+    "Live entries evicted from bounded in-process stores to stay within capacity",
+    ["store"],
+)
+
+# Concurrency limits
+CONCURRENCY_REJECTIONS = Counter(
+    "toxidapi_concurrency_rejections_total",
+    "Requests rejected because the client had too many requests in flight, by tier",
+    ["tier"],
+)
+
+# Usage event log
+USAGE_EVENTS_WRITTEN = Counter(
+    "toxidapi_usage_events_written_total",
+    "Per-request usage events written to the database",
+)
+USAGE_EVENTS_DROPPED = Counter(
+    "toxidapi_usage_events_dropped_total",
+    "Per-request usage events lost, by reason (queue_full, write_failed)",
+    ["reason"],
+)
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Return the exposition payload and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
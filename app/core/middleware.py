@@ -0,0 +1,426 @@
+"""
+ASGI middleware for ToxidAPI.
+
+These are plain ASGI middleware rather than ``@app.middleware("http")``
+functions: BaseHTTPMiddleware re-wraps every response in a streaming
+response that listens for disconnects on the request's receive channel,
+which steals request body chunks from endpoints that stream their input,
+and it adds per-request task overhead.
+"""
+
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.api import concurrency, idempotency, rate_limiter, usage, usage_events
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ProcessTimeMiddleware:
+    """Add an X-Process-Time header: seconds until the response started."""
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.time()
+
+        async def send_with_process_time(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Process-Time", str(time.time() - start_time))
+            await send(message)
+
+        await self.app(scope, receive, send_with_process_time)
+
+class UsageEventMiddleware:
+    """
+    Log every API request to the usage event log once its response is sent.
+
+    Latency covers the whole response, including streamed bodies. The record
+    is only queued here; see app.api.usage_events for how it is written.
+
+    Args:
+        app: The ASGI app
+        log: UsageEventLog to queue records on
+        prefix: Only paths under this prefix are logged
+    """
+    def __init__(self, app: ASGIApp, log, prefix: str = "/api/v2/"):
+        self.app = app
+        self.log = log
+        self.prefix = prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status = 500
+        replayed = False
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status, replayed
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                replayed = any(name == b"idempotent-replayed" for name, _ in message.get("headers", []))
+            await send(message)
+
+        # Resolved once here for every inner middleware and the routes
+        key_info = await rate_limiter.lookup_api_key(scope)
+        token = usage_events.begin_request()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_usage = usage_events.end_request(token)
+            try:
+                self.log.record(
+                    key_info.id if key_info is not None else None,
+                    usage_events.endpoint_for(scope),
+                    scope["method"],
+                    status,
+                    request_usage,
+                    time.perf_counter() - start_time,
+                    replayed=replayed,
+                )
+            except Exception as e:
+                logger.error(f"Error logging usage event: {str(e)}")
+
+# Headers that describe a request's rate-limit and quota budget
+_BUDGET_HEADER_PREFIXES = (b"x-rate-limit-", b"x-quota-")
+
+class IdempotencyMiddleware:
+    """
+    Replay stored responses for retried requests with an Idempotency-Key.
+
+    Runs ahead of the routes, so a replay costs neither an analysis nor
+    rate-limit budget. The X-Rate-Limit-* and X-Quota-* headers describe the
+    original request's budget, so they are not stored and replays carry none.
+    See app.api.idempotency for the semantics.
+
+    Args:
+        app: The ASGI app
+        store: Idempotency record store
+        paths: POST paths that honour the header
+    """
+    def __init__(self, app: ASGIApp, store, paths: Iterable[str]):
+        self.app = app
+        self.store = store
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        idempotency_key = headers.get("idempotency-key")
+        if idempotency_key is None:
+            await self.app(scope, receive, send)
+            return
+        if not 0 < len(idempotency_key) <= 255:
+            await _send_json(send, 400, {"detail": "Idempotency-Key must be 1 to 255 characters"})
+            return
+
+        # Buffer the body: it is fingerprinted, then replayed to the app
+        body = await _read_body(receive)
+        if body is None:
+            return
+
+        # Scope keys to the caller and endpoint; never store raw API keys
+        api_key = headers.get("x-api-key")
+        caller = f"key:{api_key}" if api_key else f"ip:{scope['client'][0] if scope.get('client') else 'unknown'}"
+        caller_hash = hashlib.sha256(caller.encode()).hexdigest()[:32]
+        key = f"idempotency:{caller_hash}:{scope['path']}:{idempotency_key}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+        owner = uuid.uuid4().hex
+
+        deadline = time.monotonic() + idempotency.IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            record = await self.store.begin(key, fingerprint, owner)
+            if record is None:
+                break
+            if record["fingerprint"] != fingerprint:
+                await _send_json(send, 422, {"detail": {
+                    "error": "idempotency_key_reused",
+                    "code": "IDEMPOTENCY_KEY_REUSED",
+                    "message": "This Idempotency-Key was used with a different request body."
+                }})
+                return
+            if record["state"] == "in_flight":
+                # Wait for the original; if it gives up, try to claim the key again
+                record = await self.store.wait(key, max(0.0, deadline - time.monotonic()))
+                if record is None:
+                    continue
+            if record["state"] == "done" and record["fingerprint"] == fingerprint:
+                await _replay(send, record)
+                return
+            if record["state"] == "in_flight" and time.monotonic() >= deadline:
+                await _send_json(send, 409, {"detail": {
+                    "error": "idempotency_key_in_use",
+                    "code": "IDEMPOTENCY_KEY_IN_USE",
+                    "message": "A request with this Idempotency-Key is still being processed. Retry later."
+                }}, headers=[(b"retry-after", b"1")])
+                return
+
+        response: Dict[str, Any] = {"status": 500, "headers": [], "body": b""}
+
+        async def capture(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")] for name, value in message.get("headers", [])
+                    if not name.lower().startswith(_BUDGET_HEADER_PREFIXES)
+                ]
+            elif message["type"] == "http.response.body" and len(response["body"]) <= idempotency.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, _replay_body(body, receive), capture)
+        except BaseException:
+            await self.store.release(key, owner)
+            raise
+
+        # Server errors and rate limiting are transient; let a retry run again
+        status = response["status"]
+        if status >= 500 or status in (408, 409, 429) or len(response["body"]) > idempotency.IDEMPOTENCY_MAX_RESPONSE_BYTES:
+            await self.store.release(key, owner)
+        else:
+            await self.store.complete(key, owner, {"state": "done", "fingerprint": fingerprint, "owner": owner, **response})
+
+class RateLimitMiddleware:
+    """
+    Apply rate limits and usage quotas before requests reach the routes.
+
+    Over-limit requests get a 429 with Retry-After before their body is
+    parsed or any route work is done; every other response gets the
+    X-Rate-Limit-* headers, and X-Quota-* for API keys. JSON bodies are read
+    and parsed here to price the request (see app.api.rate_limiter.json_cost)
+    and replayed to the app, which reuses the parsed body through
+    ParsedBodyRoute; other bodies, such as NDJSON streams and uploads,
+    are passed through unread, charged 1 unit here and the rest by their
+    endpoint through the RequestCharge left in the request state. Analysis
+    requests with an API key reserve their units in the owner's quota before
+    they run; the units are given back if the request fails. Job submissions
+    reserve all their units in the quota but take 1 from the rate limit, and
+    batches at most the whole limit (see rate_limiter.rate_limit_cost).
+
+    Args:
+        app: The ASGI app
+        prefix: Only paths under this prefix are limited
+        meter: UsageMeter for quotas, or None to skip them
+    """
+    def __init__(self, app: ASGIApp, prefix: str = "/api/v2/", meter=None):
+        self.app = app
+        self.prefix = prefix
+        self.meter = meter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
+        cost = 1
+        if scope["method"] == "POST" and rate_limiter.is_json(request.headers.get("content-type")):
+            body = await _read_body(receive)
+            if body is None:
+                return
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                # Malformed bodies are rejected by the endpoint
+                pass
+            else:
+                cost = rate_limiter.json_cost(payload)
+                scope.setdefault("state", {})["json_body"] = (body, payload)
+            receive = _replay_body(body, receive)
+
+        key_info = await rate_limiter.lookup_api_key(scope)
+        if key_info is not None and not key_info.is_active:
+            key_info = None
+        metered = (key_info is not None and self.meter is not None
+                   and scope["method"] == "POST" and scope["path"] in usage.METERED_PATHS)
+
+        # Quota units are reserved up front and given back if the request fails
+        now = datetime.utcnow()
+        quota = None
+        reserved = 0
+        try:
+            if metered:
+                quota = await self.meter.reserve(key_info.user_id, key_info.tier, cost, now)
+                if quota is not None and not quota.allowed:
+                    error = usage.quota_error(quota)
+                    await _send_json(send, error.status_code, {"detail": error.detail}, headers=_header_list(quota.headers))
+                    return
+                reserved = cost
+            result = await rate_limiter.rate_limit_request(
+                request, key_info, rate_limiter.rate_limit_cost(scope["path"], cost, key_info)
+            )
+        except Exception as e:
+            # Don't fail requests because the limiter broke
+            logger.error(f"Error in rate limiting middleware: {str(e)}")
+            result = None
+
+        headers = _header_list(result.headers) if result is not None else []
+        if quota is not None:
+            headers += _header_list(quota.headers)
+        if result is not None and not result.allowed:
+            if reserved:
+                await self._refund(key_info.user_id, reserved, now)
+            error = rate_limiter.rate_limit_error(result)
+            await _send_json(send, error.status_code, {"detail": error.detail}, headers=headers)
+            return
+        charge = rate_limiter.RequestCharge(request, key_info, charged=cost, meter=self.meter if reserved else None, now=now,
+                                            rate_limited=scope["path"] not in rate_limiter.QUOTA_ONLY_PATHS)
+        scope.setdefault("state", {})["charge"] = charge
+
+        status = 500
+
+        async def send_with_rate_limit_headers(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_rate_limit_headers)
+        finally:
+            # Only successful requests count towards usage
+            if charge.reserved and status >= 400:
+                await self._refund(key_info.user_id, charge.reserved, now)
+
+    async def _refund(self, user_id: str, units: int, now: datetime) -> None:
+        try:
+            await self.meter.refund(user_id, units, now)
+        except Exception as e:
+            logger.error(f"Error refunding usage: {str(e)}")
+
+class ParsedBodyRoute(APIRoute):
+    """
+    Route that reuses the JSON body RateLimitMiddleware parsed.
+
+    FastAPI reads and parses the body again through its own Request; seeding
+    that Request with the middleware's result spares large batches a second
+    parse. Use it as the route_class of routers under the limited prefix.
+    """
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            parsed = request.scope.get("state", {}).get("json_body")
+            if parsed is not None:
+                request._body, request._json = parsed
+            return await handler(request)
+
+        return route_handler
+
+class ConcurrencyLimitMiddleware:
+    """
+    Limit how many requests each client has in flight at once.
+
+    Over-limit requests wait briefly for a slot, then get a 429 with
+    Retry-After. The slot is held until the response has been sent, so
+    streamed responses count for as long as they run. See app.api.concurrency.
+
+    Args:
+        app: The ASGI app
+        semaphores: Slot store
+        paths: POST paths whose requests take a slot
+    """
+    def __init__(self, app: ASGIApp, semaphores, paths: Iterable[str]):
+        self.app = app
+        self.semaphores = semaphores
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        # Slots are per API key, or per client IP without one; never store raw API keys
+        api_key = Headers(scope=scope).get("x-api-key")
+        caller = f"key:{api_key}" if api_key else f"ip:{scope['client'][0] if scope.get('client') else 'unknown'}"
+        key = f"concurrency:{hashlib.sha256(caller.encode()).hexdigest()[:32]}"
+        key_info = await rate_limiter.lookup_api_key(scope)
+        # Unknown keys count as the default tier; they are rejected by the routes anyway
+        tier = key_info.tier if key_info is not None else None
+        limit = concurrency.limit_for_tier(tier)
+
+        lease = await concurrency.acquire(self.semaphores, key, limit, tier=tier)
+        if lease is None:
+            retry_after = concurrency.CONCURRENCY_RETRY_AFTER
+            await _send_json(send, 429, {"detail": {
+                "error": "too_many_concurrent_requests",
+                "code": "CONCURRENCY_LIMIT_EXCEEDED",
+                "message": f"Too many requests in flight; at most {limit} are allowed at once. Retry in {retry_after} seconds.",
+                "details": {"limit": limit}
+            }}, headers=[(b"retry-after", str(retry_after).encode())])
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.semaphores.release(lease)
+
+def _header_list(headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+
+async def _read_body(receive: Receive) -> Optional[bytes]:
+    """Read a whole request body; None if the client disconnected."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+def _replay_body(body: bytes, receive: Receive) -> Receive:
+    """A receive channel that yields an already read body, then defers to receive."""
+    body_sent = False
+
+    async def replay() -> Message:
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+async def _send_json(send: Send, status: int, content: Any, headers: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+    body = json.dumps(content).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + (headers or []),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _replay(send: Send, record: Dict[str, Any]) -> None:
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+    await send({
+        "type": "http.response.start",
+        "status": record["status"],
+        "headers": headers + [(b"idempotent-replayed", b"true")],
+    })
+    await send({"type": "http.response.body", "body": record["body"]})
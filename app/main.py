@@ -8,14 +8,21 @@ import time
 from pathlib import Path
 import os
 import httpx
+from starlette.concurrency import run_in_threadpool
 
 # Import the API routers
 from app.api.routes import router as api_router
 from app.api.auth_routes import router as auth_router
-from app.api.rate_limiter import rate_limit_middleware, validate_api_key
+from app.api.job_routes import router as jobs_router
+from app.api.webhook_routes import router as webhooks_router
+from app.api.usage_routes import router as usage_router
+from app.api import concurrency, idempotency, jobs, last_used, usage, usage_events, webhooks
+from app.api.rate_limiter import close_redis, redis_supervisor, validate_api_key
 
-# Database session dependency
-from app.models.database import get_db
+# Database session dependency, and the process-wide engine
+from app.models.database import get_db, init_db, dispose_engine
+from app.core.metrics import render_metrics, PROMETHEUS_AVAILABLE
+from app.core.middleware import ProcessTimeMiddleware, IdempotencyMiddleware, RateLimitMiddleware, ConcurrencyLimitMiddleware, UsageEventMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -89,21 +96,68 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 # Include API routes
 app.include_router(api_router)
 app.include_router(auth_router)
+app.include_router(jobs_router)
+app.include_router(webhooks_router)
+app.include_router(usage_router)
+
+# Usage counters for quotas, flushed to the usage table in the background
+usage_meter = usage.create_meter()
+
+# Per-request usage events, written to the usage_events table in batches
+usage_event_log = usage_events.UsageEventLog()
+
+# Create the database engine and schema once, before the first request
+@app.on_event("startup")
+async def start_database():
+    await run_in_threadpool(init_db)
+
+# Background job workers, webhook dispatchers, usage and last-used flushes and Redis reconnects
+@app.on_event("startup")
+async def start_job_workers():
+    jobs.start_workers()
+    webhooks.start_dispatchers()
+    usage_meter.start()
+    usage_event_log.start()
+    last_used.tracker.start()
+    redis_supervisor.start()
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await jobs.stop_workers()
+    await webhooks.stop_dispatchers()
+    await usage_meter.stop()
+    await usage_event_log.stop()
+    await last_used.tracker.stop()
+    await close_redis()
+
+# After the shutdown flushes above, which still write to the database
+@app.on_event("shutdown")
+async def stop_database():
+    dispose_engine()
+
+# Rate limit API requests and enforce quotas before they reach the routes
+app.add_middleware(RateLimitMiddleware, prefix="/api/v2/", meter=usage_meter)
+
+# Limit requests in flight per client; inside the idempotency middleware, so replays don't take a
+# slot, and outside the rate limit, so requests turned away for lack of a slot are not charged
+app.add_middleware(
+    ConcurrencyLimitMiddleware,
+    semaphores=concurrency.create_semaphores(),
+    paths=concurrency.LIMITED_PATHS,
+)
+
+# Replay responses for retried requests carrying an Idempotency-Key
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=idempotency.create_store(),
+    paths=idempotency.IDEMPOTENT_PATHS,
+)
+
+# Log every API request, including rejected and replayed ones
+app.add_middleware(UsageEventMiddleware, log=usage_event_log, prefix="/api/v2/")
 
 # Add middleware to measure processing time
-@app.middleware("http")
-async def process_middleware(request: Request, call_next):
-    # Measure processing time
-    start_time = time.time()
-    
-    # Process the request
-    response = await call_next(request)
-    
-    # Add processing time header
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-            
-    return response
+app.add_middleware(ProcessTimeMiddleware)
 
 # Custom Swagger UI
 @app.get("/api", include_in_schema=False)
@@ -388,6 +442,17 @@ async def health_check():
             "error": str(e)
         }
 
+# Prometheus metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Expose Prometheus metrics.
+    """
+    if not PROMETHEUS_AVAILABLE:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": "prometheus-client not installed"})
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 # Documentation redirection
 @app.get("/swagger", include_in_schema=False)
 async def swagger_ui_redirect():
@@ -1,15 +1,17 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, ForeignKey, inspect, text
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, Date, DateTime, Float, Text, ForeignKey, Index, text
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship, scoped_session
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import StaticPool
 import os
 from datetime import datetime
 import logging
 import time
 import json
+from contextlib import contextmanager
 import re
 import sys
+import threading
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -66,59 +68,174 @@ class DBAPIKey(Base):
     # Relationship with user
     user = relationship("DBUser", back_populates="api_keys")
 
-# Store in-memory engine globally for serverless
-_engine = None
-_session_factory = None
+class DBJob(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    # queued, running, completed, cancelled
+    status = Column(String, default="queued", index=True)
+    total_items = Column(Integer, default=0)
+    processed_items = Column(Integer, default=0)
+    failed_items = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    
+    # Relationship with items
+    items = relationship("DBJobItem", back_populates="job", cascade="all, delete-orphan")
 
-def get_global_engine():
-    """Get or create a global engine for in-memory SQLite."""
-    global _engine, _session_factory
+class DBJobItem(Base):
+    __tablename__ = "job_items"
+    __table_args__ = (
+        Index("ix_job_items_job_position", "job_id", "position", unique=True),
+        Index("ix_job_items_job_status", "job_id", "status"),
+    )
     
-    if _engine is None:
-        logger.info("Creating global in-memory SQLite engine")
-        _engine = create_engine(
-            "sqlite:///:memory:",
-            connect_args={"check_same_thread": False},
-            poolclass=NullPool
-        )
-        
-        # Create tables immediately
-        try:
-            Base.metadata.create_all(bind=_engine)
-            logger.info("Created tables in global in-memory SQLite database")
-
-            # Verify tables exist with explicit query
-            with _engine.connect() as conn:
-                inspector = inspect(_engine)
-                tables = inspector.get_table_names()
-                logger.info(f"Verified tables in SQLite: {tables}")
-                if "users" not in tables:
-                    logger.warning("Users table not found after creation, forcing table recreation")
-                    conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id VARCHAR PRIMARY KEY, 
-                        email VARCHAR UNIQUE, 
-                        hashed_password VARCHAR,
-                        tier VARCHAR, 
-                        is_active BOOLEAN, 
-                        created_at TIMESTAMP
-                    )
-                    """))
-                    conn.commit()
-        except Exception as e:
-            logger.error(f"Error creating tables in global engine: {str(e)}")
-        
-        # Create session factory
-        _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, ForeignKey("jobs.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    # pending, processing, done, failed
+    status = Column(String, default="pending")
+    # Lease on processing items; expired leases are reclaimed after a restart
+    claimed_at = Column(DateTime, nullable=True)
+    # Rendered analysis JSON, or error message for failed items
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    processing_time = Column(Float, nullable=True)
     
-    return _engine
+    # Relationship with job
+    job = relationship("DBJob", back_populates="items")
+
+class DBWebhook(Base):
+    """Webhook settings of an API key; applied to jobs submitted with the key."""
+    __tablename__ = "webhooks"
+
+    id = Column(String, primary_key=True, index=True)
+    api_key_id = Column(String, ForeignKey("api_keys.id"), unique=True, nullable=False)
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    # Default callback URL for jobs; None when only per-job URLs are used
+    url = Column(String, nullable=True)
+    # HMAC signing secret
+    secret = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DBJobWebhook(Base):
+    """Callback destination of a job, fixed when the job is submitted."""
+    __tablename__ = "job_webhooks"
+
+    job_id = Column(String, ForeignKey("jobs.id"), primary_key=True)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False)
+
+class DBWebhookDelivery(Base):
+    """A webhook event waiting to be delivered."""
+    __tablename__ = "webhook_deliveries"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, ForeignKey("jobs.id"), nullable=False, index=True)
+    # job.result, job.completed or job.cancelled
+    event = Column(String, nullable=False)
+    # Rendered JSON
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, default=0)
+    # Due time; pushed forward while a dispatcher holds the delivery
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class DBWebhookDeadLetter(Base):
+    """A webhook event that exhausted its delivery attempts."""
+    __tablename__ = "webhook_dead_letters"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, ForeignKey("jobs.id"), nullable=False, index=True)
+    event = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    failed_at = Column(DateTime, default=datetime.utcnow)
+
+class DBUsage(Base):
+    """Units a user consumed in a day or month, flushed in bulk from the usage counters."""
+    __tablename__ = "usage"
+    __table_args__ = (
+        Index("ix_usage_user_period", "user_id", "period", "period_start", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id"), nullable=False)
+    # day or month
+    period = Column(String, nullable=False)
+    # First day of the period (UTC)
+    period_start = Column(Date, nullable=False)
+    units = Column(Integer, default=0, nullable=False)
+    requests = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class DBUsageEvent(Base):
+    """One API request: who made it, what it carried and what it cost; written in batches."""
+    __tablename__ = "usage_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    # No foreign key: events outlive deleted keys, and anonymous requests have none
+    api_key_id = Column(String, nullable=True, index=True)
+    endpoint = Column(String, nullable=False)
+    method = Column(String, nullable=False)
+    status = Column(Integer, nullable=False)
+    items = Column(Integer, default=0, nullable=False)
+    # hit, miss or mixed, replay for idempotent replays; null when nothing was analyzed
+    cache = Column(String, nullable=True)
+    latency_ms = Column(Float, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    output_tokens = Column(Integer, default=0, nullable=False)
+
+# Connection pool settings. The serverless profile (the default on Vercel
+# and Lambda) keeps a small pool and checks connections before use, since
+# they go stale while an instance is frozen between invocations.
+DB_POOL_PROFILE = os.getenv("DB_POOL_PROFILE", "serverless" if IS_SERVERLESS else "default").lower()
+_SERVERLESS_POOL = DB_POOL_PROFILE == "serverless"
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "1" if _SERVERLESS_POOL else "5"))  # connections kept open
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "2" if _SERVERLESS_POOL else "10"))  # extra connections under load
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10" if _SERVERLESS_POOL else "30"))  # max wait for a connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300" if _SERVERLESS_POOL else "1800"))  # seconds before reconnecting
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true" if _SERVERLESS_POOL else "false").lower() == "true"
+
+# Apply schema migrations when a process creates its engine; disable when
+# deploys run "python -m app.cli migrate" instead
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() == "true"
+
+# One engine and session factory per process, created on first use
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+def _is_memory_url(url: str) -> bool:
+    return url.startswith("sqlite:///:memory:")
+
+def _create_memory_engine():
+    """In-memory SQLite engine; all sessions share its single connection, so they see the same tables."""
+    logger.info("Creating in-memory SQLite engine")
+    return create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+
+# Function to create the process-wide engine
+def create_db_engine(fallback: bool = True):
+    """
+    Create a pooled database engine.
 
-# Function to create a fresh connection engine
-def create_db_engine():
-    """Create a fresh database engine with NullPool for serverless"""
-    # For in-memory SQLite in serverless environment, use global engine
-    if DATABASE_URL == "sqlite:///:memory:" or DATABASE_URL.startswith("sqlite:///:memory:"):
-        return get_global_engine()
+    Args:
+        fallback: Use in-memory SQLite if the database is unreachable; otherwise raise RuntimeError
+    """
+    if _is_memory_url(DATABASE_URL):
+        return _create_memory_engine()
     
     retry_count = 0
     max_retries = 3
@@ -127,41 +244,39 @@ def create_db_engine():
     
     while retry_count < max_retries:
         try:
-            # For PostgreSQL, use special parameters optimized for serverless
             connect_args = {}
             if DATABASE_URL.startswith("postgres"):
                 # Build URL with proper parameters
                 base_url = DATABASE_URL.split("?")[0] if "?" in DATABASE_URL else DATABASE_URL
                 params = ["sslmode=require", "connect_timeout=5"]
                 db_url = f"{base_url}?{'&'.join(params)}"
-                logger.info("Creating PostgreSQL engine with serverless optimizations")
+                logger.info(f"Creating PostgreSQL engine ({DB_POOL_PROFILE} pool profile)")
             else:
                 db_url = DATABASE_URL
                 if db_url.startswith("sqlite"):
                     connect_args["check_same_thread"] = False
-                logger.info(f"Creating {db_url.split('://')[0]} engine")
+                logger.info(f"Creating {db_url.split('://')[0]} engine ({DB_POOL_PROFILE} pool profile)")
             
-            # Create engine with NullPool - critical for serverless
             engine = create_engine(
                 db_url,
                 echo=False,
-                poolclass=NullPool,  # Explicitly use NullPool for serverless
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_pre_ping=DB_POOL_PRE_PING,
                 connect_args=connect_args
             )
             
-            # Test connection - quick and simple
+            # Test connection once, when the engine is created
             try:
                 with engine.connect() as conn:
                     conn.execute(text("SELECT 1"))  # Use text() for SQLAlchemy 2.0 compatibility
                 logger.info("Database connection test successful")
-                
-                # Ensure tables exist
-                Base.metadata.create_all(bind=engine)
-                logger.info("Database tables verified/created")
-                
                 return engine
             except Exception as conn_error:
                 logger.error(f"Database connection test failed: {str(conn_error)}")
+                engine.dispose()
                 last_error = conn_error
                 retry_count += 1
                 if retry_count < max_retries:
@@ -181,101 +296,69 @@ def create_db_engine():
     
     # All attempts failed, fall back to in-memory SQLite
     logger.error(f"All database connection attempts failed after {max_retries} retries. Last error: {str(last_error)}")
+    if not fallback:
+        raise RuntimeError(f"Could not connect to the database: {str(last_error)}")
     logger.warning("Falling back to SQLite in-memory database")
-    return get_global_engine()
+    return _create_memory_engine()
+
+def _prepare_schema(engine) -> None:
+    """Migrate the schema once, when the engine is created; sessions never check it."""
+    from app.models import migrations
+    try:
+        # An in-memory database starts empty, and no CLI run can reach it
+        if DB_AUTO_MIGRATE or _is_memory_url(str(engine.url)):
+            applied = migrations.migrate(engine)
+            if applied:
+                logger.info(f"Database schema migrated to version {migrations.SCHEMA_VERSION}")
+        elif not migrations.schema_is_current(engine):
+            logger.error(
+                f"Database schema is older than version {migrations.SCHEMA_VERSION}; "
+                "run 'python -m app.cli migrate'"
+            )
+    except Exception as e:
+        logger.error(f"Error preparing database schema: {str(e)}")
+
+def get_engine():
+    """
+    The process-wide engine, created (and its schema migrated) on first use.
+
+    The app calls init_db at startup, so requests normally find it ready.
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_db_engine()
+                _prepare_schema(engine)
+                _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                _engine = engine
+    return _engine
+
+def init_db() -> None:
+    """Create the engine and migrate the schema ahead of the first request."""
+    get_engine()
+
+def dispose_engine() -> None:
+    """Close the pooled connections, e.g. on shutdown; the engine reconnects if used again."""
+    if _engine is not None:
+        _engine.dispose()
 
-# Simple function to get a fresh session
 def get_db():
-    """Get a fresh database session for each request"""
-    global _session_factory
-    
+    """Get a database session from the process-wide engine; it is closed when the request is done"""
+    if _session_factory is None:
+        get_engine()
+    db = _session_factory()
     try:
-        # For in-memory SQLite, use the global session factory
-        if DATABASE_URL == "sqlite:///:memory:" or DATABASE_URL.startswith("sqlite:///:memory:"):
-            if _session_factory is None:
-                # Initialize if not already done
-                get_global_engine()
-            
-            db = _session_factory()
-            
-            # Ensure tables exist each time (in-memory DB can lose tables)
-            try:
-                inspector = inspect(_engine)
-                if "users" not in inspector.get_table_names():
-                    logger.warning("Users table not found in in-memory DB, recreating tables")
-                    Base.metadata.create_all(bind=_engine)
-                    
-                    # Double-check with explicit table creation
-                    with _engine.begin() as conn:
-                        conn.execute(text("""
-                        CREATE TABLE IF NOT EXISTS users (
-                            id VARCHAR PRIMARY KEY, 
-                            email VARCHAR UNIQUE, 
-                            hashed_password VARCHAR,
-                            tier VARCHAR, 
-                            is_active BOOLEAN, 
-                            created_at TIMESTAMP
-                        )
-                        """))
-            except Exception as table_error:
-                logger.error(f"Error checking/creating tables: {str(table_error)}")
-            
-            try:
-                yield db
-            finally:
-                db.close()
-            return
-            
-        # For other databases, create a new engine for each session in serverless environment
-        engine = create_db_engine()
-        
-        # Create a new session
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        db = SessionLocal()
-        
-        # Verify tables exist before yielding session
-        try:
-            inspector = inspect(engine)
-            if "users" not in inspector.get_table_names():
-                logger.warning("Tables not found in database, creating them now")
-                Base.metadata.create_all(bind=engine)
-                
-                # Double-check with explicit table creation
-                with engine.begin() as conn:
-                    conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id VARCHAR PRIMARY KEY, 
-                        email VARCHAR UNIQUE, 
-                        hashed_password VARCHAR,
-                        tier VARCHAR, 
-                        is_active BOOLEAN, 
-                        created_at TIMESTAMP
-                    )
-                    """))
-        except Exception as table_error:
-            logger.error(f"Error checking/creating tables: {str(table_error)}")
-        
-        try:
-            yield db
-        finally:
-            db.close()
-            if engine and engine != _engine:  # Don't dispose global engine
-                engine.dispose()  # Explicitly close all connections
-    except Exception as session_error:
-        logger.error(f"Session error: {str(session_error)}")
-        # If we can't create a real DB session, create an in-memory one
-        engine = get_global_engine()  # Use global engine for consistency
-        
-        SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        db = SessionLocal()
-        
-        # Ensure tables exist in this fallback case too
-        try:
-            Base.metadata.create_all(bind=engine)
-        except Exception as table_error:
-            logger.error(f"Error creating tables in fallback: {str(table_error)}")
-            
-        try:
-            yield db
-        finally:
-            db.close() 
\ No newline at end of file
+        yield db
+    finally:
+        db.close()
+
+@contextmanager
+def session_scope():
+    """Open a database session outside of a request (background workers, CLI)."""
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        yield db
+    finally:
+        db_gen.close()
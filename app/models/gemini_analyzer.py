@@ -1,33 +1,69 @@
 import google.generativeai as genai
 import logging
-from typing import Dict, Any
+import os
 import json
-import re
+from typing import Dict, Any, Optional
+
+from app.models.json_extraction import extract_json, JSONExtractionError
+from app.models.response_schema import analysis_response_schema
+from app.models.result_normalizer import normalize_result, default_result
+from app.core.metrics import ANALYZER_RESPONSES, ANALYZER_PROMPT_TOKENS, ANALYZER_OUTPUT_TOKENS
+from app.api.usage_events import track_tokens
 
 logger = logging.getLogger(__name__)
 
+# Ask Gemini for schema-constrained JSON instead of describing the schema in the prompt
+STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "false").lower() == "true"
+
+# Prompt used in structured-output mode; the response schema carries the structure
+STRUCTURED_PROMPT_TEMPLATE = """You are a comprehensive content analysis AI. Analyze the following text for toxicity, sentiment, readability, profanity, and sensitivity. You must detect ALL forms of problematic content, including obfuscated words.
+
+Text to analyze: "{text}"
+
+Scores are 0.0-1.0 except sentiment.score (-1.0 to 1.0) and readability.grade_level (1-12). Group flagged words into the profanity, insults, slurs and other categories.
+
+Important rules:
+1. Detect ALL profanity including obfuscated forms (f*ck, sh!t, a$$, etc.)
+2. Score toxicity high for profanity and aggressive language
+3. Consider ALL-CAPS and multiple punctuation (!!!) as anger indicators
+4. Include original obfuscated forms in flagged_words
+5. Set high severity for multiple profanities or aggressive context
+6. Carefully analyze for sensitive topics like politics, religion, race
+7. Evaluate readability using standard metrics (word/sentence length, complexity)
+8. For sentiment, identify underlying emotions beyond positive/negative"""
+
 class GeminiAnalyzer:
     """
     Unified text analyzer using Google's Gemini API for toxicity, sentiment, and content analysis.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, structured_output: Optional[bool] = None):
         """
         Initialize the Gemini analyzer.
         
         Args:
             api_key: Google Gemini API key
+            structured_output: Request schema-constrained JSON output
+                (defaults to the GEMINI_STRUCTURED_OUTPUT setting)
         """
         logger.info("Initializing GeminiAnalyzer...")
         genai.configure(api_key=api_key)
         
+        self.structured_output = STRUCTURED_OUTPUT if structured_output is None else structured_output
+        self.mode = "structured" if self.structured_output else "prompt"
+        
+        generation_config = {
+            "temperature": 0,
+            "top_p": 1,
+            "top_k": 1,
+            "max_output_tokens": 2048,
+        }
+        if self.structured_output:
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = analysis_response_schema()
+        
         # Initialize model with safety settings turned off since we're doing content moderation
         self.model = genai.GenerativeModel('gemini-2.0-flash',
-            generation_config={
-                "temperature": 0,
-                "top_p": 1,
-                "top_k": 1,
-                "max_output_tokens": 2048,
-            },
+            generation_config=generation_config,
             safety_settings=[
                 {
                     "category": "HARM_CATEGORY_HARASSMENT",
@@ -136,10 +172,12 @@ Important rules:
 8. For sentiment, identify underlying emotions beyond positive/negative
 
 Return ONLY valid JSON, no other text or explanation."""
+        if self.structured_output:
+            self.prompt_template = STRUCTURED_PROMPT_TEMPLATE
         
         self.api_key = api_key
         
-        logger.info("GeminiAnalyzer initialized successfully")
+        logger.info(f"GeminiAnalyzer initialized successfully ({self.mode} output mode)")
     
     def analyze(self, text: str) -> Dict[str, Any]:
         """
@@ -157,209 +195,52 @@ Return ONLY valid JSON, no other text or explanation."""
             
             # Get response from Gemini
             response = self.model.generate_content(prompt)
+            self._record_usage(response)
+            
+            # Get the response text (raises if the candidate was blocked)
+            response_text = response.text
             
             # Parse the JSON response
             try:
-                # Get the response text
-                response_text = response.text
-                
-                # Try to find JSON in the response
-                try:
-                    # First try direct JSON parsing
+                if self.structured_output:
+                    # Schema-constrained output is plain JSON; no repair path
                     result = json.loads(response_text)
-                except:
-                    # If that fails, try to extract JSON from markdown blocks
-                    if "```json" in response_text:
-                        json_str = response_text.split("```json")[1].split("```")[0]
-                    elif "```" in response_text:
-                        json_str = response_text.split("```")[1].split("```")[0]
-                    else:
-                        # Try to find JSON-like structure
-                        match = re.search(r'({[\s\S]*})', response_text)
-                        json_str = match.group(1) if match else response_text
-                    
-                    # Clean up the JSON string
-                    json_str = re.sub(r'<[^>]+>', '', json_str)  # Remove angle brackets
-                    json_str = json_str.strip()
-                    result = json.loads(json_str)
-                
-                # Validate and normalize scores
-                self._normalize_scores(result)
+                    if not isinstance(result, dict):
+                        raise JSONExtractionError("Model output is not a JSON object")
+                else:
+                    # Extract the JSON object, tolerating fences, prose and truncation
+                    result = extract_json(response_text)
                 
-                # Ensure non-zero scores for toxic content
-                if result["flagged_words"]["count"] > 0 and result["toxicity"]["score"] == 0:
-                    result["toxicity"]["score"] = max(0.7, result["flagged_words"]["severity_score"])
-                    result["toxicity"]["is_toxic"] = True
+                # Validate, clamp and fill defaults in one pass
+                result = normalize_result(result)
                 
+                ANALYZER_RESPONSES.labels(self.mode, "parsed").inc()
                 return result
                 
-            except json.JSONDecodeError as e:
+            except (ValueError, TypeError) as e:
+                # JSONExtractionError, JSONDecodeError and pydantic's ValidationError are ValueErrors
+                ANALYZER_RESPONSES.labels(self.mode, "failed").inc()
                 logger.error(f"Error parsing Gemini response: {str(e)}")
                 logger.error(f"Raw response: {response_text}")
                 return self._get_default_response()
             
         except Exception as e:
+            ANALYZER_RESPONSES.labels(self.mode, "upstream_error").inc()
             logger.error(f"Error analyzing text with Gemini: {str(e)}")
             return self._get_default_response()
     
-    def _normalize_scores(self, result: Dict[str, Any]) -> None:
-        """Normalize and validate all scores in the result."""
-        # Ensure toxicity scores exist and are normalized
-        result.setdefault("toxicity", {})
-        toxicity = result["toxicity"]
-        toxicity.setdefault("score", 0.0)
-        toxicity.setdefault("is_toxic", False)
-        toxicity.setdefault("detailed_scores", {})
-        
-        # Normalize detailed scores
-        for key in ["toxicity", "severe_toxicity", "obscene", "threat", "insult", "identity_hate"]:
-            toxicity["detailed_scores"].setdefault(key, 0.0)
-            toxicity["detailed_scores"][key] = min(1.0, max(0.0, float(toxicity["detailed_scores"][key])))
-        
-        # Update is_toxic based on score
-        if toxicity["score"] > 0.5 or any(score > 0.5 for score in toxicity["detailed_scores"].values()):
-            toxicity["is_toxic"] = True
-        
-        # Normalize sentiment
-        result.setdefault("sentiment", {})
-        sentiment = result["sentiment"]
-        sentiment.setdefault("score", 0.0)
-        sentiment.setdefault("label", "NEUTRAL")
-        sentiment.setdefault("emotions", {})
-        
-        # Add emotions if not present
-        for emotion in ["joy", "sadness", "anger", "fear", "surprise"]:
-            sentiment["emotions"].setdefault(emotion, 0.0)
-        
-        # Normalize profanity
-        result.setdefault("profanity", {})
-        profanity = result["profanity"]
-        profanity.setdefault("score", 0.0)
-        profanity.setdefault("is_profane", False)
-        profanity.setdefault("severity", "NONE")
-        profanity.setdefault("categories", {})
-        
-        # Add profanity categories if not present
-        for category in ["mild_profanity", "strong_profanity", "sexual_references", "slurs"]:
-            profanity["categories"].setdefault(category, 0.0)
-        
-        # Update is_profane based on score
-        if profanity["score"] > 0.3:
-            profanity["is_profane"] = True
-            if profanity["score"] > 0.7:
-                profanity["severity"] = "HIGH"
-            elif profanity["score"] > 0.4:
-                profanity["severity"] = "MEDIUM"
-            else:
-                profanity["severity"] = "LOW"
-        
-        # Normalize sensitivity
-        result.setdefault("sensitivity", {})
-        sensitivity = result["sensitivity"]
-        sensitivity.setdefault("score", 0.0)
-        sensitivity.setdefault("is_sensitive", False)
-        sensitivity.setdefault("categories", {})
-        
-        # Add sensitivity categories if not present
-        for category in ["political", "religious", "racial", "gender", "violence", "self_harm"]:
-            sensitivity["categories"].setdefault(category, 0.0)
-            
-        # Update is_sensitive based on score
-        if sensitivity["score"] > 0.5 or any(score > 0.6 for score in sensitivity["categories"].values()):
-            sensitivity["is_sensitive"] = True
-        
-        # Normalize readability
-        result.setdefault("readability", {})
-        readability = result["readability"]
-        readability.setdefault("score", 0.5)
-        readability.setdefault("grade_level", 8)
-        readability.setdefault("difficulty", "MEDIUM")
-        readability.setdefault("metrics", {})
-        
-        # Add readability metrics if not present
-        readability["metrics"].setdefault("avg_word_length", 5.0)
-        readability["metrics"].setdefault("avg_sentence_length", 15.0)
-        readability["metrics"].setdefault("complex_word_percentage", 0.3)
-        
-        # Normalize flagged words
-        result.setdefault("flagged_words", {})
-        flagged = result["flagged_words"]
-        flagged.setdefault("count", 0)
-        flagged.setdefault("words", [])
-        flagged.setdefault("categories", {})
-        flagged.setdefault("severity_score", 0.0)
-        flagged.setdefault("is_severe", False)
-        
-        # Update severity based on content
-        if flagged["count"] > 0:
-            if not flagged["severity_score"]:
-                flagged["severity_score"] = max(profanity["score"], toxicity["score"])
-            flagged["is_severe"] = flagged["severity_score"] > 0.5
+    def _record_usage(self, response) -> None:
+        """Record upstream token usage when the response reports it."""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        ANALYZER_PROMPT_TOKENS.labels(self.mode).inc(prompt_tokens)
+        ANALYZER_OUTPUT_TOKENS.labels(self.mode).inc(output_tokens)
+        # Attribute them to the request being handled, for the usage event log
+        track_tokens(prompt_tokens, output_tokens)
     
     def _get_default_response(self) -> Dict[str, Any]:
         """Get default response structure when analysis fails."""
-        return {
-            "toxicity": {
-                "score": 0.0,
-                "is_toxic": False,
-                "detailed_scores": {
-                    "toxicity": 0.0,
-                    "severe_toxicity": 0.0,
-                    "obscene": 0.0,
-                    "threat": 0.0,
-                    "insult": 0.0,
-                    "identity_hate": 0.0
-                }
-            },
-            "sentiment": {
-                "score": 0.0,
-                "label": "NEUTRAL",
-                "emotions": {
-                    "joy": 0.0,
-                    "sadness": 0.0,
-                    "anger": 0.0,
-                    "fear": 0.0,
-                    "surprise": 0.0
-                }
-            },
-            "profanity": {
-                "score": 0.0,
-                "is_profane": False,
-                "severity": "NONE",
-                "categories": {
-                    "mild_profanity": 0.0,
-                    "strong_profanity": 0.0,
-                    "sexual_references": 0.0,
-                    "slurs": 0.0
-                }
-            },
-            "sensitivity": {
-                "score": 0.0,
-                "is_sensitive": False,
-                "categories": {
-                    "political": 0.0,
-                    "religious": 0.0,
-                    "racial": 0.0,
-                    "gender": 0.0,
-                    "violence": 0.0,
-                    "self_harm": 0.0
-                }
-            },
-            "readability": {
-                "score": 0.5,
-                "grade_level": 8,
-                "difficulty": "MEDIUM",
-                "metrics": {
-                    "avg_word_length": 5.0,
-                    "avg_sentence_length": 15.0,
-                    "complex_word_percentage": 0.3
-                }
-            },
-            "flagged_words": {
-                "count": 0,
-                "words": [],
-                "categories": {},
-                "severity_score": 0.0,
-                "is_severe": False
-            }
-        } 
\ No newline at end of file
+        return default_result()
@@ -0,0 +1,191 @@
+"""
+JSON extraction for model output.
+
+Finds the outermost JSON object in free-form model output. Complete objects
+are decoded in place with ``JSONDecoder.raw_decode``; a precompiled bracket
+scanner handles truncated output. Markdown code fences, surrounding prose and
+trailing commas are always handled, and common non-JSON idioms (Python
+literals, single quotes, unquoted keys and template placeholders such as
+``<0.0-1.0>``) can optionally be repaired.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Tuple
+
+_FENCE = "```"
+
+# Tokens the scanner cares about: complete or unterminated strings, brackets, commas
+_SCAN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(?P<closed>")?|[{}\[\],]', re.S)
+
+# Trailing commas before a closing bracket, skipping over strings
+_TRAILING_COMMA_RE = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|,(?=\s*[}\]])', re.S)
+
+# Simple non-JSON idioms fixed in repair mode, skipping over double-quoted strings
+_REPAIR_RE = re.compile(
+    r"""
+    (?P<dq>"[^"\\]*(?:\\.[^"\\]*)*")
+    |(?P<sq>'[^'\\]*(?:\\.[^'\\]*)*')
+    |(?P<comma>,(?=\s*[}\]]))
+    |(?<=[{,])(?P<ws>\s*)(?P<key>[A-Za-z_][A-Za-z0-9_]*)(?=\s*:)
+    |(?P<lit>\b(?:True|False|None)\b)
+    |<(?P<placeholder>[^<>\n]*)>
+    """,
+    re.S | re.X,
+)
+
+# Cheap searches that tell whether the regex passes above could change anything
+_TRAILING_COMMA_HINT_RE = re.compile(r",\s*[}\]]")
+_UNQUOTED_KEY_HINT_RE = re.compile(r"[{,]\s*[A-Za-z_]")
+_REPAIR_HINTS = ("'", "<", "True", "False", "None")
+
+_NUMBER_RE = re.compile(r"\s*-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?\s*\Z")
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_DECODER = json.JSONDecoder(strict=False)
+
+# How many cut points to try when closing truncated output
+MAX_TRUNCATION_ATTEMPTS = 8
+
+class JSONExtractionError(ValueError):
+    """Raised when no JSON object can be recovered from the text."""
+
+def _repair_match(match: "re.Match") -> str:
+    group = match.lastgroup
+    if group == "dq":
+        return match.group(0)
+    if group == "sq":
+        inner = match.group(0)[1:-1].replace("\\'", "'")
+        return json.dumps(inner)
+    if group == "comma":
+        return ""
+    if group == "key":
+        return f'{match.group("ws")}"{match.group("key")}"'
+    if group == "lit":
+        return _LITERALS[match.group(0)]
+    placeholder = match.group("placeholder")
+    return placeholder.strip() if _NUMBER_RE.match(placeholder) else "null"
+
+def _drop_trailing_commas(text: str) -> str:
+    if not _TRAILING_COMMA_HINT_RE.search(text):
+        return text
+    return _TRAILING_COMMA_RE.sub(lambda m: m.group(1) or "", text)
+
+def _repair(text: str) -> str:
+    if not any(hint in text for hint in _REPAIR_HINTS) and not _UNQUOTED_KEY_HINT_RE.search(text):
+        return _drop_trailing_commas(text)
+    return _REPAIR_RE.sub(_repair_match, text)
+
+def _scan(text: str, start: int) -> Tuple[int, List[Tuple[int, Tuple[str, ...]]], Tuple[str, ...], bool]:
+    """
+    Scan for the end of the object opened at ``start``.
+
+    Returns:
+        Tuple of (end index or -1 if truncated, cut points as (position, open
+        brackets), open brackets at end of input, whether input ended inside a string)
+    """
+    stack: List[str] = []
+    cuts: List[Tuple[int, Tuple[str, ...]]] = []
+    for match in _SCAN_RE.finditer(text, start):
+        token = match.group(0)
+        first = token[0]
+        if first == '"':
+            if match.group("closed") is None:
+                return -1, cuts, tuple(stack), True
+        elif first in "{[":
+            stack.append(first)
+            cuts.append((match.end(), tuple(stack)))
+        elif first == ",":
+            cuts.append((match.start(), tuple(stack)))
+        else:
+            if stack:
+                stack.pop()
+            if not stack:
+                return match.end(), cuts, (), False
+    return -1, cuts, tuple(stack), False
+
+def _fenced_body(text: str) -> str:
+    """Return the body of the first code fence containing an object, or the text itself."""
+    opening = text.find(_FENCE)
+    if opening < 0:
+        return text
+    body_start = text.find("\n", opening)
+    if body_start < 0:
+        return text
+    closing = text.find(_FENCE, body_start)
+    body = text[body_start + 1:closing] if closing >= 0 else text[body_start + 1:]
+    return body if "{" in body else text
+
+def _decode_object(candidate: str):
+    """Decode the object at the start of ``candidate``, ignoring anything after it."""
+    try:
+        result, _ = _DECODER.raw_decode(candidate)
+    except json.JSONDecodeError:
+        return None
+    return result if isinstance(result, dict) else None
+
+def _close_truncated(text: str, start: int, cuts, stack, in_string: bool, repair: bool) -> Dict[str, Any]:
+    """Close brackets on truncated output, backing off to earlier cut points."""
+    tail = text[start:]
+    if in_string:
+        tail = tail.rstrip("\\") + '"'
+    attempts = [(tail, stack)]
+    for position, open_brackets in reversed(cuts[-MAX_TRUNCATION_ATTEMPTS:]):
+        attempts.append((text[start:position], open_brackets))
+    candidates = [
+        candidate.rstrip().rstrip(",") + "".join(_CLOSERS[b] for b in reversed(open_brackets))
+        for candidate, open_brackets in attempts
+    ]
+
+    # Cheap pass first; most truncated output is otherwise valid JSON
+    for fix in [None, _drop_trailing_commas] + ([_repair] if repair else []):
+        for candidate in candidates:
+            fixed = fix(candidate) if fix else candidate
+            if fix and fixed is candidate:
+                continue
+            result = _decode_object(fixed)
+            if result is not None:
+                return result
+    raise JSONExtractionError("Truncated JSON object could not be closed")
+
+def extract_json(text: str, repair: bool = True) -> Dict[str, Any]:
+    """
+    Extract the outermost JSON object from model output.
+
+    Args:
+        text: Raw model output
+        repair: Also fix Python literals, single quotes, unquoted keys and
+            ``<...>`` template placeholders
+
+    Returns:
+        The decoded JSON object
+
+    Raises:
+        JSONExtractionError: When no JSON object can be recovered
+    """
+    if not text:
+        raise JSONExtractionError("Empty model output")
+
+    text = _fenced_body(text)
+    start = text.find("{")
+    if start < 0:
+        raise JSONExtractionError("No JSON object found in model output")
+
+    # Common case: a complete object, possibly followed by prose, decoded at C speed
+    tail = text[start:]
+    result = _decode_object(tail)
+    if result is not None:
+        return result
+
+    # Trailing commas, then the simple repairs, each a single regex pass
+    for fix in [_drop_trailing_commas] + ([_repair] if repair else []):
+        fixed = fix(tail)
+        if fixed is not tail:
+            result = _decode_object(fixed)
+            if result is not None:
+                return result
+
+    end, cuts, stack, in_string = _scan(text, start)
+    if end < 0:
+        return _close_truncated(text, start, cuts, stack, in_string, repair)
+    raise JSONExtractionError("Invalid JSON object in model output")
@@ -0,0 +1,104 @@
+"""
+Versioned schema migrations for ToxidAPI.
+
+The schema_version table records which migrations a database has had.
+migrate applies the missing ones in order, in one transaction. It runs once
+per process when the engine is created, or, with DB_AUTO_MIGRATE=false, once
+per deploy through ``python -m app.cli migrate``. Request sessions assume the
+schema is current and never check it.
+
+To change the schema, update the models in app.models.database and append a
+migration that brings a database at the previous version up to date. Never
+edit a migration that has shipped.
+"""
+
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.models.database import Base
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+def _create_tables(*names: str) -> Callable[[Connection], None]:
+    # checkfirst: databases from before versioning already have the tables
+    def apply(conn: Connection) -> None:
+        for name in names:
+            Base.metadata.tables[name].create(conn, checkfirst=True)
+    return apply
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Initial schema", _create_tables(
+        "users", "api_keys", "jobs", "job_items", "webhooks", "job_webhooks",
+        "webhook_deliveries", "webhook_dead_letters", "usage", "usage_events",
+    )),
+]
+
+# Version the models in app.models.database correspond to
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+# Serializes concurrent migrations on PostgreSQL; any constant shared by all processes
+_ADVISORY_LOCK_ID = 7461023
+
+def current_version(conn: Connection) -> int:
+    """Latest migration applied to the database; 0 for an unversioned one."""
+    if not inspect(conn).has_table(schema_version.name):
+        return 0
+    return conn.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc()).limit(1)).scalar() or 0
+
+def migrate(engine: Engine) -> List[int]:
+    """
+    Bring the database schema up to SCHEMA_VERSION.
+
+    Args:
+        engine: Engine of the database to migrate
+
+    Returns:
+        Versions applied, in order; empty if the schema was already current
+    """
+    try:
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": _ADVISORY_LOCK_ID})
+            version = current_version(conn)
+            pending = [migration for migration in MIGRATIONS if migration.version > version]
+            if pending:
+                schema_version.create(conn, checkfirst=True)
+            for migration in pending:
+                logger.info(f"Applying schema migration {migration.version}: {migration.description}")
+                migration.apply(conn)
+                conn.execute(insert(schema_version).values(
+                    version=migration.version,
+                    description=migration.description,
+                    applied_at=datetime.utcnow(),
+                ))
+    except SQLAlchemyError:
+        # Another process may have migrated the database at the same time
+        with engine.connect() as conn:
+            if current_version(conn) >= SCHEMA_VERSION:
+                return []
+        raise
+    return [migration.version for migration in pending]
+
+def schema_is_current(engine: Engine) -> bool:
+    """Whether every migration has been applied."""
+    with engine.connect() as conn:
+        return current_version(conn) >= SCHEMA_VERSION
@@ -0,0 +1,77 @@
+"""
+Gemini response schema generated from the API's pydantic models.
+
+Gemini's structured output accepts an OpenAPI subset: no ``$ref``, no
+defaults or titles, and objects must list their properties. This module
+converts the JSON schema of ``AnalysisResult`` into that subset once.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Type
+
+from pydantic import BaseModel
+
+from app.api.models import AnalysisResult
+
+# Keys Gemini's Schema proto understands
+_SUPPORTED_KEYS = {"type", "format", "description", "nullable", "enum", "items", "properties", "required"}
+
+# Constraints the pydantic models only state in prose, keyed by property path
+_OVERRIDES: Dict[str, Dict[str, Any]] = {
+    "sentiment.label": {"enum": ["POSITIVE", "NEGATIVE", "NEUTRAL"]},
+    "profanity.severity": {"enum": ["NONE", "LOW", "MEDIUM", "HIGH"]},
+    "readability.difficulty": {"enum": ["EASY", "MEDIUM", "DIFFICULT"]},
+    "flagged_words.categories": {
+        "type": "object",
+        "properties": {
+            name: {"type": "array", "items": {"type": "string"}}
+            for name in ("profanity", "insults", "slurs", "other")
+        },
+    },
+}
+
+# Top-level description sent to the model; AnalysisResult's docstring is written for developers
+ANALYSIS_DESCRIPTION = (
+    "Content analysis of the given text: toxicity, sentiment, profanity, sensitivity, "
+    "readability and flagged words. Scores are between 0 and 1 unless stated otherwise."
+)
+
+def _resolve(schema: Dict[str, Any], defs: Dict[str, Any]) -> Dict[str, Any]:
+    if "$ref" in schema:
+        return _resolve(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    if "allOf" in schema and len(schema["allOf"]) == 1:
+        merged = {**_resolve(schema["allOf"][0], defs), **{k: v for k, v in schema.items() if k != "allOf"}}
+        return _resolve(merged, defs)
+    return schema
+
+def _convert(schema: Dict[str, Any], defs: Dict[str, Any], path: str) -> Dict[str, Any]:
+    schema = _resolve(schema, defs)
+    if path in _OVERRIDES:
+        schema = {**schema, **_OVERRIDES[path]}
+        schema.pop("additionalProperties", None)
+
+    converted = {k: v for k, v in schema.items() if k in _SUPPORTED_KEYS and k not in ("items", "properties")}
+    if enum := converted.get("enum"):
+        converted["type"] = "string"
+        converted["format"] = "enum"
+        converted["enum"] = list(enum)
+    if "items" in schema:
+        converted["items"] = _convert(schema["items"], defs, f"{path}[]")
+    if "properties" in schema:
+        converted["properties"] = {
+            name: _convert(prop, defs, f"{path}.{name}" if path else name)
+            for name, prop in schema["properties"].items()
+        }
+        # Ask for every field so the model never relies on our defaults
+        converted["required"] = list(schema["properties"])
+    return converted
+
+def gemini_schema_for(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Convert a pydantic model into a Gemini response schema dict."""
+    schema = model.model_json_schema()
+    return _convert(schema, schema.get("$defs", {}), "")
+
+@lru_cache(maxsize=1)
+def analysis_response_schema() -> Dict[str, Any]:
+    """Response schema for the analyzer's JSON output."""
+    return {**gemini_schema_for(AnalysisResult), "description": ANALYSIS_DESCRIPTION}
@@ -0,0 +1,85 @@
+"""
+Single-pass normalization of analyzer output.
+
+The ``AnalysisResult`` pydantic model declares every default and clamps every
+score, so one validation against a prebuilt ``TypeAdapter`` fills missing
+fields, coerces types and clamps ranges. The validated model is dumped back
+to a plain dict, the flags derived from scores are set on that dict (cheaper
+than assigning through pydantic), and the routes return it without
+validating it again.
+"""
+
+from typing import Any, Dict
+
+from pydantic import TypeAdapter, ValidationError
+
+from app.api.models import AnalysisResult
+
+# Built once; validation and serialization reuse the compiled core schema
+_ADAPTER = TypeAdapter(AnalysisResult)
+
+def _drop_nulls(value: Any) -> Any:
+    """Remove ``None`` entries so explicit nulls fall back to field defaults."""
+    if isinstance(value, dict):
+        return {key: _drop_nulls(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_drop_nulls(item) for item in value if item is not None]
+    return value
+
+def _apply_derived_flags(result: Dict[str, Any]) -> None:
+    """Set the boolean flags and severities implied by the scores."""
+    toxicity = result["toxicity"]
+    if toxicity["score"] > 0.5 or any(score > 0.5 for score in toxicity["detailed_scores"].values()):
+        toxicity["is_toxic"] = True
+
+    profanity = result["profanity"]
+    if profanity["score"] > 0.3:
+        profanity["is_profane"] = True
+        if profanity["score"] > 0.7:
+            profanity["severity"] = "HIGH"
+        elif profanity["score"] > 0.4:
+            profanity["severity"] = "MEDIUM"
+        else:
+            profanity["severity"] = "LOW"
+
+    sensitivity = result["sensitivity"]
+    if sensitivity["score"] > 0.5 or any(score > 0.6 for score in sensitivity["categories"].values()):
+        sensitivity["is_sensitive"] = True
+
+    flagged = result["flagged_words"]
+    if flagged["count"] > 0:
+        if not flagged["severity_score"]:
+            flagged["severity_score"] = max(profanity["score"], toxicity["score"])
+        flagged["is_severe"] = flagged["severity_score"] > 0.5
+
+        # Ensure non-zero scores for toxic content
+        if toxicity["score"] == 0:
+            toxicity["score"] = max(0.7, flagged["severity_score"])
+            toxicity["is_toxic"] = True
+
+def normalize_result(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate, clamp and complete a raw analysis dict in one pass.
+
+    Args:
+        data: Analysis sections as returned by the model (possibly partial);
+            ``null`` values are treated as missing
+
+    Returns:
+        Dict matching ``AnalysisResult`` with derived flags applied
+
+    Raises:
+        pydantic.ValidationError: If a value has the wrong type (a ValueError)
+    """
+    try:
+        validated = _ADAPTER.validate_python(data)
+    except ValidationError:
+        # Nulls are rare, so they are only stripped once validation has failed
+        validated = _ADAPTER.validate_python(_drop_nulls(data))
+    result = _ADAPTER.dump_python(validated)
+    _apply_derived_flags(result)
+    return result
+
+def default_result() -> Dict[str, Any]:
+    """Result returned when analysis fails: every section at its defaults."""
+    return _ADAPTER.dump_python(AnalysisResult())
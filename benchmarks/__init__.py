@@ -0,0 +1,5 @@
+"""
+Benchmark suite for ToxidAPI hot paths.
+
+Run with ``python -m benchmarks`` from the repository root.
+"""
@@ -0,0 +1,86 @@
+"""
+Command-line entry point for the benchmark suite.
+
+Examples:
+    python -m benchmarks --output results.json
+    python -m benchmarks --only api.analyze --iterations 200
+    python -m benchmarks --output new.json --compare results.json --threshold 0.15
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+
+# Must be imported before any app module
+from benchmarks import environment  # noqa: F401
+from benchmarks.harness import BENCHMARKS, BenchmarkOptions, compare, write_results
+
+# Benchmark modules register themselves on import
+from benchmarks import bench_api, bench_database, bench_json_extraction, bench_normalizer  # noqa: F401
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run ToxidAPI benchmarks")
+    parser.add_argument("--iterations", type=int, default=500, help="Measured iterations per benchmark")
+    parser.add_argument("--warmup", type=int, default=20, help="Warmup iterations per benchmark")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent workers for async benchmarks")
+    parser.add_argument("--memory-iterations", type=int, default=200,
+                        help="Iterations run under tracemalloc for memory figures")
+    parser.add_argument("--only", action="append", default=[],
+                        help="Run only benchmarks whose name starts with this prefix (repeatable)")
+    parser.add_argument("--list", action="store_true", help="List available benchmarks and exit")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write JSON results")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Relative change treated as a regression when comparing")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for reproducible runs")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+
+    names = sorted(BENCHMARKS)
+    if args.only:
+        names = [n for n in names if any(n.startswith(prefix) for prefix in args.only)]
+    if args.list:
+        print("\n".join(names))
+        return 0
+
+    options = BenchmarkOptions(
+        iterations=args.iterations,
+        warmup=args.warmup,
+        concurrency=args.concurrency,
+        memory_iterations=args.memory_iterations,
+    )
+
+    results = []
+    print(f"{'benchmark':<32} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KB':>9}")
+    for name in names:
+        result = BENCHMARKS[name](options)
+        results.append(result)
+        if result.skipped:
+            print(f"{name:<32} skipped: {result.skipped}")
+        else:
+            print(f"{name:<32} {result.throughput_per_s:>10.1f} {result.p50_ms:>9.3f} "
+                  f"{result.p95_ms:>9.3f} {result.p99_ms:>9.3f} {result.peak_memory_kb:>9.1f}")
+
+    document = write_results(args.output, results)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(document, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+End-to-end benchmarks for the analyze, batch, auth and rate-limit hot paths.
+
+The FastAPI app runs in-process behind ``httpx.ASGITransport``; upstream Gemini
+calls are served by ``StubGenerativeModel``.
+"""
+
+import asyncio
+import dataclasses
+import gc
+import os
+import tracemalloc
+from contextlib import contextmanager
+
+import httpx
+from starlette.requests import Request
+
+from benchmarks import environment
+from benchmarks.harness import benchmark, measure_async, skipped
+
+from app.main import app
+from app.api import analysis, rate_limiter
+from app.api.redis_supervisor import RedisSupervisor
+from app.core.local_store import ExpiringStore
+
+# Simulated upstream latency in seconds for analyze benchmarks
+UPSTREAM_LATENCY = float(os.getenv("BENCH_UPSTREAM_LATENCY", "0"))
+
+# Distinct clients for the in-memory rate-limit store benchmark
+DISTINCT_CLIENTS = int(os.getenv("BENCH_DISTINCT_CLIENTS", "1000000"))
+
+@contextmanager
+def use_analyzer(analyzer):
+    """Temporarily swap the analyzer used by the API routes."""
+    previous = analysis.analyzer
+    analysis.analyzer = analyzer
+    analysis.result_cache.clear()
+    try:
+        yield analyzer
+    finally:
+        analysis.analyzer = previous
+        analysis.result_cache.clear()
+
+@contextmanager
+def use_redis(client):
+    """Temporarily swap the rate limiter's Redis client."""
+    previous = rate_limiter.redis_client, rate_limiter.redis_supervisor
+    rate_limiter.redis_client = client
+    rate_limiter.redis_supervisor = RedisSupervisor(client)
+    try:
+        yield client
+    finally:
+        rate_limiter.redis_client, rate_limiter.redis_supervisor = previous
+
+def _run_http(name, options, make_op):
+    """Run an HTTP benchmark against the in-process app."""
+    loop = asyncio.new_event_loop()
+    client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://bench",
+    )
+    try:
+        op = make_op(client)
+        return measure_async(name, op, options, loop=loop)
+    finally:
+        loop.run_until_complete(client.aclose())
+        loop.close()
+
+def _check_ok(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"Unexpected status {response.status_code}: {response.text[:200]}")
+
+def _analyze_op(headers, text_for):
+    def make_op(client):
+        async def op(i):
+            response = await client.post("/api/v2/analyze", json={"text": text_for(i)}, headers=headers)
+            _check_ok(response)
+        return op
+    return make_op
+
+@benchmark("api.analyze.cache_miss")
+def bench_analyze_cache_miss(options):
+    key = environment.create_api_key()
+    with use_analyzer(environment.make_stub_analyzer(latency=UPSTREAM_LATENCY)):
+        return _run_http(
+            "api.analyze.cache_miss", options,
+            _analyze_op({"X-API-Key": key}, lambda i: f"you absolute idiot #{i}"),
+        )
+
+@benchmark("api.analyze.cache_hit")
+def bench_analyze_cache_hit(options):
+    key = environment.create_api_key()
+    with use_analyzer(environment.make_stub_analyzer(latency=UPSTREAM_LATENCY)):
+        return _run_http(
+            "api.analyze.cache_hit", options,
+            _analyze_op({"X-API-Key": key}, lambda i: "you absolute idiot"),
+        )
+
+@benchmark("api.analyze.fenced_output")
+def bench_analyze_fenced_output(options):
+    """Cache misses where every model response needs the code-fence fallback parser."""
+    key = environment.create_api_key()
+    with use_analyzer(environment.make_stub_analyzer(latency=UPSTREAM_LATENCY, fenced=True)):
+        return _run_http(
+            "api.analyze.fenced_output", options,
+            _analyze_op({"X-API-Key": key}, lambda i: f"fenced text #{i}"),
+        )
+
+@benchmark("api.analyze.structured_output")
+def bench_analyze_structured_output(options):
+    """Cache misses with the analyzer in structured-output (response schema) mode."""
+    key = environment.create_api_key()
+    analyzer = environment.make_stub_analyzer(latency=UPSTREAM_LATENCY, structured_output=True)
+    with use_analyzer(analyzer):
+        result = _run_http(
+            "api.analyze.structured_output", options,
+            _analyze_op({"X-API-Key": key}, lambda i: f"structured text #{i}"),
+        )
+    result.extra["prompt_chars"] = len(analyzer.prompt_template)
+    return result
+
+@benchmark("api.analyze.mock_analyzer")
+def bench_analyze_mock_analyzer(options):
+    key = environment.create_api_key()
+    with use_analyzer(analysis.MockAnalyzer()):
+        return _run_http(
+            "api.analyze.mock_analyzer", options,
+            _analyze_op({"X-API-Key": key}, lambda i: f"this is terrible, I hate it #{i}"),
+        )
+
+@benchmark("api.analyze.anonymous")
+def bench_analyze_anonymous(options):
+    """Requests without an API key (IP-based rate limiting, no DB lookup)."""
+    with use_analyzer(environment.make_stub_analyzer(latency=UPSTREAM_LATENCY)):
+        return _run_http(
+            "api.analyze.anonymous", options,
+            _analyze_op({}, lambda i: f"anonymous text #{i}"),
+        )
+
+@benchmark("api.analyze.anonymous_cache_hit")
+def bench_analyze_anonymous_cache_hit(options):
+    """Repeated text without an API key: cache lookup and response rendering only."""
+    with use_analyzer(environment.make_stub_analyzer(latency=UPSTREAM_LATENCY)):
+        return _run_http(
+            "api.analyze.anonymous_cache_hit", options,
+            _analyze_op({}, lambda i: "anonymous repeated text"),
+        )
+
+def _bench_batch(name, options, size, tier="free"):
+    key = environment.create_api_key(tier)
+    headers = {"X-API-Key": key}
+
+    def make_op(client):
+        async def op(i):
+            texts = [f"batch {i} item {j}" for j in range(size)]
+            response = await client.post("/api/v2/analyze/batch", json={"texts": texts}, headers=headers)
+            _check_ok(response)
+        return op
+
+    with use_analyzer(environment.make_stub_analyzer(latency=UPSTREAM_LATENCY)):
+        result = _run_http(name, options, make_op)
+    result.extra["items_per_request"] = size
+    return result
+
+@benchmark("api.batch.10")
+def bench_batch(options):
+    return _bench_batch("api.batch.10", options, 10)
+
+@benchmark("api.batch.100")
+def bench_batch_100(options):
+    """Pro-tier batch; fan-out matters most with BENCH_UPSTREAM_LATENCY set."""
+    return _bench_batch("api.batch.100", options, 100, tier="pro")
+
+def _make_request(api_key=None):
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/api/v2/analyze",
+        "raw_path": b"/api/v2/analyze",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 12345),
+        "server": ("bench", 80),
+        "scheme": "http",
+        "root_path": "",
+        "app": app,
+    }
+    return Request(scope)
+
+@benchmark("auth.validate_api_key")
+def bench_validate_api_key(options):
+    key = environment.create_api_key()
+
+    async def op(i):
+        await rate_limiter.validate_api_key(_make_request(key), key)
+
+    with use_redis(None):
+        return measure_async("auth.validate_api_key", op, options)
+
+def _bench_check_rate_limit(name, options, algorithm="fixed_window", loop=None):
+    limit = 10 ** 9
+
+    async def op(i):
+        await rate_limiter.check_rate_limit(f"bench:{name}:{i % 1000}", limit, 3600, algorithm)
+
+    return measure_async(name, op, options, loop=loop)
+
+def _bench_check_rate_limit_redis(name, options, algorithm="fixed_window"):
+    loop = asyncio.new_event_loop()
+    try:
+        client, description = environment.redis_client_for_benchmarks(loop)
+        if client is None:
+            return skipped(name, description)
+        try:
+            with use_redis(client):
+                result = _bench_check_rate_limit(name, options, algorithm, loop=loop)
+        finally:
+            loop.run_until_complete(client.aclose())
+        result.extra["redis"] = description
+        return result
+    finally:
+        loop.close()
+
+@benchmark("ratelimit.check.memory")
+def bench_check_rate_limit_memory(options):
+    with use_redis(None):
+        return _bench_check_rate_limit("ratelimit.check.memory", options)
+
+@benchmark("ratelimit.check.redis")
+def bench_check_rate_limit_redis(options):
+    return _bench_check_rate_limit_redis("ratelimit.check.redis", options)
+
+@benchmark("ratelimit.check.memory.sliding_window")
+def bench_check_rate_limit_memory_sliding_window(options):
+    with use_redis(None):
+        return _bench_check_rate_limit("ratelimit.check.memory.sliding_window", options, "sliding_window")
+
+@benchmark("ratelimit.check.redis.sliding_window")
+def bench_check_rate_limit_redis_sliding_window(options):
+    return _bench_check_rate_limit_redis("ratelimit.check.redis.sliding_window", options, "sliding_window")
+
+@benchmark("ratelimit.check.memory.gcra")
+def bench_check_rate_limit_memory_gcra(options):
+    with use_redis(None):
+        return _bench_check_rate_limit("ratelimit.check.memory.gcra", options, "gcra")
+
+@benchmark("ratelimit.check.redis.gcra")
+def bench_check_rate_limit_redis_gcra(options):
+    return _bench_check_rate_limit_redis("ratelimit.check.redis.gcra", options, "gcra")
+
+@contextmanager
+def use_memory_store(store):
+    """Temporarily swap the rate limiter's in-memory store."""
+    previous = rate_limiter.in_memory_store
+    rate_limiter.in_memory_store = store
+    try:
+        yield store
+    finally:
+        rate_limiter.in_memory_store = previous
+
+@benchmark("ratelimit.memory.distinct_clients")
+def bench_rate_limit_memory_distinct_clients(options):
+    """
+    One check for each of DISTINCT_CLIENTS clients against the in-memory store.
+
+    Timing uses the harness; memory is measured separately, for a fresh store
+    taking every client, so it shows what the store holds after a scan.
+    """
+    name = "ratelimit.memory.distinct_clients"
+    capacity = rate_limiter.RATE_LIMIT_MEMORY_MAX_KEYS
+    identifiers = [f"ip:10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}/{i >> 24}" for i in range(DISTINCT_CLIENTS)]
+
+    async def op(i):
+        await rate_limiter.check_rate_limit(identifiers[i % DISTINCT_CLIENTS], 100, 3600)
+
+    async def scan():
+        for identifier in identifiers:
+            await rate_limiter.check_rate_limit(identifier, 100, 3600)
+
+    timing = dataclasses.replace(options, iterations=DISTINCT_CLIENTS, warmup=0, memory_iterations=0)
+    with use_redis(None), use_memory_store(ExpiringStore(capacity, name="bench")):
+        result = measure_async(name, op, timing)
+
+    loop = asyncio.new_event_loop()
+    try:
+        with use_redis(None), use_memory_store(ExpiringStore(capacity, name="bench")) as store:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before, _ = tracemalloc.get_traced_memory()
+                loop.run_until_complete(scan())
+                gc.collect()
+                after, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            entries = len(store)
+    finally:
+        loop.close()
+
+    result.peak_memory_kb = max(0, peak - before) / 1024
+    result.retained_memory_kb = max(0, after - before) / 1024
+    result.extra.update({
+        "distinct_clients": DISTINCT_CLIENTS,
+        "capacity": capacity,
+        "entries": entries,
+        "bytes_per_entry": round(max(0, after - before) / max(1, entries), 1),
+    })
+    return result
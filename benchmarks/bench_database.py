@@ -0,0 +1,46 @@
+"""
+Benchmarks for acquiring a database session.
+
+Compares a session from the process-wide pooled engine, whose schema was
+migrated once when it was created, with the path ``get_db`` took before:
+a fresh NullPool engine per session, a ``SELECT 1`` connection test,
+``create_all``, a table-name inspection and disposing the engine afterwards.
+Both run one key lookup, like an authenticated request on a cache miss.
+"""
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from benchmarks.environment import create_api_key
+from benchmarks.harness import benchmark, measure
+
+from app.models.database import DATABASE_URL, Base, DBAPIKey, session_scope
+
+def legacy_session_lookup(api_key: str) -> None:
+    """The per-session engine setup get_db used to do, kept for comparison."""
+    engine = create_engine(DATABASE_URL, poolclass=NullPool, connect_args={"check_same_thread": False})
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        inspect(engine).get_table_names()
+        db.query(DBAPIKey.id).filter(DBAPIKey.key == api_key).first()
+    finally:
+        db.close()
+        engine.dispose()
+
+def pooled_session_lookup(api_key: str) -> None:
+    with session_scope() as db:
+        db.query(DBAPIKey.id).filter(DBAPIKey.key == api_key).first()
+
+@benchmark("db.session.legacy")
+def bench_session_legacy(options):
+    api_key = create_api_key()
+    return measure("db.session.legacy", lambda i: legacy_session_lookup(api_key), options)
+
+@benchmark("db.session.pooled")
+def bench_session_pooled(options):
+    api_key = create_api_key()
+    return measure("db.session.pooled", lambda i: pooled_session_lookup(api_key), options)
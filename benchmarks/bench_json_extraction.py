@@ -0,0 +1,88 @@
+"""
+Benchmarks for extracting JSON from model output.
+
+Runs the corpus in ``data/model_outputs.jsonl`` through ``extract_json`` and
+through the inline parser ``GeminiAnalyzer.analyze`` used before it, reporting
+per-call latency and how many corpus entries each one recovers. The
+``.valid`` variants run only the entries the legacy parser recovers, so
+the two can be compared on the same input; the full corpus mixes in the
+repair and truncation paths that the legacy parser rejects outright.
+"""
+
+import json
+import re
+from pathlib import Path
+
+from benchmarks.harness import benchmark, measure
+
+from app.models.json_extraction import extract_json, JSONExtractionError
+
+CORPUS_PATH = Path(__file__).parent / "data" / "model_outputs.jsonl"
+
+def load_corpus():
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def legacy_extract(response_text):
+    """The parsing previously inlined in GeminiAnalyzer.analyze, kept for comparison."""
+    try:
+        return json.loads(response_text)
+    except:
+        if "```json" in response_text:
+            json_str = response_text.split("```json")[1].split("```")[0]
+        elif "```" in response_text:
+            json_str = response_text.split("```")[1].split("```")[0]
+        else:
+            match = re.search(r'({[\s\S]*})', response_text)
+            json_str = match.group(1) if match else response_text
+        json_str = re.sub(r'<[^>]+>', '', json_str)
+        json_str = json_str.strip()
+        return json.loads(json_str)
+
+def _recovered(parse, corpus):
+    count = 0
+    for entry in corpus:
+        try:
+            if isinstance(parse(entry["text"]), dict):
+                count += 1
+        except (ValueError, IndexError):
+            pass
+    return count
+
+def _legacy_recovers(entry):
+    try:
+        return isinstance(legacy_extract(entry["text"]), dict)
+    except (ValueError, IndexError):
+        return False
+
+def _bench(name, parse, options, valid_only=False):
+    corpus = load_corpus()
+    if valid_only:
+        corpus = [entry for entry in corpus if _legacy_recovers(entry)]
+
+    def op(i):
+        try:
+            parse(corpus[i % len(corpus)]["text"])
+        except (ValueError, IndexError):
+            pass
+
+    result = measure(name, op, options)
+    result.extra["corpus_size"] = len(corpus)
+    result.extra["recovered"] = _recovered(parse, corpus)
+    return result
+
+@benchmark("json_extraction.extract_json")
+def bench_extract_json(options):
+    return _bench("json_extraction.extract_json", extract_json, options)
+
+@benchmark("json_extraction.legacy")
+def bench_legacy(options):
+    return _bench("json_extraction.legacy", legacy_extract, options)
+
+@benchmark("json_extraction.extract_json.valid")
+def bench_extract_json_valid(options):
+    return _bench("json_extraction.extract_json.valid", extract_json, options, valid_only=True)
+
+@benchmark("json_extraction.legacy.valid")
+def bench_legacy_valid(options):
+    return _bench("json_extraction.legacy.valid", legacy_extract, options, valid_only=True)
@@ -0,0 +1,153 @@
+"""
+Benchmarks for normalizing analyzer output into the response shape.
+
+Compares ``normalize_result`` (one validation pass against ``AnalysisResult``)
+with the previous path: ``setdefault`` normalization in the analyzer followed
+by FastAPI validating and serializing the dict against ``AnalysisResponse``.
+Both include everything done per request between parsing the model output
+and handing the content to the JSON encoder.
+"""
+
+import json
+from typing import Any, Dict
+
+from pydantic import TypeAdapter
+
+from benchmarks.environment import STUB_RESPONSE
+from benchmarks.harness import benchmark, measure
+
+from app.api.models import AnalysisResponse
+from app.models.result_normalizer import normalize_result
+
+# Partial output, as returned by the mock analyzers and truncated responses
+PARTIAL_RESPONSE = {
+    "toxicity": {"score": 0.0, "is_toxic": False, "detailed_scores": {"insult": 0.9}},
+    "sentiment": {"score": -0.4, "label": "NEGATIVE"},
+    "profanity": {"score": 0.35},
+    "flagged_words": {"count": 2, "words": ["idiot", "moron"]},
+}
+
+def legacy_normalize(result: Dict[str, Any]) -> None:
+    """The setdefault-based normalizer previously in GeminiAnalyzer, kept for comparison."""
+    # Ensure toxicity scores exist and are normalized
+    result.setdefault("toxicity", {})
+    toxicity = result["toxicity"]
+    toxicity.setdefault("score", 0.0)
+    toxicity.setdefault("is_toxic", False)
+    toxicity.setdefault("detailed_scores", {})
+
+    # Normalize detailed scores
+    for key in ["toxicity", "severe_toxicity", "obscene", "threat", "insult", "identity_hate"]:
+        toxicity["detailed_scores"].setdefault(key, 0.0)
+        toxicity["detailed_scores"][key] = min(1.0, max(0.0, float(toxicity["detailed_scores"][key])))
+
+    # Update is_toxic based on score
+    if toxicity["score"] > 0.5 or any(score > 0.5 for score in toxicity["detailed_scores"].values()):
+        toxicity["is_toxic"] = True
+
+    # Normalize sentiment
+    result.setdefault("sentiment", {})
+    sentiment = result["sentiment"]
+    sentiment.setdefault("score", 0.0)
+    sentiment.setdefault("label", "NEUTRAL")
+    sentiment.setdefault("emotions", {})
+
+    # Add emotions if not present
+    for emotion in ["joy", "sadness", "anger", "fear", "surprise"]:
+        sentiment["emotions"].setdefault(emotion, 0.0)
+
+    # Normalize profanity
+    result.setdefault("profanity", {})
+    profanity = result["profanity"]
+    profanity.setdefault("score", 0.0)
+    profanity.setdefault("is_profane", False)
+    profanity.setdefault("severity", "NONE")
+    profanity.setdefault("categories", {})
+
+    # Add profanity categories if not present
+    for category in ["mild_profanity", "strong_profanity", "sexual_references", "slurs"]:
+        profanity["categories"].setdefault(category, 0.0)
+
+    # Update is_profane based on score
+    if profanity["score"] > 0.3:
+        profanity["is_profane"] = True
+        if profanity["score"] > 0.7:
+            profanity["severity"] = "HIGH"
+        elif profanity["score"] > 0.4:
+            profanity["severity"] = "MEDIUM"
+        else:
+            profanity["severity"] = "LOW"
+
+    # Normalize sensitivity
+    result.setdefault("sensitivity", {})
+    sensitivity = result["sensitivity"]
+    sensitivity.setdefault("score", 0.0)
+    sensitivity.setdefault("is_sensitive", False)
+    sensitivity.setdefault("categories", {})
+
+    # Add sensitivity categories if not present
+    for category in ["political", "religious", "racial", "gender", "violence", "self_harm"]:
+        sensitivity["categories"].setdefault(category, 0.0)
+
+    # Update is_sensitive based on score
+    if sensitivity["score"] > 0.5 or any(score > 0.6 for score in sensitivity["categories"].values()):
+        sensitivity["is_sensitive"] = True
+
+    # Normalize readability
+    result.setdefault("readability", {})
+    readability = result["readability"]
+    readability.setdefault("score", 0.5)
+    readability.setdefault("grade_level", 8)
+    readability.setdefault("difficulty", "MEDIUM")
+    readability.setdefault("metrics", {})
+
+    # Add readability metrics if not present
+    readability["metrics"].setdefault("avg_word_length", 5.0)
+    readability["metrics"].setdefault("avg_sentence_length", 15.0)
+    readability["metrics"].setdefault("complex_word_percentage", 0.3)
+
+    # Normalize flagged words
+    result.setdefault("flagged_words", {})
+    flagged = result["flagged_words"]
+    flagged.setdefault("count", 0)
+    flagged.setdefault("words", [])
+    flagged.setdefault("categories", {})
+    flagged.setdefault("severity_score", 0.0)
+    flagged.setdefault("is_severe", False)
+
+    # Update severity based on content
+    if flagged["count"] > 0:
+        if not flagged["severity_score"]:
+            flagged["severity_score"] = max(profanity["score"], toxicity["score"])
+        flagged["is_severe"] = flagged["severity_score"] > 0.5
+
+# Response-model validation and serialization FastAPI ran on every analyze response
+_RESPONSE_ADAPTER = TypeAdapter(AnalysisResponse)
+
+def legacy_pipeline(data: Dict[str, Any]) -> Dict[str, Any]:
+    legacy_normalize(data)
+    if data["flagged_words"]["count"] > 0 and data["toxicity"]["score"] == 0:
+        data["toxicity"]["score"] = max(0.7, data["flagged_words"]["severity_score"])
+        data["toxicity"]["is_toxic"] = True
+    content = {**data, "processing_time": 0.01, "text": "bench"}
+    return _RESPONSE_ADAPTER.dump_python(_RESPONSE_ADAPTER.validate_python(content), mode="json")
+
+def current_pipeline(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {**normalize_result(data), "processing_time": 0.01, "text": "bench"}
+
+def _bench(name, pipeline, options):
+    inputs = [json.dumps(STUB_RESPONSE), json.dumps(PARTIAL_RESPONSE)]
+
+    def op(i):
+        # Model output is freshly parsed per request (the legacy path mutates it)
+        pipeline(json.loads(inputs[i % len(inputs)]))
+
+    return measure(name, op, options)
+
+@benchmark("normalize.result")
+def bench_normalize_result(options):
+    return _bench("normalize.result", current_pipeline, options)
+
+@benchmark("normalize.legacy")
+def bench_normalize_legacy(options):
+    return _bench("normalize.legacy", legacy_pipeline, options)
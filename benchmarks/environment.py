@@ -0,0 +1,165 @@
+"""
+In-process benchmark environment.
+
+Importing this module configures environment variables for an isolated run
+(temporary SQLite database, effectively unlimited rate limits, no Gemini key)
+and must therefore happen before any ``app`` module is imported.
+"""
+
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+_TMP_DIR = tempfile.mkdtemp(prefix="toxidapi-bench-")
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP_DIR, 'bench.db')}"
+os.environ.setdefault("RATE_LIMIT", "1000000000")
+os.environ.setdefault("PRO_RATE_LIMIT", "1000000000")
+os.environ.setdefault("CONCURRENCY_LIMIT", "1000000")
+os.environ.setdefault("PRO_CONCURRENCY_LIMIT", "1000000")
+os.environ.setdefault("QUOTA_MONTHLY", "0")
+os.environ.setdefault("PRO_QUOTA_MONTHLY", "0")
+os.environ.pop("GEMINI_API_KEY", None)
+# Keep the rate limiter off any Redis that happens to run locally (empty
+# disables Redis); the Redis benchmarks install their own client explicitly.
+os.environ["REDIS_URL"] = os.getenv("BENCH_APP_REDIS_URL", "")
+
+# Canned model output matching the prompt's JSON structure
+STUB_RESPONSE = {
+    "toxicity": {
+        "score": 0.82,
+        "is_toxic": True,
+        "detailed_scores": {
+            "toxicity": 0.82, "severe_toxicity": 0.4, "obscene": 0.6,
+            "threat": 0.05, "insult": 0.77, "identity_hate": 0.02,
+        },
+    },
+    "sentiment": {
+        "score": -0.7,
+        "label": "NEGATIVE",
+        "emotions": {"joy": 0.01, "sadness": 0.2, "anger": 0.8, "fear": 0.05, "surprise": 0.1},
+    },
+    "profanity": {
+        "score": 0.5,
+        "is_profane": True,
+        "severity": "MEDIUM",
+        "categories": {"mild_profanity": 0.4, "strong_profanity": 0.3, "sexual_references": 0.0, "slurs": 0.0},
+    },
+    "sensitivity": {
+        "score": 0.1,
+        "is_sensitive": False,
+        "categories": {
+            "political": 0.0, "religious": 0.0, "racial": 0.0,
+            "gender": 0.0, "violence": 0.1, "self_harm": 0.0,
+        },
+    },
+    "readability": {
+        "score": 0.8,
+        "grade_level": 3,
+        "difficulty": "EASY",
+        "metrics": {"avg_word_length": 4.1, "avg_sentence_length": 5.0, "complex_word_percentage": 0.05},
+    },
+    "flagged_words": {
+        "count": 1,
+        "words": ["idiot"],
+        "categories": {"insults": ["idiot"]},
+        "severity_score": 0.6,
+        "is_severe": True,
+    },
+}
+
+class StubGeminiResponse:
+    """Minimal stand-in for a google.generativeai response object."""
+    def __init__(self, text: str):
+        self.text = text
+
+class StubGenerativeModel:
+    """
+    Stand-in for ``genai.GenerativeModel`` that returns canned output.
+
+    Args:
+        latency: Seconds to sleep per call, simulating upstream latency
+        fenced: Wrap the JSON in a markdown code fence to exercise the fallback parser
+    """
+    def __init__(self, latency: float = 0.0, fenced: bool = False):
+        self.latency = latency
+        self.calls = 0
+        body = json.dumps(STUB_RESPONSE)
+        self.text = f"```json\n{body}\n```" if fenced else body
+
+    def generate_content(self, prompt, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return StubGeminiResponse(self.text)
+
+def make_stub_analyzer(latency: float = 0.0, fenced: bool = False, structured_output: bool = False):
+    """Build a real GeminiAnalyzer whose upstream model is stubbed out."""
+    from app.models.gemini_analyzer import GeminiAnalyzer
+
+    analyzer = GeminiAnalyzer("bench-stub-key", structured_output=structured_output)
+    analyzer.model = StubGenerativeModel(latency=latency, fenced=fenced)
+    return analyzer
+
+def create_api_key(tier: str = "free") -> str:
+    """Insert a user and an active API key into the benchmark database."""
+    from app.models.database import get_db, DBUser, DBAPIKey
+
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        user_id = str(uuid.uuid4())
+        key = f"toxid_{uuid.uuid4().hex}"
+        db.add(DBUser(
+            id=user_id,
+            email=f"bench-{user_id}@example.com",
+            hashed_password="x",
+            tier=tier,
+            is_active=True,
+            created_at=datetime.utcnow(),
+        ))
+        db.add(DBAPIKey(
+            id=str(uuid.uuid4()),
+            key=key,
+            name="bench",
+            user_id=user_id,
+            is_active=True,
+            created_at=datetime.utcnow(),
+        ))
+        db.commit()
+        return key
+    finally:
+        db_gen.close()
+
+def redis_client_for_benchmarks(loop):
+    """
+    Return ``(client, description)`` for the Redis benchmarks.
+
+    The client is a ``redis.asyncio`` client bound to ``loop``. Uses
+    ``BENCH_REDIS_URL`` when a server is reachable there, otherwise
+    ``fakeredis`` when it is installed with Lua support, otherwise
+    ``(None, reason)``.
+    """
+    url = os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15")
+    try:
+        import redis.asyncio
+        client = redis.asyncio.from_url(url)
+        loop.run_until_complete(client.ping())
+        return client, url
+    except Exception as e:
+        reason = f"Redis unavailable at {url}: {e}"
+
+    try:
+        import fakeredis
+    except ImportError:
+        return None, reason
+    client = fakeredis.FakeAsyncRedis()
+    try:
+        # The rate limiter runs Lua scripts; fakeredis needs lupa for them
+        loop.run_until_complete(client.eval("return 1", 0))
+    except Exception:
+        return None, f"{reason}; fakeredis has no Lua support (install lupa)"
+    return client, "fakeredis"
@@ -0,0 +1,237 @@
+"""
+Timing and memory harness shared by all benchmark modules.
+
+Benchmarks register themselves with the ``benchmark`` decorator and return a
+``BenchmarkResult`` built by ``measure`` or ``measure_async``.
+"""
+
+import asyncio
+import gc
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass, field, asdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Registry of benchmark name -> callable(options) -> BenchmarkResult
+BENCHMARKS: Dict[str, Callable[["BenchmarkOptions"], "BenchmarkResult"]] = {}
+
+@dataclass
+class BenchmarkOptions:
+    """Options passed to every benchmark."""
+    iterations: int = 500
+    warmup: int = 20
+    concurrency: int = 1
+    memory_iterations: int = 200
+
+@dataclass
+class BenchmarkResult:
+    """Machine-readable result of a single benchmark."""
+    name: str
+    iterations: int = 0
+    concurrency: int = 1
+    throughput_per_s: float = 0.0
+    mean_ms: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    p99_ms: float = 0.0
+    max_ms: float = 0.0
+    peak_memory_kb: float = 0.0
+    retained_memory_kb: float = 0.0
+    skipped: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def benchmark(name: str):
+    """Register a benchmark function under ``name``."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank))]
+
+def _summarize(name: str, latencies: List[float], wall: float, options: BenchmarkOptions) -> BenchmarkResult:
+    latencies.sort()
+    count = len(latencies)
+    return BenchmarkResult(
+        name=name,
+        iterations=count,
+        concurrency=options.concurrency,
+        throughput_per_s=count / wall if wall > 0 else 0.0,
+        mean_ms=sum(latencies) / count * 1000 if count else 0.0,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+        max_ms=latencies[-1] * 1000 if count else 0.0,
+    )
+
+def _memory_pass(run_ops: Callable[[int], None], iterations: int) -> Dict[str, float]:
+    """Run ``iterations`` operations under tracemalloc and report peak/retained KB."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        run_ops(iterations)
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "peak_memory_kb": max(0, peak - before) / 1024,
+        "retained_memory_kb": max(0, after - before) / 1024,
+    }
+
+def measure(name: str, op: Callable[[int], Any], options: BenchmarkOptions) -> BenchmarkResult:
+    """
+    Benchmark a synchronous operation.
+
+    Args:
+        name: Benchmark name
+        op: Callable receiving the iteration index
+        options: Benchmark options
+
+    Returns:
+        BenchmarkResult with latency percentiles, throughput and memory
+    """
+    for i in range(options.warmup):
+        op(i)
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(options.iterations):
+        t0 = time.perf_counter()
+        op(options.warmup + i)
+        latencies.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - started
+
+    result = _summarize(name, latencies, wall, options)
+    offset = options.warmup + options.iterations
+
+    def run_ops(n):
+        for i in range(n):
+            op(offset + i)
+
+    memory = _memory_pass(run_ops, min(options.iterations, options.memory_iterations))
+    result.peak_memory_kb = memory["peak_memory_kb"]
+    result.retained_memory_kb = memory["retained_memory_kb"]
+    return result
+
+def measure_async(name: str, op: Callable[[int], Awaitable[Any]], options: BenchmarkOptions,
+                  loop: Optional[asyncio.AbstractEventLoop] = None) -> BenchmarkResult:
+    """
+    Benchmark an async operation with ``options.concurrency`` concurrent workers.
+
+    Args:
+        name: Benchmark name
+        op: Coroutine function receiving the iteration index
+        options: Benchmark options
+        loop: Event loop to run on (a new one is created if omitted)
+
+    Returns:
+        BenchmarkResult with latency percentiles, throughput and memory
+    """
+    own_loop = loop is None
+    loop = loop or asyncio.new_event_loop()
+
+    async def run(start: int, count: int, latencies: Optional[List[float]]):
+        queue = iter(range(start, start + count))
+
+        async def worker():
+            for i in queue:
+                t0 = time.perf_counter()
+                await op(i)
+                if latencies is not None:
+                    latencies.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, options.concurrency))))
+
+    try:
+        loop.run_until_complete(run(0, options.warmup, None))
+
+        latencies: List[float] = []
+        started = time.perf_counter()
+        loop.run_until_complete(run(options.warmup, options.iterations, latencies))
+        wall = time.perf_counter() - started
+
+        result = _summarize(name, latencies, wall, options)
+        offset = options.warmup + options.iterations
+        memory = _memory_pass(
+            lambda n: loop.run_until_complete(run(offset, n, None)),
+            min(options.iterations, options.memory_iterations),
+        )
+        result.peak_memory_kb = memory["peak_memory_kb"]
+        result.retained_memory_kb = memory["retained_memory_kb"]
+        return result
+    finally:
+        if own_loop:
+            loop.close()
+
+def skipped(name: str, reason: str) -> BenchmarkResult:
+    """Result placeholder for a benchmark that could not run in this environment."""
+    return BenchmarkResult(name=name, skipped=reason)
+
+def environment_info() -> Dict[str, Any]:
+    """Describe the environment so results from different runs can be compared."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=False,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+    }
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare two result documents and describe regressions.
+
+    A benchmark regresses when its p50 or p99 latency grows, or its throughput
+    drops, by more than ``threshold`` (a fraction, e.g. 0.1 for 10%).
+    """
+    regressions = []
+    baseline_results = {r["name"]: r for r in baseline.get("results", [])}
+    for result in current.get("results", []):
+        old = baseline_results.get(result["name"])
+        if not old or result.get("skipped") or old.get("skipped"):
+            continue
+        for metric in ("p50_ms", "p99_ms"):
+            if old[metric] > 0 and result[metric] > old[metric] * (1 + threshold):
+                regressions.append(
+                    f"{result['name']}: {metric} {old[metric]:.3f} -> {result[metric]:.3f}"
+                )
+        if old["throughput_per_s"] > 0 and result["throughput_per_s"] < old["throughput_per_s"] * (1 - threshold):
+            regressions.append(
+                f"{result['name']}: throughput_per_s {old['throughput_per_s']:.1f} -> {result['throughput_per_s']:.1f}"
+            )
+    return regressions
+
+def write_results(path: str, results: List[BenchmarkResult]) -> Dict[str, Any]:
+    """Write results as JSON and return the written document."""
+    document = {
+        "environment": environment_info(),
+        "results": [r.to_dict() for r in results],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2)
+    return document
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import uuid
+from typing import NamedTuple
+
+import pytest
+
+# Point the app at a throwaway database before any test module imports it
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+
+from app.api import analysis
+from app.models.database import session_scope, DBAPIKey, DBUser
+from app.models.result_normalizer import normalize_result
+
+class RecordingAnalyzer:
+    """Analyzer stand-in: texts containing "idiot" are toxic and "boom" fails upstream."""
+
+    def __init__(self, interrupt_on=None):
+        self.calls = []
+        self.interrupt_on = interrupt_on
+
+    def analyze(self, text):
+        if text == self.interrupt_on:
+            raise KeyboardInterrupt
+        self.calls.append(text)
+        if text == "boom":
+            raise RuntimeError("upstream failed")
+        return normalize_result({"toxicity": {"score": 0.9 if "idiot" in text else 0.0}})
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    """Install a ``RecordingAnalyzer`` behind an empty result cache."""
+    analyzer = RecordingAnalyzer()
+    monkeypatch.setattr(analysis, "analyzer", analyzer)
+    analysis.result_cache.clear()
+    yield analyzer
+    analysis.result_cache.clear()
+
+class KeyRecord(NamedTuple):
+    user_id: str
+    key_id: str
+    key: str
+
+def make_key(tier="free"):
+    """Create a user of ``tier`` with one active API key."""
+    with session_scope() as db:
+        user_id, key_id = str(uuid.uuid4()), str(uuid.uuid4())
+        key = f"toxid_{uuid.uuid4().hex}"
+        db.add(DBUser(id=user_id, email=f"{user_id}@example.com", hashed_password="x", tier=tier))
+        db.add(DBAPIKey(id=key_id, key=key, name="test", user_id=user_id, is_active=True))
+        db.commit()
+        return KeyRecord(user_id, key_id, key)
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from conftest import RecordingAnalyzer, make_key
+from app.api import analysis, rate_limiter
+from app.core.local_store import ExpiringStore
+from app.main import app, usage_meter
+
+class SlowAnalyzer(RecordingAnalyzer):
+    """Takes a while over texts starting with "slow"."""
+
+    def analyze(self, text):
+        if text.startswith("slow"):
+            time.sleep(0.05)
+        return super().analyze(text)
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(usage_meter, "client", None)
+
+def analyze_batch(texts):
+    return asyncio.run(analysis.analyze_batch(texts))
+
+def test_batch_results_follow_input_order(analyzer):
+    texts = [f"text {i}" for i in range(20)]
+
+    items = analyze_batch(texts)
+
+    assert [item["entry"].result["text"] for item in items] == texts
+
+def test_repeated_texts_are_analyzed_once(analyzer):
+    items = analyze_batch(["a", "b", "a", "a", "b"])
+
+    assert sorted(analyzer.calls) == ["a", "b"]
+    assert items[0]["entry"] is items[2]["entry"] is items[3]["entry"]
+    assert items[1]["entry"] is items[4]["entry"]
+
+def test_failed_items_do_not_fail_the_batch(analyzer):
+    items = analyze_batch(["a", "boom", 3, "you idiot"])
+
+    assert [item["status"] for item in items] == ["ok", "error", "error", "ok"]
+    assert items[1]["error"] == {"code": "ANALYSIS_FAILED", "message": "upstream failed"}
+    assert items[2]["error"]["code"] == "INVALID_ITEM"
+    assert items[3]["entry"].result["toxicity"]["is_toxic"] is True
+
+def test_each_item_measures_its_own_processing_time(monkeypatch):
+    monkeypatch.setattr(analysis, "analyzer", SlowAnalyzer())
+    analysis.result_cache.clear()
+
+    items = analyze_batch(["slow 1", "fast", "slow 2"])
+    analysis.result_cache.clear()
+
+    assert items[0]["processing_time"] >= 0.05 and items[2]["processing_time"] >= 0.05
+    assert items[1]["processing_time"] < 0.05
+
+def post_batch(texts, key):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/v2/analyze/batch", json={"texts": texts}, headers={"X-API-Key": key})
+    return asyncio.run(scenario())
+
+def test_batch_endpoint_renders_items_in_order_with_a_summary(analyzer):
+    response = post_batch(["a", "boom", "a", "you idiot"], make_key().key)
+
+    assert response.status_code == 200
+    body = response.json()
+    results = body["results"]
+    assert [item["status"] for item in results] == ["ok", "error", "ok", "ok"]
+    assert [item["text"] for item in results] == ["a", "boom", "a", "you idiot"]
+    assert results[1]["error"]["code"] == "ANALYSIS_FAILED"
+    assert results[3]["toxicity"]["is_toxic"] is True
+    assert all(isinstance(item["processing_time"], float) for item in results)
+    assert body["summary"] == {"total": 4, "succeeded": 3, "failed": 1, "unique": 3}
+    assert sorted(analyzer.calls) == ["a", "boom", "you idiot"]
+
+@pytest.mark.parametrize("tier, cap", [("free", 10), ("pro", 500)])
+def test_batch_size_is_capped_per_tier(analyzer, tier, cap):
+    texts = [f"text {i}" for i in range(cap + 1)]
+
+    # Separate keys, so neither request spends the other's rate limit
+    accepted = post_batch(texts[:cap], make_key(tier).key)
+    too_large = post_batch(texts, make_key(tier).key)
+
+    assert accepted.status_code == 200
+    assert accepted.json()["summary"]["total"] == cap
+    assert too_large.status_code == 400
+    assert too_large.json()["detail"] == f"Batch size limit is {cap} texts"
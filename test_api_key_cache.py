@@ -0,0 +1,142 @@
+import asyncio
+import uuid
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+
+from conftest import make_key
+from app.api import auth, last_used, rate_limiter
+from app.api.auth import delete_api_key
+from app.models.database import session_scope, DBAPIKey
+
+def setup_function():
+    rate_limiter.api_key_cache.clear()
+
+def make_request(api_key):
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/api/v2/analyze",
+        "headers": [(b"x-api-key", api_key.encode())],
+        "client": ("127.0.0.1", 12345),
+    })
+
+def validate(api_key):
+    request = make_request(api_key)
+    asyncio.run(rate_limiter.validate_api_key(request, api_key))
+    return request
+
+@pytest.fixture
+def key_queries():
+    """Count SELECTs against api_keys."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "api_keys" in statement:
+            statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    yield statements
+    event.remove(Engine, "before_cursor_execute", record)
+
+def test_key_is_resolved_once_and_shared_through_request_state(key_queries):
+    user_id, _, key = make_key(tier="pro")
+
+    first = validate(key)
+    second = validate(key)
+
+    assert len(key_queries) == 1
+    for request in (first, second):
+        assert request.state.user_id == user_id
+        assert request.state.tier == "pro"
+        assert request.state.api_key_info.limits == rate_limiter.limits_for_tier("pro")
+
+def test_unknown_keys_are_cached_briefly(key_queries, monkeypatch):
+    for _ in range(3):
+        with pytest.raises(HTTPException) as error:
+            validate("toxid_bogus")
+        assert error.value.status_code == 401
+    assert len(key_queries) == 1
+
+    monkeypatch.setattr(rate_limiter, "API_KEY_NEGATIVE_CACHE_TTL", 0)
+    rate_limiter.api_key_cache.clear()
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            validate("toxid_bogus")
+    assert len(key_queries) == 3
+
+def test_middleware_resolution_is_reused_by_the_route(key_queries):
+    user_id, _, key = make_key()
+    request = make_request(key)
+
+    async def scenario():
+        # As RateLimitMiddleware, ConcurrencyLimitMiddleware and then the route would
+        first = await rate_limiter.lookup_api_key(request.scope)
+        rate_limiter.api_key_cache.clear()
+        second = await rate_limiter.lookup_api_key(request.scope)
+        await rate_limiter.validate_api_key(request, key)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is second is request.state.api_key_info
+    assert request.state.user_id == user_id
+    assert len(key_queries) == 1
+
+def test_deleted_key_is_rejected_immediately():
+    user_id, _, key = make_key()
+    request = validate(key)
+
+    with session_scope() as db:
+        assert delete_api_key(request.state.api_key_id, user_id, db)
+
+    with pytest.raises(HTTPException) as error:
+        validate(key)
+    assert error.value.status_code == 401
+
+def test_new_key_is_accepted_immediately(monkeypatch):
+    user_id = make_key().user_id
+    fixed = uuid.uuid4()
+    monkeypatch.setattr(auth.uuid, "uuid4", lambda: fixed)
+    key = f"toxid_{fixed.hex}"
+
+    # Tried before it existed, so it is cached as unknown
+    with pytest.raises(HTTPException):
+        validate(key)
+    with session_scope() as db:
+        auth.create_api_key(user_id, "new", db)
+
+    assert validate(key).state.user_id == user_id
+
+def test_last_used_is_written_behind(monkeypatch):
+    tracker = last_used.LastUsedTracker()
+    monkeypatch.setattr(last_used, "tracker", tracker)
+    keys = [make_key().key for _ in range(2)]
+    updates = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("UPDATE") and "api_keys" in statement:
+            updates.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        ids = [validate(key).state.api_key_id for key in keys for _ in range(3)][::3]
+        assert updates == []
+        assert len(tracker) == 2
+        assert asyncio.run(tracker.flush()) == 2
+        assert len(updates) == 1
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+
+    with session_scope() as db:
+        stored = {key.id: key.last_used for key in db.query(DBAPIKey).filter(DBAPIKey.id.in_(ids))}
+    assert all(stored[key_id] is not None for key_id in ids)
+
+    # A late write of an older time does not move last_used back
+    tracker.touch(ids[0], stored[ids[0]] - timedelta(minutes=5))
+    asyncio.run(tracker.flush())
+    with session_scope() as db:
+        assert db.get(DBAPIKey, ids[0]).last_used == stored[ids[0]]
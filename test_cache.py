@@ -0,0 +1,62 @@
+import asyncio
+import json
+import re
+
+import httpx
+import pytest
+
+from conftest import make_key
+from app.api import rate_limiter
+from app.api.cache import ResultCache
+from app.api.responses import RenderedJSONResponse
+from app.core.local_store import ExpiringStore
+from app.main import app, usage_meter
+from app.models.result_normalizer import normalize_result
+
+PROCESSING_TIME_RE = re.compile(rb',"processing_time":[^,}]+')
+
+def make_entry(text="you idiot"):
+    return ResultCache(10).put(text, normalize_result({"toxicity": {"score": 0.9}}))
+
+@pytest.mark.parametrize("processing_time", [0, 0.25, 1e-07, 12345.678])
+def test_render_adds_processing_time_to_the_stored_body(processing_time):
+    entry = make_entry()
+
+    body = entry.render(processing_time)
+
+    assert json.loads(body) == {**entry.result, "processing_time": processing_time}
+    assert PROCESSING_TIME_RE.sub(b"", body) == entry.body
+
+def test_extra_members_are_spliced_in_as_valid_json():
+    entry = make_entry()
+
+    body = entry.render(0.5, extra=b',"status":"ok","index":3')
+
+    assert json.loads(body) == {**entry.result, "processing_time": 0.5, "status": "ok", "index": 3}
+
+def test_rendered_response_sends_the_bytes_as_json():
+    response = RenderedJSONResponse(content=make_entry().render(0.1))
+
+    assert response.media_type == "application/json"
+    assert response.headers["content-type"] == "application/json"
+    assert json.loads(response.body)["processing_time"] == 0.1
+
+def test_cache_hit_returns_the_same_body_as_the_miss(analyzer, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(usage_meter, "client", None)
+    headers = {"X-API-Key": make_key().key}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.post("/api/v2/analyze", json={"text": "you idiot"}, headers=headers) for _ in range(2)]
+
+    miss, hit = asyncio.run(scenario())
+
+    assert analyzer.calls == ["you idiot"]
+    assert miss.status_code == hit.status_code == 200
+    assert hit.headers["content-type"] == miss.headers["content-type"] == "application/json"
+    # Byte for byte, apart from the per-request processing time
+    assert PROCESSING_TIME_RE.sub(b"", hit.content) == PROCESSING_TIME_RE.sub(b"", miss.content)
+    assert json.loads(hit.content)["toxicity"]["is_toxic"] is True
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from conftest import RecordingAnalyzer
+from app import cli
+from app.api import analysis
+
+def setup_function():
+    analysis.result_cache.clear()
+
+def write_csv(path, texts):
+    path.write_text("id,text\n" + "".join(f"{i},{text}\n" for i, text in enumerate(texts)))
+
+def read_output(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_analyze_writes_results_in_input_order(tmp_path):
+    analysis.analyzer = RecordingAnalyzer()
+    texts = [f"text {i % 7}" for i in range(30)] + ["you idiot", "boom"]
+    write_csv(tmp_path / "in.csv", texts)
+
+    code = cli.main(["analyze", str(tmp_path / "in.csv"), "-o", str(tmp_path / "out.jsonl"), "--workers", "4"])
+
+    results = read_output(tmp_path / "out.jsonl")
+    assert code == 1  # one record failed
+    assert [r["index"] for r in results] == list(range(32))
+    assert [r["text"] for r in results] == texts
+    assert results[30]["toxicity"]["is_toxic"]
+    assert results[31]["error"]["code"] == "ANALYSIS_FAILED"
+    # Repeated texts were served from the shared cache
+    assert sorted(analysis.analyzer.calls) == sorted(set(texts))
+    assert not (tmp_path / "out.jsonl.checkpoint").exists()
+
+def test_interrupted_run_resumes_from_checkpoint(tmp_path):
+    texts = [f"text {i}" for i in range(25)]
+    write_csv(tmp_path / "in.csv", texts)
+    argv = ["analyze", str(tmp_path / "in.csv"), "-o", str(tmp_path / "out.jsonl"), "--checkpoint-every", "10"]
+
+    analysis.analyzer = RecordingAnalyzer(interrupt_on="text 17")
+    with pytest.raises(KeyboardInterrupt):
+        cli.main(argv)
+    checkpoint = json.loads((tmp_path / "out.jsonl.checkpoint").read_text())
+    assert checkpoint["records"] == 10
+
+    analysis.result_cache.clear()
+    analysis.analyzer = RecordingAnalyzer()
+    assert cli.main(argv) == 0
+
+    results = read_output(tmp_path / "out.jsonl")
+    assert [r["index"] for r in results] == list(range(25))
+    # Only records after the checkpoint were analyzed again
+    assert "text 9" not in analysis.analyzer.calls
+    assert "text 10" in analysis.analyzer.calls
@@ -0,0 +1,140 @@
+import asyncio
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.api import concurrency, rate_limiter
+from app.core.middleware import ConcurrencyLimitMiddleware
+
+class Handler:
+    """Stand-in analyze endpoint that tracks how many calls run at once."""
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.running = 0
+        self.peak = 0
+
+    async def handle(self, request: Request):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        return JSONResponse({"ok": True})
+
+def make_client(handler, semaphores):
+    app = Starlette(routes=[Route("/api/v2/analyze", handler.handle, methods=["POST"])])
+    app = ConcurrencyLimitMiddleware(app, semaphores=semaphores, paths=concurrency.LIMITED_PATHS)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+def redis_semaphores(loop, lease_ttl=concurrency.CONCURRENCY_LEASE_TTL):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis()
+    try:
+        loop.run_until_complete(client.eval("return 1", 0))
+    except Exception:
+        pytest.skip("fakeredis without Lua support (install lupa)")
+    return concurrency.RedisSemaphores(client, lease_ttl=lease_ttl)
+
+@pytest.fixture(params=["memory", "redis"])
+def semaphores(request, loop, caplog):
+    if request.param == "memory":
+        yield concurrency.MemorySemaphores()
+    else:
+        yield redis_semaphores(loop)
+    # A Redis error would silently fall back to in-process slots
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(concurrency, "CONCURRENCY_LIMIT", 2)
+    monkeypatch.setattr(concurrency, "PRO_CONCURRENCY_LIMIT", 4)
+    pro_key = rate_limiter.APIKeyInfo("key_pro", "toxid_pro", "user_pro", "pro", True)
+
+    async def lookup_api_key(scope):
+        return pro_key if Headers(scope=scope).get("x-api-key") == "toxid_pro" else None
+
+    monkeypatch.setattr(rate_limiter, "lookup_api_key", lookup_api_key)
+
+def post(client, api_key=None):
+    headers = {"X-API-Key": api_key} if api_key else {}
+    return client.post("/api/v2/analyze", json={"text": "hi"}, headers=headers)
+
+def test_requests_over_the_limit_are_rejected(semaphores, loop, monkeypatch):
+    monkeypatch.setattr(concurrency, "CONCURRENCY_QUEUE_TIMEOUT", 0.05)
+    handler = Handler()
+
+    async def scenario():
+        async with make_client(handler, semaphores) as client:
+            return await asyncio.gather(
+                *(post(client) for _ in range(3)),
+                *(post(client, "toxid_pro") for _ in range(4)),
+            )
+
+    responses = loop.run_until_complete(scenario())
+    free, pro = responses[:3], responses[3:]
+    assert sorted(r.status_code for r in free) == [200, 200, 429]
+    assert [r.status_code for r in pro] == [200] * 4
+    rejected = next(r for r in free if r.status_code == 429)
+    assert rejected.headers["retry-after"] == str(concurrency.CONCURRENCY_RETRY_AFTER)
+    assert rejected.json()["detail"]["code"] == "CONCURRENCY_LIMIT_EXCEEDED"
+
+def test_queued_requests_get_a_freed_slot(semaphores, loop):
+    handler = Handler(delay=0.1)
+
+    async def scenario():
+        async with make_client(handler, semaphores) as client:
+            responses = await asyncio.gather(*(post(client) for _ in range(5)))
+            # Every slot is released once the responses are sent
+            after = await asyncio.gather(*(post(client) for _ in range(2)))
+            return responses + after
+
+    responses = loop.run_until_complete(scenario())
+    assert [r.status_code for r in responses] == [200] * 7
+    assert handler.peak == 2
+
+def test_leases_of_crashed_holders_expire(loop):
+    semaphores = redis_semaphores(loop, lease_ttl=0.2)
+
+    async def scenario():
+        held = [await semaphores.try_acquire("concurrency:test", 2) for _ in range(2)]
+        # Holders vanish without releasing or renewing
+        for lease in held:
+            lease.renewal.cancel()
+        blocked = await semaphores.try_acquire("concurrency:test", 2)
+        await asyncio.sleep(0.3)
+        freed = await semaphores.try_acquire("concurrency:test", 2)
+        await semaphores.release(freed)
+        return held, blocked, freed
+
+    held, blocked, freed = loop.run_until_complete(scenario())
+    assert all(lease is not None for lease in held)
+    assert blocked is None
+    assert freed is not None
+
+def test_held_leases_are_renewed(loop):
+    semaphores = redis_semaphores(loop, lease_ttl=0.2)
+
+    async def scenario():
+        held = [await semaphores.try_acquire("concurrency:test", 1)]
+        await asyncio.sleep(0.5)
+        blocked = await semaphores.try_acquire("concurrency:test", 1)
+        await semaphores.release(held[0])
+        freed = await semaphores.try_acquire("concurrency:test", 1)
+        await semaphores.release(freed)
+        return blocked, freed
+
+    blocked, freed = loop.run_until_complete(scenario())
+    assert blocked is None
+    assert freed is not None
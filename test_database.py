@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import event, text
+
+from app.models import database
+from app.models.database import session_scope, DBUser
+
+@pytest.fixture
+def statements():
+    """Record every statement run on the process-wide engine."""
+    engine = database.get_engine()
+    recorded = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        recorded.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield recorded
+    event.remove(engine, "before_cursor_execute", record)
+
+def test_sessions_share_one_engine_without_setup_queries(statements):
+    engine = database.get_engine()
+    for _ in range(20):
+        with session_scope() as db:
+            assert db.get_bind() is engine
+            db.query(DBUser).filter(DBUser.id == "missing").first()
+
+    # One query per session: no connection tests, table checks or schema creation
+    assert len(statements) == 20
+    assert all("users" in statement and "sqlite_master" not in statement for statement in statements)
+    assert database.get_engine() is engine
+
+def test_pool_settings_apply_to_file_databases(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, "DATABASE_URL", f"sqlite:///{tmp_path / 'pool.db'}")
+    monkeypatch.setattr(database, "DB_POOL_SIZE", 3)
+    monkeypatch.setattr(database, "DB_MAX_OVERFLOW", 1)
+    monkeypatch.setattr(database, "DB_POOL_PRE_PING", True)
+
+    engine = database.create_db_engine()
+    try:
+        assert engine.pool.size() == 3
+        assert engine.pool._max_overflow == 1
+        assert engine.pool._pre_ping
+    finally:
+        engine.dispose()
+
+def test_in_memory_database_is_shared_by_all_connections(monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_URL", "sqlite:///:memory:")
+
+    engine = database.create_db_engine()
+    database.Base.metadata.create_all(bind=engine)
+    with engine.connect() as first, engine.connect() as second:
+        first.execute(text("INSERT INTO users (id, email) VALUES ('a', 'a@example.com')"))
+        assert second.execute(text("SELECT count(*) FROM users")).scalar() == 1
@@ -0,0 +1,153 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.api import idempotency
+from app.core.middleware import IdempotencyMiddleware
+
+class Handler:
+    """Stand-in analyze endpoint that counts its calls."""
+    def __init__(self, delay=0.0, status_code=200):
+        self.calls = 0
+        self.delay = delay
+        self.status_code = status_code
+
+    async def handle(self, request: Request):
+        self.calls += 1
+        payload = await request.json()
+        await asyncio.sleep(self.delay)
+        headers = {"X-Rate-Limit-Remaining": str(100 - self.calls), "X-Quota-Remaining": str(1000 - self.calls), "X-Call": str(self.calls)}
+        return JSONResponse({"text": payload["text"], "call": self.calls}, status_code=self.status_code, headers=headers)
+
+def make_client(handler, store):
+    app = Starlette(routes=[Route("/api/v2/analyze", handler.handle, methods=["POST"])])
+    app = IdempotencyMiddleware(app, store=store, paths=idempotency.IDEMPOTENT_PATHS)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+def redis_store():
+    fakeredis = pytest.importorskip("fakeredis")
+    return idempotency.RedisIdempotencyStore(fakeredis.FakeAsyncRedis())
+
+@pytest.fixture(params=[idempotency.MemoryIdempotencyStore, redis_store], ids=["memory", "redis"])
+def store(request):
+    return request.param()
+
+def post(client, text, key="abc", api_key="toxid_1"):
+    headers = {"X-API-Key": api_key}
+    if key is not None:
+        headers["Idempotency-Key"] = key
+    return client.post("/api/v2/analyze", json={"text": text}, headers=headers)
+
+def test_retries_replay_the_first_response(store):
+    handler = Handler()
+
+    async def scenario():
+        async with make_client(handler, store) as client:
+            first = await post(client, "hello")
+            retry = await post(client, "hello")
+            other_key = await post(client, "hello", key="def")
+            other_caller = await post(client, "hello", api_key="toxid_2")
+            no_key = await post(client, "hello", key=None)
+            return first, retry, other_key, other_caller, no_key
+
+    first, retry, other_key, other_caller, no_key = asyncio.run(scenario())
+    assert retry.json() == first.json() == {"text": "hello", "call": 1}
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert [other_key.json()["call"], other_caller.json()["call"], no_key.json()["call"]] == [2, 3, 4]
+
+def test_replays_drop_the_original_budget_headers(store):
+    handler = Handler()
+
+    async def scenario():
+        async with make_client(handler, store) as client:
+            await post(client, "hello")
+            await post(client, "other", key="def")
+            return await post(client, "hello")
+
+    retry = asyncio.run(scenario())
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.headers["x-call"] == "1"
+    # The first request's remaining budget is stale by now
+    assert "x-rate-limit-remaining" not in retry.headers
+    assert "x-quota-remaining" not in retry.headers
+
+def test_concurrent_retry_waits_for_the_original(store):
+    handler = Handler(delay=0.2)
+
+    async def scenario():
+        async with make_client(handler, store) as client:
+            return await asyncio.gather(*(post(client, "slow") for _ in range(3)))
+
+    responses = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert [r.json()["call"] for r in responses] == [1, 1, 1]
+
+def test_key_reused_with_different_body_is_rejected(store):
+    handler = Handler()
+
+    async def scenario():
+        async with make_client(handler, store) as client:
+            await post(client, "one")
+            return await post(client, "two")
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 422
+    assert response.json()["detail"]["code"] == "IDEMPOTENCY_KEY_REUSED"
+    assert handler.calls == 1
+
+def test_server_errors_are_not_stored(store):
+    handler = Handler(status_code=503)
+
+    async def scenario():
+        async with make_client(handler, store) as client:
+            await post(client, "hello")
+            handler.status_code = 200
+            return await post(client, "hello")
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert handler.calls == 2
+
+def test_redis_store_falls_back_while_redis_is_down():
+    from app.api.redis_supervisor import RedisSupervisor
+
+    class DeadRedis:
+        async def ping(self):
+            raise ConnectionError("Connection refused")
+
+    client = DeadRedis()
+    store = idempotency.RedisIdempotencyStore(client, RedisSupervisor(client, up=False, min_delay=60))
+    handler = Handler()
+
+    async def scenario():
+        async with make_client(handler, store) as client:
+            first = await post(client, "hello")
+            retry = await post(client, "hello")
+        await store.supervisor.stop()
+        return first, retry
+
+    first, retry = asyncio.run(scenario())
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert handler.calls == 1
+
+def test_memory_store_is_bounded_by_total_bytes():
+    store = idempotency.MemoryIdempotencyStore(max_keys=100, max_bytes=2500)
+
+    async def scenario():
+        for key in ("a", "b", "c"):
+            await store.begin(key, "fp", "owner")
+            await store.complete(key, "owner", {"state": "done", "fingerprint": "fp", "owner": "owner",
+                                               "status": 200, "headers": [], "body": b"x" * 1000})
+        return [store._get(key) is not None for key in ("a", "b", "c")]
+
+    # The oldest response is evicted to make room for the third
+    assert asyncio.run(scenario()) == [False, True, True]
+    assert store._bytes == 2000
@@ -0,0 +1,170 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+
+from conftest import RecordingAnalyzer, make_key
+from app.api import analysis, jobs, rate_limiter, usage
+from app.core.local_store import ExpiringStore
+from app.main import app, usage_meter
+from app.models.database import session_scope, DBJob, DBJobItem
+
+def setup_function():
+    analysis.analyzer = RecordingAnalyzer()
+    analysis.result_cache.clear()
+    with session_scope() as db:
+        db.query(DBJobItem).delete()
+        db.query(DBJob).delete()
+        db.commit()
+
+def make_job(texts):
+    user_id = make_key().user_id
+    with session_scope() as db:
+        return jobs.create_job(db, user_id, texts).id
+
+def run_until_idle(size=3):
+    async def drain():
+        while await jobs.process_next_chunk(size):
+            pass
+    asyncio.run(drain())
+
+def load(job_id):
+    with session_scope() as db:
+        job = db.query(DBJob).filter(DBJob.id == job_id).one()
+        items = jobs.get_job_items(db, job_id, -1, 100)
+        db.expunge_all()
+        return job, items
+
+def test_job_runs_to_completion_in_order():
+    texts = ["hello", "you idiot", "boom", "hello", "fine", "thanks", "bye"]
+    job_id = make_job(texts)
+
+    run_until_idle()
+
+    job, items = load(job_id)
+    assert job.status == "completed"
+    assert (job.total_items, job.processed_items, job.failed_items) == (7, 7, 1)
+    assert [item.position for item in items] == list(range(7))
+    assert [item.status for item in items] == ["done", "done", "failed", "done", "done", "done", "done"]
+    assert items[2].error == "upstream failed"
+    assert '"is_toxic":true' in items[1].result
+    # The repeated text was served from the cache
+    assert analysis.analyzer.calls.count("hello") == 1
+
+def test_expired_leases_are_reclaimed_after_restart():
+    job_id = make_job(["a", "b", "c"])
+    # Simulate a worker that claimed items and died before storing results
+    with session_scope() as db:
+        db.query(DBJob).filter(DBJob.id == job_id).update({"status": "running"})
+        db.query(DBJobItem).filter(DBJobItem.position < 2).update({
+            "status": "processing",
+            "claimed_at": datetime.utcnow() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1),
+        })
+        db.commit()
+
+    run_until_idle()
+
+    job, items = load(job_id)
+    assert job.status == "completed"
+    assert [item.status for item in items] == ["done", "done", "done"]
+
+def test_live_leases_are_not_reclaimed():
+    job_id = make_job(["a", "b"])
+    with session_scope() as db:
+        db.query(DBJobItem).filter(DBJobItem.position == 0).update({
+            "status": "processing",
+            "claimed_at": datetime.utcnow(),
+        })
+        db.commit()
+
+    run_until_idle()
+
+    job, items = load(job_id)
+    assert job.status == "running"
+    assert [item.status for item in items] == ["processing", "done"]
+
+def test_cancelled_jobs_are_not_processed():
+    job_id = make_job(["a", "b"])
+    with session_scope() as db:
+        jobs.cancel_job(db, db.query(DBJob).filter(DBJob.id == job_id).one())
+
+    run_until_idle()
+
+    job, items = load(job_id)
+    assert job.status == "cancelled"
+    assert analysis.analyzer.calls == []
+
+def analyze(items):
+    return asyncio.run(analysis.analyze_batch([text for _, _, text in items]))
+
+def test_stale_results_are_not_stored_after_a_reclaim():
+    job_id = make_job(["a", "b"])
+    _, first_claim, items = jobs.claim_chunk(2)
+    outcomes = analyze(items)
+
+    # The lease runs out and another worker takes the items over
+    with session_scope() as db:
+        db.query(DBJobItem).filter(DBJobItem.job_id == job_id).update({
+            "claimed_at": first_claim - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1),
+        })
+        db.commit()
+    _, second_claim, reclaimed = jobs.claim_chunk(2)
+    assert reclaimed == items and second_claim != first_claim
+
+    jobs.store_results(job_id, first_claim, items, outcomes)
+    job, stored = load(job_id)
+    assert [item.status for item in stored] == ["processing", "processing"]
+    assert (job.processed_items, job.status) == (0, "running")
+
+    jobs.store_results(job_id, second_claim, reclaimed, analyze(reclaimed))
+    jobs.store_results(job_id, second_claim, reclaimed, outcomes)
+    job, stored = load(job_id)
+    assert [item.status for item in stored] == ["done", "done"]
+    assert (job.processed_items, job.status) == (2, "completed")
+
+def test_results_are_dropped_for_jobs_cancelled_in_flight():
+    job_id = make_job(["a", "b"])
+    _, claimed_at, items = jobs.claim_chunk(2)
+    with session_scope() as db:
+        jobs.cancel_job(db, db.query(DBJob).filter(DBJob.id == job_id).one())
+
+    jobs.store_results(job_id, claimed_at, items, analyze(items))
+
+    job, stored = load(job_id)
+    assert job.status == "cancelled" and job.processed_items == 0
+    assert all(item.result is None for item in stored)
+
+def submit(tier, sizes):
+    key = make_key(tier).key
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                await client.post("/api/v2/jobs", json={"texts": [f"text {i}" for i in range(size)]}, headers={"X-API-Key": key})
+                for size in sizes
+            ]
+
+    return asyncio.run(scenario())
+
+def test_job_size_and_quota_are_checked_at_submission(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(rate_limiter, "DEFAULT_RATE_LIMIT", 10)
+    monkeypatch.setattr(rate_limiter, "PRO_RATE_LIMIT", 10)
+    monkeypatch.setattr(usage_meter, "client", None)
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 30)
+    monkeypatch.setattr(jobs, "JOB_MAX_ITEMS", 20)
+    monkeypatch.setattr(jobs, "PRO_JOB_MAX_ITEMS", 50)
+
+    free = submit("free", [25, 20, 20])
+    pro = submit("pro", [25])
+
+    # Too large for the tier, then too large for what is left of the quota;
+    # jobs larger than the rate limit are accepted and take 1 unit of it
+    assert [r.status_code for r in free] == [400, 202, 429]
+    assert free[1].headers["x-rate-limit-cost"] == "1"
+    assert free[2].json()["detail"]["code"] == "QUOTA_EXCEEDED"
+    assert pro[0].status_code == 202
+    with session_scope() as db:
+        assert sorted(job.total_items for job in db.query(DBJob)) == [20, 25]
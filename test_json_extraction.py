@@ -0,0 +1,139 @@
+import json
+import random
+from pathlib import Path
+
+import pytest
+
+from app.models.json_extraction import extract_json, JSONExtractionError
+from app.models.result_normalizer import normalize_result, default_result
+
+CORPUS_PATH = Path(__file__).parent / "benchmarks" / "data" / "model_outputs.jsonl"
+
+FUZZ_ROUNDS = 500
+
+def random_value(rng, depth=0):
+    choice = rng.randrange(7 if depth < 3 else 4)
+    if choice == 0:
+        return round(rng.uniform(-1, 1), 3)
+    if choice == 1:
+        return rng.choice([True, False, None])
+    if choice == 2:
+        return rng.randrange(100)
+    if choice == 3:
+        return rng.choice(["plain", "with } brace", 'quote " inside', "back\\slash", "f*ck", "{[,]}", ""])
+    if choice == 4:
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return random_object(rng, depth + 1)
+
+def random_object(rng, depth=0):
+    return {f"k{i}_{rng.randrange(1000)}": random_value(rng, depth) for i in range(rng.randrange(1, 5))}
+
+def add_trailing_commas(text):
+    # Only safe on our generated JSON because keys and values never contain "}\n"
+    return text.replace("\n}", ",\n}").replace("\n]", ",\n]")
+
+WRAPPERS = [
+    lambda s: s,
+    lambda s: f"```json\n{s}\n```",
+    lambda s: f"```\n{s}\n```",
+    lambda s: f"Here is the analysis:\n{s}\nLet me know if you need anything else {{:}}.",
+    lambda s: f"```json\n{s}",
+    lambda s: f"  \n{s}\n\n",
+]
+
+@pytest.mark.parametrize("seed", range(FUZZ_ROUNDS))
+def test_fuzz_wrapped_and_trailing_commas_round_trip(seed):
+    rng = random.Random(seed)
+    obj = random_object(rng)
+    text = json.dumps(obj, indent=rng.choice([None, 2]))
+    if rng.random() < 0.5 and "\n" in text:
+        text = add_trailing_commas(text)
+    text = rng.choice(WRAPPERS)(text)
+
+    assert extract_json(text) == obj
+    assert extract_json(text, repair=False) == obj
+
+def is_prefix_subset(partial, full):
+    """A recovered object may only contain keys/items present in the original."""
+    if isinstance(partial, dict):
+        return isinstance(full, dict) and all(k in full and is_prefix_subset(v, full[k]) for k, v in partial.items())
+    if isinstance(partial, list):
+        return isinstance(full, list) and len(partial) <= len(full) and all(
+            is_prefix_subset(p, f) for p, f in zip(partial, full)
+        )
+    if isinstance(partial, str) and isinstance(full, str):
+        return full.startswith(partial)
+    return partial == full or isinstance(full, (int, float))
+
+@pytest.mark.parametrize("seed", range(FUZZ_ROUNDS))
+def test_fuzz_truncated_output_never_crashes(seed):
+    rng = random.Random(seed)
+    obj = random_object(rng)
+    text = json.dumps(obj, indent=rng.choice([None, 2]))
+    cut = rng.randrange(1, len(text))
+    # Truncated output never has a closing fence
+    truncated = rng.choice([WRAPPERS[0], WRAPPERS[4]])(text[:cut])
+
+    try:
+        result = extract_json(truncated)
+    except JSONExtractionError:
+        return
+    assert isinstance(result, dict)
+    assert is_prefix_subset(result, obj)
+
+@pytest.mark.parametrize("seed", range(200))
+def test_fuzz_random_garbage_only_raises_extraction_error(seed):
+    rng = random.Random(seed)
+    alphabet = '{}[]",:\\ \n`abc01.-<>\'TrueNone'
+    text = "".join(rng.choice(alphabet) for _ in range(rng.randrange(1, 80)))
+    try:
+        assert isinstance(extract_json(text), dict)
+    except JSONExtractionError:
+        pass
+
+def test_outermost_object_ignores_braces_in_strings_and_trailing_prose():
+    text = 'Result: {"a": {"b": "x}y"}, "c": 2} and also {"ignored": true}'
+    assert extract_json(text) == {"a": {"b": "x}y"}, "c": 2}
+
+def test_truncated_output_is_closed():
+    assert extract_json('{"a": 1, "b": {"c": [1, 2, 3') == {"a": 1, "b": {"c": [1, 2, 3]}}
+    assert extract_json('{"a": 1, "b": "unterminated') == {"a": 1, "b": "unterminated"}
+    assert extract_json('{"a": 1,\n "b": 0.') == {"a": 1}
+
+def test_repair_mode_fixes_simple_errors():
+    text = "{'a': True, b: None, \"c\": <0.5>, \"d\": <\"POSITIVE\"/\"NEGATIVE\">}"
+    assert extract_json(text) == {"a": True, "b": None, "c": 0.5, "d": None}
+    with pytest.raises(JSONExtractionError):
+        extract_json(text, repair=False)
+
+def test_no_object_raises():
+    for text in ["", "no json here", "[1, 2, 3]", "```\njust code\n```"]:
+        with pytest.raises(JSONExtractionError):
+            extract_json(text)
+
+def load_corpus():
+    with open(CORPUS_PATH, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+@pytest.mark.parametrize("entry", load_corpus(), ids=lambda entry: entry["kind"])
+def test_corpus_survives_normalization(entry):
+    if entry["kind"] == "no_json":
+        with pytest.raises(JSONExtractionError):
+            extract_json(entry["text"])
+        return
+
+    result = normalize_result(extract_json(entry["text"]))
+
+    # Every recoverable entry keeps the model's scores instead of the fallback
+    assert result != default_result()
+    assert result["toxicity"]["score"] == 0.82
+    assert result["sentiment"]["label"] == "NEGATIVE"
+
+def test_template_placeholders_fall_back_to_field_defaults():
+    entry = next(e for e in load_corpus() if e["kind"] == "template_placeholders")
+    result = normalize_result(extract_json(entry["text"]))
+
+    # <0.1> is a number; <"EASY"/"MEDIUM"/"DIFFICULT"> becomes null, then the default
+    assert result["sensitivity"]["score"] == 0.1
+    assert result["readability"]["difficulty"] == default_result()["readability"]["difficulty"]
+    assert result["readability"]["grade_level"] == 3
@@ -0,0 +1,68 @@
+import threading
+
+from app.core.local_store import ExpiringStore
+
+def increment(ttl, now):
+    def update(value):
+        count = (value or 0) + 1
+        return count, count, now + ttl
+    return update
+
+def test_entries_expire_and_are_swept():
+    store = ExpiringStore(100, resolution=10)
+    for i in range(50):
+        store.update(f"short:{i}", increment(5, 0), 0)
+    store.update("long", increment(1000, 0), 0)
+
+    assert store.get("short:0", 4) == 1
+    assert store.get("short:0", 5) is None
+    # Writes sweep expired keys as they go
+    store.update("later", increment(1000, 100), 100)
+    assert len(store) == 2
+    assert store.get("long", 100) == 1
+
+def test_extended_entries_survive_their_first_slot():
+    store = ExpiringStore(100, resolution=10)
+    store.update("key", increment(15, 0), 0)
+    store.update("key", increment(100, 10), 10)
+
+    assert store.sweep(50) == 1
+    assert store.get("key", 50) == 2
+    assert store.get("key", 110) is None
+    assert store.sweep(120) == 0
+
+def test_capacity_evicts_least_recently_written():
+    store = ExpiringStore(3)
+    for key in ("a", "b", "c"):
+        store.update(key, increment(1000, 0), 0)
+    store.update("a", increment(1000, 1), 1)
+    store.update("d", increment(1000, 2), 2)
+
+    assert len(store) == 3
+    assert store.get("b", 2) is None
+    assert store.get("a", 2) == 2
+
+def test_many_distinct_keys_stay_within_capacity():
+    store = ExpiringStore(1000)
+    for i in range(20000):
+        store.update(f"ip:{i}", increment(60000, i), i)
+
+    assert len(store) == 1000
+    # The wheel does not keep references to evicted keys beyond its slots
+    assert store.sweep(20000 + 60000) == 0
+
+def test_concurrent_updates_are_not_lost():
+    store = ExpiringStore(10)
+    threads, calls = 8, 500
+
+    def worker():
+        for _ in range(calls):
+            store.update("key", increment(1000, 0), 0)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert store.get("key", 0) == threads * calls
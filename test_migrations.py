@@ -0,0 +1,34 @@
+from sqlalchemy import create_engine, inspect, select
+
+from app import cli
+from app.models import database, migrations
+
+def test_migrations_are_applied_once_and_recorded(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+
+    assert migrations.migrate(engine) == [migration.version for migration in migrations.MIGRATIONS]
+    assert migrations.migrate(engine) == []
+
+    tables = set(inspect(engine).get_table_names())
+    assert set(database.Base.metadata.tables) <= tables
+    with engine.connect() as conn:
+        versions = conn.execute(select(migrations.schema_version.c.version)).scalars().all()
+    assert versions == [migration.version for migration in migrations.MIGRATIONS]
+    assert migrations.schema_is_current(engine)
+
+def test_unversioned_database_is_adopted(tmp_path):
+    # Tables created by create_all, as before schema versions were recorded
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    database.Base.metadata.create_all(bind=engine)
+    assert not migrations.schema_is_current(engine)
+
+    migrations.migrate(engine)
+
+    assert migrations.schema_is_current(engine)
+
+def test_cli_checks_and_applies_migrations(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_URL", f"sqlite:///{tmp_path / 'deploy.db'}")
+
+    assert cli.main(["migrate", "--check"]) == 1
+    assert cli.main(["migrate"]) == 0
+    assert cli.main(["migrate", "--check"]) == 0
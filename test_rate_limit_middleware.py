@@ -0,0 +1,146 @@
+import asyncio
+import json
+import uuid
+
+import httpx
+import pytest
+
+from conftest import make_key
+from app.api import concurrency, rate_limiter, usage
+from app.core.local_store import ExpiringStore
+from app.main import app, usage_meter
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(rate_limiter, "DEFAULT_RATE_LIMIT", 3)
+    monkeypatch.setattr(rate_limiter, "PRO_RATE_LIMIT", 5)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_COST_PER_ITEM", 1)
+
+def send(requests, host=None):
+    async def scenario():
+        transport = httpx.ASGITransport(app=app, client=(host or f"10.0.0.{uuid.uuid4().int % 250}", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.post(path, **kwargs) for path, kwargs in requests]
+    return asyncio.run(scenario())
+
+def test_rejected_requests_do_no_analyzer_work(analyzer):
+    responses = send([("/api/v2/analyze", {"json": {"text": f"text {i}"}}) for i in range(5)])
+
+    assert [r.status_code for r in responses] == [200, 200, 200, 429, 429]
+    assert analyzer.calls == ["text 0", "text 1", "text 2"]
+    assert [r.headers["x-rate-limit-remaining"] for r in responses] == ["2", "1", "0", "0", "0"]
+    assert all(r.headers["x-rate-limit-limit"] == "3" for r in responses)
+    rejected = responses[3]
+    assert "retry-after" not in responses[0].headers
+    assert int(rejected.headers["retry-after"]) == int(rejected.headers["x-rate-limit-reset"]) > 0
+    assert rejected.json()["detail"]["code"] == "RATE_LIMIT_EXCEEDED"
+
+def test_batches_are_charged_per_item(analyzer):
+    key = make_key("pro").key
+    headers = {"X-API-Key": key}
+
+    responses = send([
+        ("/api/v2/analyze/batch", {"json": {"texts": ["a", "b", "c"]}, "headers": headers}),
+        ("/api/v2/analyze/batch", {"json": {"texts": ["d", "e", "f"]}, "headers": headers}),
+        ("/api/v2/analyze/batch", {"json": {"texts": ["g", "h"]}, "headers": headers}),
+    ])
+
+    assert [r.status_code for r in responses] == [200, 429, 200]
+    assert [r.headers["x-rate-limit-cost"] for r in responses] == ["3", "3", "2"]
+    assert [r.headers["x-rate-limit-remaining"] for r in responses] == ["2", "2", "0"]
+    assert sorted(analyzer.calls) == ["a", "b", "c", "g", "h"]
+
+def test_unknown_keys_are_limited_per_client_ip(analyzer):
+    responses = send([
+        ("/api/v2/analyze", {"json": {"text": "x"}, "headers": {"X-API-Key": f"toxid_{i}"}}) for i in range(4)
+    ])
+
+    assert [r.status_code for r in responses] == [401, 401, 401, 429]
+    assert analyzer.calls == []
+
+def test_requests_costing_more_than_the_limit_are_rejected(analyzer):
+    # 1 unit for the text and 3 for its 3 KB
+    responses = send([("/api/v2/analyze", {"json": {"text": "x" * 3072}})])
+
+    rejected = responses[0]
+    assert rejected.status_code == 413
+    assert rejected.json()["detail"]["code"] == "REQUEST_TOO_LARGE"
+    assert "retry-after" not in rejected.headers
+    assert rejected.headers["x-rate-limit-remaining"] == "3"
+    assert analyzer.calls == []
+
+def test_stream_items_are_charged_as_they_are_read(analyzer):
+    body = b"".join(f'"text {i}"\n'.encode() for i in range(5))
+
+    response = send([("/api/v2/analyze/stream", {
+        "content": body, "headers": {"Content-Type": "application/x-ndjson"}
+    })])[0]
+
+    lines = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+    assert [line["status"] for line in lines] == ["ok", "ok", "ok", "error"]
+    # The stream as a whole costs more than the limit
+    assert lines[3]["error"]["code"] == "REQUEST_TOO_LARGE"
+    assert sorted(analyzer.calls) == ["text 0", "text 1", "text 2"]
+
+def test_batches_are_charged_at_most_the_whole_limit(analyzer):
+    headers = {"X-API-Key": make_key("free").key}
+
+    responses = send([
+        ("/api/v2/analyze/batch", {"json": {"texts": ["a", "b", "c", "d"]}, "headers": headers}),
+        ("/api/v2/analyze", {"json": {"text": "e"}, "headers": headers}),
+    ])
+
+    # A batch within the tier's size cap is admitted on a full budget and uses all of it
+    assert [r.status_code for r in responses] == [200, 429]
+    assert responses[0].headers["x-rate-limit-cost"] == "3"
+    assert responses[0].headers["x-rate-limit-remaining"] == "0"
+    assert sorted(analyzer.calls) == ["a", "b", "c", "d"]
+
+def test_job_submissions_take_one_unit_and_meter_their_texts_against_the_quota(monkeypatch):
+    monkeypatch.setattr(usage_meter, "client", None)
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 20)
+    headers = {"X-API-Key": make_key("free").key}
+    texts = [f"text {i}" for i in range(8)]
+
+    responses = send([
+        ("/api/v2/jobs", {"json": {"texts": texts}, "headers": headers}),
+        ("/api/v2/jobs/upload", {"files": {"file": ("texts.txt", "\n".join(texts).encode())}, "headers": headers}),
+        ("/api/v2/jobs", {"json": {"texts": texts[:5]}, "headers": headers}),
+    ])
+
+    # More texts than the rate limit of 3, but each submission costs it 1 unit
+    assert [r.status_code for r in responses] == [202, 202, 429]
+    assert [r.headers["x-rate-limit-cost"] for r in responses[:2]] == ["1", "1"]
+    assert responses[1].headers["x-rate-limit-remaining"] == "1"
+    # 16 of the 20 quota units are used, so 5 more texts do not fit
+    assert responses[2].json()["detail"]["code"] == "QUOTA_EXCEEDED"
+
+def test_batch_bodies_are_parsed_once(analyzer, monkeypatch):
+    parsed = []
+    loads = json.loads
+    monkeypatch.setattr(json, "loads", lambda s, **kwargs: parsed.append(s) or loads(s, **kwargs))
+    body = json.dumps({"texts": ["a", "b"]})
+
+    responses = send([
+        ("/api/v2/analyze/batch", {"content": body, "headers": {"Content-Type": "application/json"}}),
+        ("/api/v2/analyze/batch", {"content": body[:-1], "headers": {"Content-Type": "application/json"}}),
+    ])
+
+    assert [r.status_code for r in responses] == [200, 422]
+    assert responses[0].json()["summary"]["total"] == 2
+    # The malformed body is left to the route, which reports the error
+    assert parsed.count(body.encode()) == 1
+
+def test_requests_without_a_concurrency_slot_are_not_charged(analyzer, monkeypatch):
+    async def no_slot(semaphores, key, limit, tier=None):
+        return None
+
+    with monkeypatch.context() as patch:
+        patch.setattr(concurrency, "acquire", no_slot)
+        rejected = send([("/api/v2/analyze", {"json": {"text": f"text {i}"}}) for i in range(4)], host="10.0.0.251")
+    accepted = send([("/api/v2/analyze", {"json": {"text": "text"}})], host="10.0.0.251")
+
+    assert [r.json()["detail"]["code"] for r in rejected] == ["CONCURRENCY_LIMIT_EXCEEDED"] * 4
+    assert accepted[0].headers["x-rate-limit-remaining"] == "2"
@@ -0,0 +1,295 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+
+import pytest
+
+from app.api import rate_limiter
+from app.api.redis_supervisor import RedisSupervisor
+from app.core.local_store import ExpiringStore
+from app.core.metrics import PROMETHEUS_AVAILABLE
+
+# Start of a clock-aligned minute, so sliding windows line up with the tests
+T0 = 960_000_000_000
+
+def lua_redis_client(loop):
+    """An async Redis client that can run Lua: TEST_REDIS_URL if reachable, else fakeredis with lupa."""
+    url = os.getenv("TEST_REDIS_URL")
+    if url:
+        import redis.asyncio
+        client = redis.asyncio.from_url(url)
+        loop.run_until_complete(client.ping())
+        return client
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis()
+    try:
+        loop.run_until_complete(client.eval("return 1", 0))
+    except Exception:
+        pytest.skip("fakeredis without Lua support (install lupa)")
+    return client
+
+class Clock:
+    def __init__(self):
+        self.now = T0
+
+    def advance(self, seconds):
+        self.now += int(seconds * 1000)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "_now_ms", lambda: clock.now)
+    return clock
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture
+def redis_client(monkeypatch, loop):
+    client = lua_redis_client(loop)
+    monkeypatch.setattr(rate_limiter, "redis_client", client)
+    monkeypatch.setattr(rate_limiter, "redis_supervisor", RedisSupervisor(client))
+    yield client
+    loop.run_until_complete(client.aclose())
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, monkeypatch):
+    if request.param == "redis":
+        return request.getfixturevalue("redis_client")
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    return None
+
+@pytest.fixture(params=sorted(rate_limiter.ALGORITHMS))
+def algorithm(request):
+    return request.param
+
+@pytest.fixture
+def check(loop):
+    def check(identifier, limit, algorithm, window=60, cost=1):
+        return loop.run_until_complete(rate_limiter.check_rate_limit(identifier, limit, window, algorithm, cost))
+    return check
+
+def test_burst_admits_exactly_the_limit(backend, clock, algorithm, check):
+    identifier = f"test:{uuid.uuid4()}"
+
+    results = [check(identifier, 3, algorithm) for _ in range(5)]
+
+    assert [allowed for allowed, _, _, _ in results] == [True, True, True, False, False]
+    assert [remaining for _, remaining, _, _ in results] == [2, 1, 0, 0, 0]
+    assert all(limit == 3 for _, _, limit, _ in results)
+    assert all(0 < reset <= 120 for _, _, _, reset in results)
+
+def test_request_succeeds_after_reported_reset(backend, clock, algorithm, check):
+    identifier = f"test:{uuid.uuid4()}"
+    for _ in range(3):
+        check(identifier, 3, algorithm)
+
+    allowed, _, _, reset = check(identifier, 3, algorithm)
+    assert not allowed
+    clock.advance(reset)
+
+    assert check(identifier, 3, algorithm)[0]
+
+def test_full_limit_recovers_after_idle(backend, clock, algorithm, check):
+    identifier = f"test:{uuid.uuid4()}"
+    for _ in range(5):
+        check(identifier, 3, algorithm)
+
+    clock.advance(120)
+
+    results = [check(identifier, 3, algorithm)[0] for _ in range(4)]
+    assert results == [True, True, True, False]
+
+def test_rejected_requests_are_not_counted(backend, clock, loop, check):
+    identifier = f"test:{uuid.uuid4()}"
+    for _ in range(5):
+        check(identifier, 3, "fixed_window")
+
+    if backend is None:
+        count = rate_limiter.in_memory_store.get(f"fixed_window:{identifier}", clock.now)[0]
+    else:
+        count = int(loop.run_until_complete(backend.hget(f"rate_limit:fixed_window:{identifier}", "count")))
+    assert count == 3
+
+def test_cost_is_charged_in_units(backend, clock, algorithm, check):
+    identifier = f"test:{uuid.uuid4()}"
+
+    results = [check(identifier, 10, algorithm, cost=cost) for cost in (4, 4, 3, 2, 1)]
+
+    assert [allowed for allowed, _, _, _ in results] == [True, True, False, True, False]
+    assert [remaining for _, remaining, _, _ in results] == [6, 2, 2, 0, 0]
+
+    # A request costing more than the limit never fits and charges nothing
+    clock.advance(120)
+    assert check(identifier, 10, algorithm, cost=50)[:2] == (False, 10)
+    assert check(identifier, 10, algorithm, cost=10)[:2] == (True, 0)
+
+@pytest.mark.parametrize("algorithm, max_burst", [("fixed_window", 19), ("sliding_window", 10), ("gcra", 10)])
+def test_boundary_burst(backend, clock, algorithm, max_burst, check):
+    # One request opens the window, then the client bursts on either side of the boundary
+    identifier = f"test:{uuid.uuid4()}"
+    assert check(identifier, 10, algorithm)[0]
+    clock.advance(59.9)
+    burst = sum(check(identifier, 10, algorithm)[0] for _ in range(10))
+    clock.advance(0.2)
+    burst += sum(check(identifier, 10, algorithm)[0] for _ in range(10))
+
+    if algorithm == "fixed_window":
+        assert burst == max_burst
+    else:
+        assert burst <= max_burst
+
+def test_memory_and_redis_agree(redis_client, clock, algorithm, monkeypatch, check):
+    identifier = f"test:{uuid.uuid4()}"
+    rng = random.Random(38)
+    steps = [(rng.choice([0, 0, 0, 0.5, 3, 17]), rng.choice([1, 1, 1, 2, 5])) for _ in range(300)]
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+
+    results = {}
+    for name, client in (("memory", None), ("redis", redis_client)):
+        monkeypatch.setattr(rate_limiter, "redis_client", client)
+        monkeypatch.setattr(rate_limiter, "redis_supervisor", RedisSupervisor(client))
+        clock.now = T0 + 1234
+        results[name] = []
+        for step, cost in steps:
+            clock.advance(step)
+            results[name].append(check(identifier, 7, algorithm, window=30, cost=cost))
+
+    assert results["memory"] == results["redis"]
+
+def test_limit_holds_under_contention(backend, clock, algorithm, loop):
+    identifier = f"test:{uuid.uuid4()}"
+    limit, calls = 100, 400
+
+    async def burst():
+        return await asyncio.gather(*(
+            rate_limiter.check_rate_limit(identifier, limit, 60, algorithm) for _ in range(calls)
+        ))
+
+    allowed = [result[0] for result in loop.run_until_complete(burst())]
+
+    assert len(allowed) == calls
+    assert sum(allowed) == limit
+
+class SlowRedis:
+    """Stand-in client whose scripts take a while, like Redis during a latency spike."""
+    def register_script(self, source):
+        async def script(keys, args):
+            await asyncio.sleep(0.2)
+            return [1, 0, 1000]
+        script.registered_client = self
+        return script
+
+def test_slow_redis_does_not_block_the_event_loop(monkeypatch, loop):
+    client = SlowRedis()
+    monkeypatch.setattr(rate_limiter, "redis_client", client)
+    monkeypatch.setattr(rate_limiter, "redis_supervisor", RedisSupervisor(client))
+
+    async def scenario():
+        check = asyncio.create_task(rate_limiter.check_rate_limit("test:slow", 10, 60))
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        other_work = time.perf_counter() - started
+        return await check, other_work
+
+    result, other_work = loop.run_until_complete(scenario())
+    assert result[0] is True
+    assert other_work < 0.1
+
+class FlakyRedis:
+    """Wraps a client and fails with connection errors while down, counting script calls."""
+    def __init__(self, client):
+        self.client = client
+        self.down = False
+        self.calls = 0
+
+    def _check(self):
+        if self.down:
+            import redis
+            raise redis.ConnectionError("Connection refused")
+
+    def register_script(self, source):
+        inner = self.client.register_script(source)
+
+        async def script(keys, args):
+            self.calls += 1
+            self._check()
+            return await inner(keys=keys, args=args)
+        script.registered_client = self
+        return script
+
+    async def ping(self):
+        self._check()
+        return await self.client.ping()
+
+def redis_up_metric():
+    from prometheus_client import REGISTRY
+    return REGISTRY.get_sample_value("toxidapi_redis_up")
+
+def test_outage_opens_circuit_and_reconnects(redis_client, monkeypatch, loop):
+    client = FlakyRedis(redis_client)
+    supervisor = RedisSupervisor(client, failure_threshold=2, min_delay=0.01, max_delay=0.02)
+    monkeypatch.setattr(rate_limiter, "redis_client", client)
+    monkeypatch.setattr(rate_limiter, "redis_supervisor", supervisor)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    identifier = f"test:{uuid.uuid4()}"
+
+    async def scenario():
+        client.down = True
+        during = [await rate_limiter.check_rate_limit(identifier, 10, 60) for _ in range(5)]
+        calls_during, up_during = client.calls, supervisor.up
+        metric_during = redis_up_metric() if PROMETHEUS_AVAILABLE else None
+
+        client.down = False
+        for _ in range(50):
+            if supervisor.up:
+                break
+            await asyncio.sleep(0.01)
+        after = await rate_limiter.check_rate_limit(identifier, 10, 60)
+        await supervisor.stop()
+        return during, calls_during, up_during, metric_during, after
+
+    during, calls_during, up_during, metric_during, after = loop.run_until_complete(scenario())
+
+    # Requests keep being served from memory, and stop hitting Redis once the circuit opens
+    assert all(allowed for allowed, _, _, _ in during)
+    assert calls_during == 2
+    assert not up_during
+    assert supervisor.up
+    assert after[0] and client.calls == 3
+    if PROMETHEUS_AVAILABLE:
+        assert metric_during == 0
+        assert redis_up_metric() == 1
+
+def test_down_at_startup_reconnects_in_background(redis_client, loop):
+    supervisor = RedisSupervisor(redis_client, up=False, min_delay=0.01)
+
+    async def scenario():
+        supervisor.start()
+        for _ in range(50):
+            if supervisor.up:
+                break
+            await asyncio.sleep(0.01)
+        await supervisor.stop()
+
+    loop.run_until_complete(scenario())
+    assert supervisor.up
+
+def test_json_cost(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_COST_PER_ITEM", 1)
+    monkeypatch.setattr(rate_limiter, "RATE_LIMIT_COST_PER_KB", 1)
+    cost = rate_limiter.json_cost
+
+    assert cost({"text": "short"}) == 1
+    assert cost({"text": "x" * 50 * 1024}) == 51
+    assert cost({"texts": ["a", "b", "c", "y" * 2048]}) == 6
+    assert cost({"texts": []}) == 1
+    assert cost(["not", "an", "object"]) == 1
+    assert rate_limiter.is_json("application/json; charset=utf-8")
+    assert not rate_limiter.is_json("application/x-ndjson")
@@ -0,0 +1,104 @@
+import json
+from types import SimpleNamespace
+from typing import List, Optional
+
+import pytest
+from pydantic import BaseModel, Field
+
+from app.models import gemini_analyzer
+from app.models.response_schema import ANALYSIS_DESCRIPTION, analysis_response_schema, gemini_schema_for
+
+class Score(BaseModel):
+    value: float = Field(0.5, ge=0.0, le=1.0, title="Value", description="A bounded score")
+    label: Optional[str] = Field(None, description="Label")
+
+class Report(BaseModel):
+    overall: Score
+    parts: List[Score] = Field(default_factory=list)
+
+def walk(schema):
+    yield schema
+    for prop in schema.get("properties", {}).values():
+        yield from walk(prop)
+    if "items" in schema:
+        yield from walk(schema["items"])
+
+def test_refs_are_inlined_and_unsupported_keywords_dropped():
+    schema = gemini_schema_for(Report)
+
+    assert "$ref" not in json.dumps(schema) and "$defs" not in schema
+    allowed = {"type", "format", "description", "nullable", "enum", "items", "properties", "required"}
+    assert all(set(node) <= allowed for node in walk(schema))
+    overall = schema["properties"]["overall"]
+    assert overall["properties"]["value"] == {"type": "number", "description": "A bounded score"}
+    assert schema["properties"]["parts"]["items"]["properties"] == overall["properties"]
+    # Every property is requested, including ones with defaults
+    assert overall["required"] == ["value", "label"]
+    assert schema["required"] == ["overall", "parts"]
+
+def test_analysis_schema_maps_constrained_fields():
+    schema = analysis_response_schema()
+    properties = schema["properties"]
+
+    # The model sees a description written for it, not the developer docstring
+    assert schema["description"] == ANALYSIS_DESCRIPTION
+
+    assert properties["toxicity"]["properties"]["score"]["type"] == "number"
+    assert properties["readability"]["properties"]["grade_level"]["type"] == "integer"
+    label = properties["sentiment"]["properties"]["label"]
+    assert (label["type"], label["format"], label["enum"]) == ("string", "enum", ["POSITIVE", "NEGATIVE", "NEUTRAL"])
+    assert properties["profanity"]["properties"]["severity"]["enum"] == ["NONE", "LOW", "MEDIUM", "HIGH"]
+    categories = properties["flagged_words"]["properties"]["categories"]
+    assert set(categories["properties"]) == {"profanity", "insults", "slurs", "other"}
+    assert categories["properties"]["slurs"] == {"type": "array", "items": {"type": "string"}}
+    assert all("minimum" not in node and "additionalProperties" not in node for node in walk(schema))
+
+class FakeModel:
+    """Records how GenerativeModel was configured and answers with a canned reply."""
+    instances = []
+
+    def __init__(self, name, generation_config=None, safety_settings=None):
+        self.generation_config = generation_config
+        self.prompts = []
+        self.reply = "{}"
+        FakeModel.instances.append(self)
+
+    def generate_content(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        usage = SimpleNamespace(prompt_token_count=12, candidates_token_count=34)
+        return SimpleNamespace(text=self.reply, usage_metadata=usage)
+
+@pytest.fixture
+def fake_genai(monkeypatch):
+    FakeModel.instances = []
+    monkeypatch.setattr(gemini_analyzer.genai, "configure", lambda **kwargs: None)
+    monkeypatch.setattr(gemini_analyzer.genai, "GenerativeModel", FakeModel)
+
+def test_structured_output_sends_the_schema_and_parses_the_reply(fake_genai):
+    analyzer = gemini_analyzer.GeminiAnalyzer("test-key", structured_output=True)
+    model = FakeModel.instances[-1]
+    model.reply = json.dumps({
+        "toxicity": {"score": 0.8, "is_toxic": True, "detailed_scores": {"insult": 0.9}},
+        "sentiment": {"score": -0.6, "label": "NEGATIVE"},
+    })
+
+    result = analyzer.analyze("you idiot")
+
+    assert model.generation_config["response_mime_type"] == "application/json"
+    assert model.generation_config["response_schema"] == analysis_response_schema()
+    assert model.prompts == [gemini_analyzer.STRUCTURED_PROMPT_TEMPLATE.format(text="you idiot")]
+    assert result["toxicity"]["score"] == 0.8
+    assert result["toxicity"]["detailed_scores"]["insult"] == 0.9
+    assert result["sentiment"]["label"] == "NEGATIVE"
+
+def test_structured_output_rejects_non_object_replies(fake_genai):
+    analyzer = gemini_analyzer.GeminiAnalyzer("test-key", structured_output=True)
+    FakeModel.instances[-1].reply = '["not", "an", "object"]'
+
+    assert analyzer.analyze("text") == analyzer._get_default_response()
+
+def test_prompt_mode_sends_no_schema(fake_genai):
+    gemini_analyzer.GeminiAnalyzer("test-key", structured_output=False)
+
+    config = FakeModel.instances[-1].generation_config
+    assert "response_schema" not in config and "response_mime_type" not in config
@@ -0,0 +1,64 @@
+import pytest
+
+from app.models.result_normalizer import normalize_result, default_result
+
+def test_empty_input_gets_defaults():
+    assert normalize_result({}) == default_result()
+    assert default_result()["readability"]["grade_level"] == 8
+
+def test_scores_are_clamped():
+    result = normalize_result({
+        "toxicity": {"score": 1.7, "detailed_scores": {"insult": -0.2}},
+        "sentiment": {"score": -3},
+        "readability": {"grade_level": 40},
+        "flagged_words": {"count": -2},
+    })
+    assert result["toxicity"]["score"] == 1.0
+    assert result["toxicity"]["detailed_scores"]["insult"] == 0.0
+    assert result["sentiment"]["score"] == -1.0
+    assert result["readability"]["grade_level"] == 12
+    assert result["flagged_words"]["count"] == 0
+
+def test_numeric_strings_are_coerced():
+    result = normalize_result({"toxicity": {"score": "0.25"}})
+    assert result["toxicity"]["score"] == 0.25
+
+def test_null_values_fall_back_to_defaults():
+    result = normalize_result({
+        "toxicity": {"score": 0.6, "is_toxic": None, "detailed_scores": {"insult": None, "threat": 0.2}},
+        "sentiment": None,
+        "readability": {"grade_level": None, "score": 0.9},
+        "flagged_words": {"count": None, "words": ["x", None], "categories": {"slurs": None}},
+    })
+    defaults = default_result()
+    assert result["toxicity"]["score"] == 0.6
+    assert result["toxicity"]["is_toxic"] is True
+    assert result["toxicity"]["detailed_scores"]["insult"] == 0.0
+    assert result["toxicity"]["detailed_scores"]["threat"] == 0.2
+    assert result["sentiment"] == defaults["sentiment"]
+    assert result["readability"]["grade_level"] == defaults["readability"]["grade_level"]
+    assert result["readability"]["score"] == 0.9
+    assert result["flagged_words"]["count"] == 0
+    assert result["flagged_words"]["words"] == ["x"]
+    assert result["flagged_words"]["categories"] == {}
+
+def test_derived_flags():
+    result = normalize_result({
+        "toxicity": {"score": 0.0, "detailed_scores": {"threat": 0.6}},
+        "profanity": {"score": 0.5},
+        "sensitivity": {"categories": {"religious": 0.7}},
+        "flagged_words": {"count": 1, "words": ["x"]},
+    })
+    assert result["toxicity"]["is_toxic"] is True
+    assert result["profanity"]["is_profane"] is True
+    assert result["profanity"]["severity"] == "MEDIUM"
+    assert result["sensitivity"]["is_sensitive"] is True
+    # Flagged words with no severity inherit it; a zero toxicity score is raised
+    assert result["flagged_words"]["severity_score"] == 0.5
+    assert result["toxicity"]["score"] == 0.7
+
+def test_wrong_types_raise_value_error():
+    with pytest.raises(ValueError):
+        normalize_result({"toxicity": {"score": "high"}})
+    with pytest.raises(ValueError):
+        normalize_result({"flagged_words": {"words": "idiot"}})
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from conftest import RecordingAnalyzer
+from app.api import analysis, streaming
+
+def setup_function():
+    analysis.analyzer = RecordingAnalyzer()
+    analysis.result_cache.clear()
+
+def run(chunks, **kwargs):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [json.loads(line) async for line in streaming.stream_analysis(source(), **kwargs)]
+
+    return sorted(asyncio.run(collect()), key=lambda line: line["index"])
+
+def test_lines_split_across_chunks_are_analyzed():
+    lines = run([b'"hello"\n{"te', b'xt": "you idiot"}\n\n"bo', b'om"\nnot json\n[1]'])
+
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    assert [line["status"] for line in lines] == ["ok", "ok", "error", "error", "error"]
+    assert lines[1]["text"] == "you idiot" and lines[1]["toxicity"]["is_toxic"]
+    assert lines[2]["error"]["code"] == "ANALYSIS_FAILED"
+    assert lines[3]["error"]["code"] == "INVALID_ITEM"
+    assert lines[4]["error"]["code"] == "INVALID_ITEM"
+
+def test_item_limit_stops_the_stream():
+    lines = run([b'"a"\n"b"\n"c"\n"d"\n'], max_items=2)
+
+    assert [line["status"] for line in lines] == ["ok", "ok", "error"]
+    assert lines[2]["error"]["code"] == "LIMIT_EXCEEDED"
+
+def test_oversized_lines_are_rejected():
+    async def collect():
+        async def source():
+            yield b'"short"\n"' + b"x" * 50
+            yield b"x" * 50 + b'"\n"after"\n'
+        return [line async for line in streaming.iter_lines(source(), max_line_bytes=20)]
+
+    assert asyncio.run(collect()) == [b'"short"', None, b'"after"']
@@ -0,0 +1,229 @@
+import asyncio
+import json
+from datetime import date, datetime
+
+import httpx
+import pytest
+
+from conftest import make_key
+from app.api import rate_limiter, usage
+from app.api.redis_supervisor import RedisSupervisor
+from app.core.local_store import ExpiringStore
+from app.main import app, usage_meter
+from app.models.database import session_scope, DBUsage
+
+NOW = datetime(2024, 2, 29, 23, 0, 0)
+
+def stored(user_id):
+    with session_scope() as db:
+        return {
+            (row.period, row.period_start): (row.units, row.requests)
+            for row in db.query(DBUsage).filter(DBUsage.user_id == user_id)
+        }
+
+def test_counts_are_flushed_in_bulk_and_accumulate():
+    meter = usage.UsageMeter()
+    user_id = make_key().user_id
+
+    async def scenario():
+        await meter.record(user_id, 3, NOW)
+        await meter.record(user_id, 2, NOW)
+        before = await meter.usage(user_id, NOW)
+        first = await meter.flush()
+        await meter.record(user_id, 4, NOW)
+        # Rows are added to, not overwritten
+        await meter.flush()
+        after = await meter.usage(user_id, NOW)
+        return before, first, after
+
+    before, first, after = asyncio.run(scenario())
+    assert before == {"day": 5, "month": 5}
+    assert first == 2
+    assert after == {"day": 9, "month": 9}
+    assert stored(user_id) == {("day", date(2024, 2, 29)): (9, 3), ("month", date(2024, 2, 1)): (9, 3)}
+
+def test_quota_picks_the_period_that_binds(monkeypatch):
+    monkeypatch.setattr(usage, "QUOTA_DAILY", 10)
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 12)
+    monkeypatch.setattr(usage, "PRO_QUOTA_MONTHLY", 0)
+    meter = usage.UsageMeter()
+    user_id = make_key().user_id
+
+    async def scenario():
+        await meter.record(user_id, 8, NOW)
+        fits = await meter.reserve(user_id, "free", 2, NOW)
+        over = await meter.reserve(user_id, "free", 1, NOW)
+        unlimited = await meter.reserve(user_id, "pro", 1, NOW)
+        return fits, over, unlimited, await meter.usage(user_id, NOW)
+
+    fits, over, unlimited, used = asyncio.run(scenario())
+    assert (fits.allowed, fits.period, fits.remaining) == (True, "day", 0)
+    # Both are used up past what the request needs; retry once the month rolls over
+    assert (over.allowed, over.period, over.reset) == (False, "day", 3600)
+    assert unlimited is None
+    # Rejected requests are not counted; requests without quotas are
+    assert used == {"day": 11, "month": 11}
+
+def test_requests_larger_than_what_is_left_are_rejected(monkeypatch):
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 10)
+    meter = usage.UsageMeter()
+    user_id = make_key().user_id
+
+    async def scenario():
+        too_large = await meter.reserve(user_id, "free", 11, NOW)
+        await meter.reserve(user_id, "free", 8, NOW)
+        over = await meter.reserve(user_id, "free", 5, NOW)
+        return too_large, over, await meter.usage(user_id, NOW)
+
+    too_large, over, used = asyncio.run(scenario())
+    assert not too_large.allowed and not over.allowed
+    assert over.remaining == 2
+    assert used["month"] == 8
+
+@pytest.fixture(params=["memory", "redis"])
+def meter(request):
+    if request.param == "memory":
+        return usage.UsageMeter()
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis()
+    return usage.UsageMeter(client, RedisSupervisor(client))
+
+def test_concurrent_reservations_cannot_overshoot(meter, monkeypatch):
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 10)
+    user_id = make_key().user_id
+    # Redis counters expire after their period, so use the real date
+    now = datetime.utcnow()
+
+    async def scenario():
+        results = await asyncio.gather(*(meter.reserve(user_id, "free", 1, now) for _ in range(25)))
+        return results, await meter.usage(user_id, now)
+
+    results, used = asyncio.run(scenario())
+    assert sum(result.allowed for result in results) == 10
+    assert used["month"] == 10
+
+def test_refunds_give_back_units_and_requests(meter, monkeypatch):
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 10)
+    user_id = make_key().user_id
+    now = datetime.utcnow()
+
+    async def scenario():
+        await meter.reserve(user_id, "free", 4, now)
+        await meter.reserve(user_id, "free", 6, now)
+        await meter.refund(user_id, 6, now)
+        retry = await meter.reserve(user_id, "free", 6, now)
+        await meter.refund(user_id, 6, now)
+        await meter.flush()
+        return retry, await meter.usage(user_id, now)
+
+    retry, used = asyncio.run(scenario())
+    assert retry.allowed
+    assert used["month"] == 4
+    assert stored(user_id)[("month", now.date().replace(day=1))] == (4, 1)
+
+def test_redis_counters_start_from_the_table():
+    fakeredis = pytest.importorskip("fakeredis")
+    user_id = make_key().user_id
+    memory = usage.UsageMeter()
+    # Redis counters expire after their period, so use the real date
+    now = datetime.utcnow()
+
+    async def scenario():
+        client = fakeredis.FakeAsyncRedis()
+        meter = usage.UsageMeter(client, RedisSupervisor(client))
+        await memory.record(user_id, 7, now)
+        await memory.flush()
+        seeded = await meter.usage(user_id, now)
+        await meter.record(user_id, 1, now)
+        counted = await meter.usage(user_id, now)
+        # Counters live in Redis; the table only changes when this process flushes
+        table = await usage.UsageMeter().usage(user_id, now)
+        await meter.flush()
+        return seeded, counted, table
+
+    seeded, counted, table = asyncio.run(scenario())
+    assert seeded == {"day": 7, "month": 7}
+    assert counted == {"day": 8, "month": 8}
+    assert table == {"day": 7, "month": 7}
+    assert stored(user_id)[("month", now.date().replace(day=1))] == (8, 2)
+
+def test_monthly_quota_is_enforced_before_analysis(analyzer, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(usage_meter, "client", None)
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 3)
+    user_id, _, key = make_key()
+    headers = {"X-API-Key": key}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = [
+                await client.post("/api/v2/analyze/batch", json={"texts": ["a", "b"]}, headers=headers),
+                await client.post("/api/v2/analyze", json={"text": "c"}, headers=headers),
+                await client.post("/api/v2/analyze", json={"text": "d"}, headers=headers),
+            ]
+            await usage_meter.flush()
+            report = await client.get("/api/v2/usage", headers=headers)
+            return responses, report
+
+    responses, report = asyncio.run(scenario())
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert [r.headers["x-quota-remaining"] for r in responses] == ["1", "0", "0"]
+    assert responses[2].json()["detail"]["code"] == "QUOTA_EXCEEDED"
+    assert int(responses[2].headers["retry-after"]) == int(responses[2].headers["x-quota-reset"]) > 0
+    assert sorted(analyzer.calls) == ["a", "b", "c"]
+
+    assert report.status_code == 200
+    body = report.json()
+    assert body["quotas"] == {"day": 0, "month": 3}
+    assert [(row["units"], row["requests"]) for row in body["months"]] == [(3, 2)]
+
+def test_failed_requests_give_their_units_back(analyzer, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(usage_meter, "client", None)
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 3)
+    user_id, _, key = make_key()
+    headers = {"X-API-Key": key}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                await client.post("/api/v2/analyze", json={"txt": "a"}, headers=headers),
+                await client.post("/api/v2/analyze/batch", json={"texts": ["a", "b", "c"]}, headers=headers),
+            ]
+
+    responses = asyncio.run(scenario())
+
+    assert [r.status_code for r in responses] == [422, 200]
+    assert responses[1].headers["x-quota-remaining"] == "0"
+
+def test_stream_and_upload_texts_are_metered(analyzer, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(usage_meter, "client", None)
+    monkeypatch.setattr(usage, "QUOTA_MONTHLY", 5)
+    user_id, _, key = make_key()
+    headers = {"X-API-Key": key}
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            upload = await client.post("/api/v2/jobs/upload", headers=headers,
+                                       files={"file": ("texts.txt", b"a\nb\nc\nd\ne\nf\n")})
+            stream = await client.post("/api/v2/analyze/stream", headers={**headers, "Content-Type": "application/x-ndjson"},
+                                       content=b"".join(f'"text {i}"\n'.encode() for i in range(8)))
+            return upload, stream, await usage_meter.usage(user_id)
+
+    upload, stream, used = asyncio.run(scenario())
+
+    assert upload.status_code == 429
+    assert upload.json()["detail"]["code"] == "QUOTA_EXCEEDED"
+    lines = sorted((json.loads(line) for line in stream.text.splitlines()), key=lambda line: line["index"])
+    assert [line["status"] for line in lines] == ["ok"] * 5 + ["error"]
+    assert lines[5]["error"]["code"] == "QUOTA_EXCEEDED"
+    # The rejected upload gave back what it was charged up front
+    assert used["month"] == 5
@@ -0,0 +1,97 @@
+import asyncio
+import uuid
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from conftest import make_key
+from app.api import rate_limiter, usage_events
+from app.core.local_store import ExpiringStore
+from app.main import app, usage_event_log
+from app.models.database import session_scope, DBUsageEvent
+
+def event(api_key_id):
+    return {"api_key_id": api_key_id, "endpoint": "/api/v2/analyze", "method": "POST", "status": 200,
+            "items": 1, "cache": None, "latency_ms": 1.0, "prompt_tokens": 0, "output_tokens": 0}
+
+def stored(api_key_id):
+    with session_scope() as db:
+        return db.query(DBUsageEvent).filter(DBUsageEvent.api_key_id == api_key_id).order_by(DBUsageEvent.id).all()
+
+def test_full_queue_drops_new_events():
+    key_id = str(uuid.uuid4())
+    log = usage_events.UsageEventLog(max_size=2)
+
+    accepted = [log.enqueue(event(key_id)) for _ in range(3)]
+    written = asyncio.run(log.flush())
+
+    assert accepted == [True, True, False]
+    assert written == 2
+    assert len(stored(key_id)) == 2
+
+def test_writer_flushes_full_batches_and_on_a_timer():
+    key_id = str(uuid.uuid4())
+    log = usage_events.UsageEventLog(batch_size=3, flush_ms=200)
+
+    async def scenario():
+        log.start()
+        for _ in range(3):
+            log.enqueue(event(key_id))
+        # A full batch is written without waiting for the timer
+        await asyncio.sleep(0.1)
+        after_batch = len(stored(key_id))
+        log.enqueue(event(key_id))
+        await asyncio.sleep(0.05)
+        before_timer = len(stored(key_id))
+        await asyncio.sleep(0.3)
+        after_timer = len(stored(key_id))
+        await log.stop()
+        return after_batch, before_timer, after_timer
+
+    assert asyncio.run(scenario()) == (3, 3, 4)
+
+def test_request_usage_is_tracked_across_tasks_and_threads():
+    async def scenario():
+        token = usage_events.begin_request()
+        usage_events.track_items(2)
+        await asyncio.gather(
+            run_in_threadpool(usage_events.track_tokens, 10, 4),
+            run_in_threadpool(usage_events.track_tokens, 6, 2),
+            asyncio.create_task(asyncio.to_thread(usage_events.track_cache, True)),
+        )
+        usage_events.track_cache(False)
+        return usage_events.end_request(token)
+
+    usage = asyncio.run(scenario())
+    assert (usage.items, usage.prompt_tokens, usage.output_tokens, usage.cache) == (2, 16, 6, "mixed")
+    # Outside of a request, tracking does nothing
+    usage_events.track_items(1)
+
+def test_api_requests_are_logged(analyzer, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "redis_client", None)
+    monkeypatch.setattr(rate_limiter, "in_memory_store", ExpiringStore(1000))
+    monkeypatch.setattr(rate_limiter, "DEFAULT_RATE_LIMIT", 4)
+    _, key_id, key = make_key()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app, client=(f"10.1.0.{uuid.uuid4().int % 250}", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers={"X-API-Key": key}) as client:
+            statuses = [
+                (await client.post("/api/v2/analyze", json={"text": "logged"})).status_code,
+                (await client.post("/api/v2/analyze/batch", json={"texts": ["logged", "fresh"]})).status_code,
+                (await client.get(f"/api/v2/jobs/{uuid.uuid4()}")).status_code,
+                # Over the rate limit of 4 units
+                (await client.post("/api/v2/analyze", json={"text": "rejected"})).status_code,
+            ]
+        await usage_event_log.flush()
+        return statuses
+
+    assert asyncio.run(scenario()) == [200, 200, 404, 429]
+    events = [(e.endpoint, e.method, e.status, e.items, e.cache) for e in stored(key_id)]
+    assert events == [
+        ("/api/v2/analyze", "POST", 200, 1, "miss"),
+        ("/api/v2/analyze/batch", "POST", 200, 2, "mixed"),
+        ("/api/v2/jobs/{job_id}", "GET", 404, 0, None),
+        ("/api/v2/analyze", "POST", 429, 0, None),
+    ]
+    assert all(e.latency_ms > 0 for e in stored(key_id))